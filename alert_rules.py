@@ -0,0 +1,179 @@
+"""Declarative alert rules evaluated against each incoming metrics sample.
+
+A rule is a plain dict:
+
+    {'name': 'high_cpu', 'type': 'threshold', 'metric': 'cpu_percent',
+     'op': '>', 'value': 80, 'severity': 'WARNING'}
+
+Types:
+    threshold   fires when the metric crosses value
+    rate        fires when the change per minute crosses value
+    sustained   fires when the metric has crossed value for `samples` samples in a row
+    hysteresis  fires when the metric crosses value and re-arms only once it
+                crosses back over `clear`
+
+Rules are compiled once. Each sample costs one comparison per rule against
+that rule's per-host state. Alerts are edge-triggered: a rule fires once
+when it becomes active and stays quiet until it clears. A rule that fires
+again within `cooldown` seconds is suppressed.
+"""
+import operator
+import threading
+import time
+from collections import deque
+
+OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+RULE_TYPES = ('threshold', 'rate', 'sustained', 'hysteresis')
+DEFAULT_COOLDOWN = 300
+LATENCY_WINDOW = 4096
+
+DEFAULT_RULES = [
+    {'name': 'high_cpu', 'type': 'threshold', 'metric': 'cpu_percent', 'op': '>', 'value': 80,
+     'severity': 'WARNING', 'message': 'High CPU usage detected: {value:.1f}%'},
+    {'name': 'sustained_cpu', 'type': 'sustained', 'metric': 'cpu_percent', 'op': '>', 'value': 90,
+     'samples': 3, 'severity': 'CRITICAL',
+     'message': 'CPU above {threshold:g}% for {samples} samples: {value:.1f}%'},
+    {'name': 'critical_memory', 'type': 'threshold', 'metric': 'memory_percent', 'op': '>', 'value': 90,
+     'severity': 'CRITICAL', 'message': 'Critical memory usage: {value:.1f}%'},
+    {'name': 'disk_filling', 'type': 'rate', 'metric': 'disk_percent', 'op': '>', 'value': 1.0,
+     'severity': 'WARNING', 'message': 'Disk usage growing {value:.2f}% per minute'},
+    {'name': 'hot_cpu', 'type': 'hysteresis', 'metric': 'temperature', 'op': '>', 'value': 75,
+     'clear': 70, 'severity': 'WARNING', 'message': 'Temperature high: {value:.1f}C'},
+]
+
+
+class Rule:
+    """One compiled rule; state lives in the engine, keyed by host"""
+
+    def __init__(self, definition):
+        self.name = definition['name']
+        self.type = definition['type']
+        if self.type not in RULE_TYPES:
+            raise ValueError(f"Rule {self.name}: unknown type {self.type!r}")
+        self.metric = definition['metric']
+        self.op = definition.get('op', '>')
+        if self.op not in OPERATORS:
+            raise ValueError(f"Rule {self.name}: unknown operator {self.op!r}")
+        self.compare = OPERATORS[self.op]
+        self.threshold = float(definition['value'])
+        self.severity = definition.get('severity', 'WARNING')
+        self.samples = int(definition.get('samples', 1))
+        self.cooldown = definition.get('cooldown', DEFAULT_COOLDOWN)
+        self.message = definition.get('message', '{metric} {op} {threshold:g}: {value:g}')
+        if self.type == 'hysteresis':
+            self.clear = float(definition['clear'])
+            # Clearing means crossing back the other way, past the clear level
+            self.cleared = OPERATORS['<=' if self.op in ('>', '>=') else '>=']
+
+    def check(self, state, value, ts):
+        """Update state with one value; return the value to report if the rule fires"""
+        if self.type == 'rate':
+            previous = state.get('previous')
+            state['previous'] = (ts, value)
+            if previous is None or ts <= previous[0]:
+                return None
+            value = (value - previous[1]) / (ts - previous[0]) * 60
+            breached = self.compare(value, self.threshold)
+        elif self.type == 'sustained':
+            state['run'] = state.get('run', 0) + 1 if self.compare(value, self.threshold) else 0
+            breached = state['run'] >= self.samples
+        elif self.type == 'hysteresis':
+            if state.get('active'):
+                breached = not self.cleared(value, self.clear)
+            else:
+                breached = self.compare(value, self.threshold)
+        else:
+            breached = self.compare(value, self.threshold)
+
+        was_active = state.get('active', False)
+        state['active'] = breached
+        if breached and not was_active:
+            return value
+        return None
+
+    def format(self, value):
+        return self.message.format(value=value, threshold=self.threshold, metric=self.metric,
+                                   op=self.op, samples=self.samples)
+
+
+def compile_rules(definitions):
+    """Validate rule dicts and return Rule objects"""
+    rules = [Rule(definition) for definition in definitions]
+    names = [rule.name for rule in rules]
+    if len(names) != len(set(names)):
+        raise ValueError('Rule names must be unique')
+    return rules
+
+
+class RuleEngine:
+    """Evaluates compiled rules incrementally, one sample at a time"""
+
+    def __init__(self, definitions=None):
+        self.rules = compile_rules(DEFAULT_RULES if definitions is None else definitions)
+        self._state = {}  # (rule name, hostname) -> dict
+        self._last_fired = {}  # (rule name, hostname) -> ts
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.evaluations = 0
+        self.fired = 0
+        self.suppressed = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def evaluate(self, sample):
+        """Return alert dicts (add_alert keyword arguments) fired by one sample"""
+        started = time.perf_counter_ns()
+        hostname = sample.get('hostname')
+        ts = sample.get('ts') or int(time.time())
+        alerts = []
+        with self._lock:
+            for rule in self.rules:
+                value = sample.get(rule.metric)
+                if value is None:
+                    continue
+                key = (rule.name, hostname)
+                state = self._state.get(key)
+                if state is None:
+                    state = self._state[key] = {}
+                reported = rule.check(state, value, ts)
+                if reported is None:
+                    continue
+                last = self._last_fired.get(key)
+                if last is not None and ts - last < rule.cooldown:
+                    self.suppressed += 1
+                    continue
+                self._last_fired[key] = ts
+                self.fired += 1
+                # reported is what the threshold is compared with: the rate for rate rules
+                alerts.append({
+                    'severity': rule.severity, 'metric': rule.metric, 'value': reported,
+                    'threshold': rule.threshold, 'message': rule.format(reported),
+                    'ts': ts, 'hostname': hostname,
+                })
+            elapsed = time.perf_counter_ns() - started
+            self.evaluations += 1
+            self.total_ns += elapsed
+            self.max_ns = max(self.max_ns, elapsed)
+            self._latencies.append(elapsed)
+        return alerts
+
+    def stats(self):
+        """Counters and evaluation latency in microseconds"""
+        with self._lock:
+            recent = sorted(self._latencies)
+            result = {
+                'rules': [{'name': rule.name, 'type': rule.type, 'metric': rule.metric}
+                          for rule in self.rules],
+                'evaluations': self.evaluations,
+                'fired': self.fired,
+                'suppressed': self.suppressed,
+                'tracked_series': len(self._state),
+            }
+        if recent:
+            result['latency_us'] = {
+                'mean': round(self.total_ns / self.evaluations / 1000, 2),
+                'p50': round(recent[len(recent) // 2] / 1000, 2),
+                'p99': round(recent[max(int(len(recent) * 0.99) - 1, 0)] / 1000, 2),
+                'max': round(self.max_ns / 1000, 2),
+            }
+        return result
@@ -1,59 +1,327 @@
-from flask import Flask, render_template_string, jsonify, request
+from flask import Flask, Response, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
 import sqlite3
 import datetime
 import json
+import math
+import time
+import base64
+import hashlib
+import zlib
+import threading
+import queue
+import heapq
+import itertools
+import archive
+import schema
+import rollup
+import metric_stats
+import perf
+from alert_rules import RuleEngine
+from db_pool import ConnectionPool
+from broadcaster import MetricsBroadcaster
+from ingest import BufferFull, IngestWriter, format_ts
 
 app = Flask(__name__)
 DATABASE = 'monitoring.db'
+DB_POOL_SIZE = 8
+DB_BUSY_TIMEOUT_MS = 5000
+CHART_POINTS = 50
+STREAM_FETCH_ROWS = 500
+SSE_KEEPALIVE_SECONDS = 15
+SNAPSHOT_MAX_HOSTS = 256
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+MAX_SAMPLE_SKEW = 86400  # seconds a pushed sample's ts may run ahead of the server clock
+ARCHIVE_DIR = 'archive'
+HISTORICAL_COLUMNS = ('timestamp', 'ts', 'hostname', 'cpu_percent', 'memory_percent',
+                      'disk_percent', 'temperature')
+STREAM_COLUMNS = ('id',) + HISTORICAL_COLUMNS
+AVERAGE_COLUMNS = ('cpu_percent', 'memory_percent', 'disk_percent', 'temperature')
+PERF_SLOW_REQUEST_MS = 500
+PERF_PROFILE_RATE = 0.0  # fraction of requests run under cProfile
+
+db_pool = ConnectionPool(DATABASE, size=DB_POOL_SIZE, busy_timeout_ms=DB_BUSY_TIMEOUT_MS,
+                         factory=perf.TimedConnection)
+perf.install(app, slow_ms=PERF_SLOW_REQUEST_MS, profile_rate=PERF_PROFILE_RATE)
+# Bodies over this are refused with 413 before they are read; read_batch_body() caps the inflated size
+app.config['MAX_CONTENT_LENGTH'] = MAX_BATCH_BYTES
+broadcaster = MetricsBroadcaster(DATABASE)
+stats_cache = metric_stats.StatsCache()
+archive_reader = archive.ArchiveReader(ARCHIVE_DIR)
 
 def get_db_connection():
-    """Create a database connection"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Borrow a pooled database connection (use as a context manager)"""
+    return db_pool.connection()
+
+def window_start(hours):
+    """Epoch second at which a window of the given hours begins"""
+    return int(time.time() - hours * 3600)
+
+def host_filter(host, keyword='AND'):
+    """SQL condition limiting rows to one host, and its parameters"""
+    if host is None:
+        return '', ()
+    return f' {keyword} hostname = ?', (host,)
 
-def get_latest_metrics():
+def archived_filter(partitions):
+    """SQL condition leaving out live rows already in one of the archive partitions, and its parameters"""
+    # A day's rows sit in both places while archive.py deletes them after writing the file
+    condition, params = '', ()
+    for partition in partitions:
+        condition += ' AND NOT (ts >= ? AND ts < ? AND id <= ?)'
+        params += (partition.day_start, partition.day_start + archive.DAY, partition.max_id)
+    return condition, params
+
+def get_latest_metrics(host=None):
     """Get the most recent metrics from the database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM system_metrics 
-        ORDER BY timestamp DESC 
-        LIMIT 1
-    ''')
-    result = cursor.fetchone()
-    conn.close()
-    return result
-
-def get_historical_metrics(hours=24):
-    """Get historical metrics for charts"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT timestamp, cpu_percent, memory_percent, disk_percent, temperature
-        FROM system_metrics 
-        WHERE timestamp >= datetime('now', '-' || ? || ' hours')
-        ORDER BY timestamp ASC
-    ''', (hours,))
-    results = cursor.fetchall()
-    conn.close()
-    return results
-
-def get_recent_alerts(limit=10):
-    """Get recent alerts"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM alerts 
-        ORDER BY timestamp DESC 
+    condition, params = host_filter(host, 'WHERE')
+    with get_db_connection() as conn:
+        cursor = conn.execute(f'''
+            SELECT * FROM system_metrics{condition}
+            ORDER BY ts DESC 
+            LIMIT 1
+        ''', params)
+        return cursor.fetchone()
+
+def get_historical_metrics(hours=24, resolution=None, max_points=None, host=None):
+    """Get historical metrics for charts.
+
+    resolution picks a rollup tier ('1m', '5m', '1h') or 'raw'; max_points
+    returns raw rows if they fit and otherwise the best fitting rollup. Raw
+    rows include archived days.
+    """
+    start = window_start(hours)
+    now = int(time.time())
+    condition, params = host_filter(host)
+    # One snapshot of the archive for both halves, so no row is counted twice
+    partitions = archive_reader.partitions(start, now + 1)
+    archived_condition, archived_params = archived_filter(partitions)
+    condition, params = condition + archived_condition, params + archived_params
+    with get_db_connection() as conn:
+        if resolution in rollup.TIERS_BY_NAME:
+            return rollup.query(conn, start, now, resolution=resolution, hostname=host)
+        if resolution is None and max_points:
+            cursor = conn.execute(f'''
+                SELECT COUNT(*) FROM system_metrics WHERE ts >= ?{condition}
+            ''', (start,) + params)
+            archived_count = archive_reader.count(start, now + 1, host, partitions)
+            if cursor.fetchone()[0] + archived_count > max_points:
+                return rollup.query(conn, start, now, max_points=max_points, hostname=host)
+        cursor = conn.execute(f'''
+            SELECT {', '.join(HISTORICAL_COLUMNS)}
+            FROM system_metrics 
+            WHERE ts >= ?{condition}
+            ORDER BY ts ASC
+        ''', (start,) + params)
+        rows = cursor.fetchall()
+    archived = list(archive_reader.rows(start, now + 1, HISTORICAL_COLUMNS, host, partitions=partitions))
+    if not archived:
+        return rows
+    if not rows or archived[-1]['ts'] <= rows[0]['ts']:
+        return archived + rows
+    # Late rows for an archived day are still in the live table
+    return list(heapq.merge(archived, rows, key=lambda row: row['ts']))
+
+def encode_cursor(ts, row_id):
+    """Opaque pagination token for the row after (ts, id)"""
+    return base64.urlsafe_b64encode(f"{ts}:{row_id}".encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Inverse of encode_cursor(); raises ValueError on a malformed token"""
+    padded = token + '=' * (-len(token) % 4)
+    ts, row_id = base64.urlsafe_b64decode(padded.encode()).decode().split(':')
+    return int(ts), int(row_id)
+
+def next_page_cursor(conn, start, after, limit, host=None):
+    """Cursor for the page after this one, or None if this is the last page"""
+    condition, params = host_filter(host)
+    now = int(time.time())
+    partitions = archive_reader.partitions(max(start, after[0]), now + 1)
+    if partitions:
+        # The page may span archived and live rows; merge the keys of both
+        archived_condition, archived_params = archived_filter(partitions)
+        cursor = conn.execute(f'''
+            SELECT ts, id FROM system_metrics
+            WHERE ts >= ? AND (ts, id) > (?, ?){condition}{archived_condition}
+            ORDER BY ts ASC, id ASC
+            LIMIT ?
+        ''', (start, after[0], after[1]) + params + archived_params + (limit + 1,))
+        live = [tuple(row) for row in cursor.fetchall()]
+        keys = list(itertools.islice(
+            heapq.merge(archive_reader.keys(start, now + 1, host, after, partitions), live), limit + 1))
+        return encode_cursor(*keys[limit - 1]) if len(keys) > limit else None
+
+    cursor = conn.execute(f'''
+        SELECT ts, id FROM system_metrics
+        WHERE ts >= ? AND (ts, id) > (?, ?){condition}
+        ORDER BY ts ASC, id ASC
+        LIMIT 2 OFFSET ?
+    ''', (start, after[0], after[1]) + params + (limit - 1,))
+    rows = cursor.fetchall()
+    if len(rows) < 2:
+        return None
+    return encode_cursor(rows[0]['ts'], rows[0]['id'])
+
+def iter_live_rows(start, after=(-1, -1), limit=None, host=None, partitions=()):
+    """Yield raw database rows in (ts, id) order, STREAM_FETCH_ROWS at a time, skipping rows in partitions.
+
+    Each page borrows a pooled connection only while it is read and the next
+    one resumes after the last (ts, id), so a slow client never holds a pool slot.
+    """
+    condition, host_params = host_filter(host)
+    archived_condition, archived_params = archived_filter(partitions)
+    sql = f'''
+        SELECT {', '.join(STREAM_COLUMNS)}
+        FROM system_metrics
+        WHERE ts >= ? AND (ts, id) > (?, ?){condition}{archived_condition}
+        ORDER BY ts ASC, id ASC
         LIMIT ?
-    ''', (limit,))
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    '''
+    remaining = limit
+    while True:
+        page = min(STREAM_FETCH_ROWS, remaining) if remaining else STREAM_FETCH_ROWS
+        with get_db_connection() as conn:
+            rows = conn.execute(sql, (max(start, after[0]), after[0], after[1], *host_params,
+                                      *archived_params, page)).fetchall()
+        yield from rows
+        if len(rows) < page:
+            return
+        after = (rows[-1]['ts'], rows[-1]['id'])
+        if remaining:
+            remaining -= len(rows)
+            if not remaining:
+                return
+
+def iter_historical_rows(start, after=(-1, -1), limit=None, host=None):
+    """Yield archived and live rows merged in (ts, id) order"""
+    end = int(time.time()) + 1
+    partitions = archive_reader.partitions(max(start, after[0]), end)
+    live = iter_live_rows(start, after, limit, host, partitions)
+    archived = archive_reader.rows(start, end, STREAM_COLUMNS, host, after, partitions)
+    try:
+        rows = heapq.merge(archived, live, key=lambda row: (row['ts'], row['id']))
+        yield from itertools.islice(rows, limit) if limit else rows
+    finally:
+        live.close()
+
+def encode_stream(rows, ndjson):
+    """Serialise rows as NDJSON lines or as one chunked JSON array"""
+    if ndjson:
+        for row in rows:
+            yield json.dumps(dict(row), separators=(',', ':')) + '\n'
+        return
+    yield '['
+    first = True
+    for row in rows:
+        yield ('' if first else ',') + json.dumps(dict(row), separators=(',', ':'))
+        first = False
+    yield ']'
+
+def gzip_stream(chunks):
+    """Compress a text stream on the fly, flushing once per chunk batch"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    pending = []
+    for chunk in chunks:
+        pending.append(chunk)
+        if len(pending) >= STREAM_FETCH_ROWS:
+            data = compressor.compress(''.join(pending).encode())
+            pending = []
+            if data:
+                yield data
+    yield compressor.compress(''.join(pending).encode()) + compressor.flush()
+
+def stream_historical(hours, ndjson, limit, token, host=None):
+    """Streaming response for a raw historical range with bounded memory"""
+    start = window_start(hours)
+    try:
+        after = decode_cursor(token) if token else (-1, -1)
+    except (ValueError, UnicodeDecodeError):
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    headers = {}
+    if limit:
+        with get_db_connection() as conn:
+            next_cursor = next_page_cursor(conn, start, after, limit, host)
+        if next_cursor:
+            headers['X-Next-Cursor'] = next_cursor
+
+    body = encode_stream(iter_historical_rows(start, after, limit, host), ndjson)
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body = gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+    headers['Vary'] = 'Accept-Encoding'
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(body, mimetype=mimetype, headers=headers)
+
+def get_recent_metrics(limit=10, host=None):
+    """Get the most recent raw data points, oldest first"""
+    condition, params = host_filter(host, 'WHERE')
+    with get_db_connection() as conn:
+        cursor = conn.execute(f'''
+            SELECT timestamp, ts, cpu_percent, memory_percent, disk_percent, temperature
+            FROM system_metrics{condition}
+            ORDER BY ts DESC 
+            LIMIT ?
+        ''', params + (limit,))
+        return cursor.fetchall()[::-1]
+
+def get_recent_alerts(limit=10, host=None):
+    """Get recent alerts"""
+    condition, params = host_filter(host, 'WHERE')
+    with get_db_connection() as conn:
+        cursor = conn.execute(f'''
+            SELECT * FROM alerts{condition}
+            ORDER BY ts DESC 
+            LIMIT ?
+        ''', params + (limit,))
+        return cursor.fetchall()
+
+def round_or_none(value, digits=2):
+    """Round an aggregate that is NULL when a host never reports the column"""
+    return round(value, digits) if value is not None else None
+
+def get_average_metrics(hours=1, host=None):
+    """Averages over the last hours, archived days included, or None if the window is empty"""
+    start = window_start(hours)
+    end = int(time.time()) + 1
+    condition, params = host_filter(host)
+    partitions = archive_reader.partitions(start, end)
+    archived_condition, archived_params = archived_filter(partitions)
+    condition, params = condition + archived_condition, params + archived_params
+    with get_db_connection() as conn:
+        cursor = conn.execute(f'''
+            SELECT {', '.join(f'SUM({column}), COUNT({column})' for column in AVERAGE_COLUMNS)},
+                   MIN(ts), MAX(ts)
+            FROM system_metrics 
+            WHERE ts >= ?{condition}
+        ''', (start,) + params)
+        live = cursor.fetchone()
+    
+    # Sums and counts combine across the archive and the live table; averages do not
+    archived = archive_reader.aggregate(start, end, AVERAGE_COLUMNS, host, partitions)
+    averages = {}
+    for i, column in enumerate(AVERAGE_COLUMNS):
+        total, count = archived[column]
+        total += live[2 * i] or 0
+        count += live[2 * i + 1]
+        averages[column] = round_or_none(total / count) if count else None
+    bounds = [ts for ts in (live[-2], live[-1], archived['min_ts'], archived['max_ts']) if ts is not None]
+    if averages['cpu_percent'] is None or not bounds:
+        return None
+    return {
+        'period_hours': hours,
+        'avg_cpu': averages['cpu_percent'],
+        'avg_memory': averages['memory_percent'],
+        'avg_disk': averages['disk_percent'],
+        'avg_temperature': averages['temperature'],
+        'period_start': format_ts(min(bounds)),
+        'period_end': format_ts(max(bounds))
+    }
 
 def format_bytes(bytes):
     """Convert bytes to human readable format"""
+    if bytes is None:
+        return "N/A"
     for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
         if bytes < 1024.0:
             return f"{bytes:.2f} {unit}"
@@ -62,6 +330,8 @@ def format_bytes(bytes):
 
 def format_uptime(seconds):
     """Format uptime seconds to readable string"""
+    if seconds is None:
+        return "N/A"
     days = seconds // 86400
     hours = (seconds % 86400) // 3600
     minutes = (seconds % 3600) // 60
@@ -73,7 +343,6 @@ HTML_TEMPLATE = '''
 <html>
 <head>
     <title>Linux Monitor - Database View</title>
-    <meta http-equiv="refresh" content="30">
     <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
     <style>
         body {
@@ -192,34 +461,34 @@ HTML_TEMPLATE = '''
                 </div>
                 <div class="metric">
                     <span class="label">Timestamp:</span>
-                    <span class="value">{{ metrics.timestamp }}</span>
+                    <span class="value" id="timestamp-value">{{ metrics.timestamp }}</span>
                 </div>
                 <div class="metric">
                     <span class="label">CPU Usage:</span>
-                    <span class="value">{{ metrics.cpu_percent }}%</span>
+                    <span class="value" id="cpu-value">{{ metrics.cpu_percent }}%</span>
                     <div class="progress-bar">
-                        <div class="progress-fill" style="width: {{ metrics.cpu_percent }}%"></div>
+                        <div class="progress-fill" id="cpu-bar" style="width: {{ metrics.cpu_percent }}%"></div>
                     </div>
                 </div>
                 <div class="metric">
                     <span class="label">Memory Usage:</span>
-                    <span class="value">{{ metrics.memory_percent }}%</span>
+                    <span class="value" id="memory-value">{{ metrics.memory_percent }}%</span>
                     <div class="progress-bar">
-                        <div class="progress-fill" style="width: {{ metrics.memory_percent }}%"></div>
+                        <div class="progress-fill" id="memory-bar" style="width: {{ metrics.memory_percent }}%"></div>
                     </div>
                     <small>Used: {{ memory_used }} / Total: {{ memory_total }}</small>
                 </div>
                 <div class="metric">
                     <span class="label">Disk Usage:</span>
-                    <span class="value">{{ metrics.disk_percent }}%</span>
+                    <span class="value" id="disk-value">{{ metrics.disk_percent }}%</span>
                     <div class="progress-bar">
-                        <div class="progress-fill" style="width: {{ metrics.disk_percent }}%"></div>
+                        <div class="progress-fill" id="disk-bar" style="width: {{ metrics.disk_percent }}%"></div>
                     </div>
                     <small>Used: {{ disk_used }} / Total: {{ disk_total }}</small>
                 </div>
                 <div class="metric">
                     <span class="label">Temperature:</span>
-                    <span class="value">{{ metrics.temperature }}°C</span>
+                    <span class="value" id="temperature-value">{{ metrics.temperature }}°C</span>
                 </div>
                 <div class="metric">
                     <span class="label">Uptime:</span>
@@ -251,6 +520,7 @@ HTML_TEMPLATE = '''
             <!-- Recent Alerts Card -->
             <div class="card">
                 <h3>Recent Alerts</h3>
+                <div id="alert-list">
                 {% if alerts %}
                     {% for alert in alerts %}
                     <div class="alert alert-{{ alert.severity|lower }}">
@@ -261,6 +531,7 @@ HTML_TEMPLATE = '''
                 {% else %}
                     <p>No recent alerts</p>
                 {% endif %}
+                </div>
             </div>
         </div>
 
@@ -298,7 +569,7 @@ HTML_TEMPLATE = '''
         </div>
 
         <div class="timestamp">
-            Last updated: {{ current_time }} | Auto-refresh every 30 seconds
+            Last updated: <span id="last-updated">{{ current_time }}</span> | Live updates via /api/stream
         </div>
     </div>
 
@@ -308,7 +579,7 @@ HTML_TEMPLATE = '''
         const chart = new Chart(ctx, {
             type: 'line',
             data: {
-                labels: {{ chart_labels | safe }},
+                labels: [{{ chart_labels | safe }}],
                 datasets: [{
                     label: 'CPU %',
                     data: {{ chart_cpu | safe }},
@@ -363,24 +634,161 @@ HTML_TEMPLATE = '''
                 }
             }
         });
+
+        // Live updates: one shared server-side tail pushes only new rows
+        const maxPoints = {{ chart_points }};
+        const source = new EventSource('/api/stream{% if host %}?host={{ host | urlencode }}{% endif %}');
+
+        function setMetric(name, value, suffix) {
+            const el = document.getElementById(name + '-value');
+            if (el) el.textContent = value + suffix;
+            const bar = document.getElementById(name + '-bar');
+            if (bar) bar.style.width = value + '%';
+        }
+
+        source.addEventListener('metrics', (event) => {
+            const row = JSON.parse(event.data);
+            chart.data.labels.push(row.timestamp.substring(5, 16));
+            chart.data.datasets[0].data.push(row.cpu_percent);
+            chart.data.datasets[1].data.push(row.memory_percent);
+            chart.data.datasets[2].data.push(row.disk_percent);
+            chart.data.datasets[3].data.push(row.temperature);
+            if (chart.data.labels.length > maxPoints) {
+                chart.data.labels.shift();
+                chart.data.datasets.forEach((dataset) => dataset.data.shift());
+            }
+            chart.update('none');
+
+            setMetric('cpu', row.cpu_percent, '%');
+            setMetric('memory', row.memory_percent, '%');
+            setMetric('disk', row.disk_percent, '%');
+            setMetric('temperature', row.temperature, '°C');
+            document.getElementById('timestamp-value').textContent = row.timestamp;
+            document.getElementById('last-updated').textContent = row.timestamp;
+        });
+
+        source.addEventListener('alert', (event) => {
+            const alert = JSON.parse(event.data);
+            const list = document.getElementById('alert-list');
+            const placeholder = list.querySelector('p');
+            if (placeholder) placeholder.remove();
+
+            const item = document.createElement('div');
+            item.className = 'alert alert-' + alert.severity.toLowerCase();
+            const severity = document.createElement('strong');
+            severity.textContent = alert.severity;
+            const time = document.createElement('small');
+            time.textContent = alert.timestamp;
+            item.append(severity, ': ' + alert.message, document.createElement('br'), time);
+            list.prepend(item);
+            while (list.children.length > 5) list.lastElementChild.remove();
+        });
     </script>
 </body>
 </html>
 '''
 
+class DashboardSnapshot:
+    """Rendered dashboard page, kept until a new metrics row or alert is written.
+
+    The data version is the pair of highest row ids in system_metrics and
+    alerts, which only changes when the ingest path inserts something. The
+    ETag is a hash of the rendered page, so it cannot match a different page,
+    even one from another process or from before a restart.
+    """
+
+    def __init__(self, max_hosts=SNAPSHOT_MAX_HOSTS):
+        self.lock = threading.Lock()
+        self.max_hosts = max_hosts
+        self.pages = {}  # host (None for all hosts) -> (version, body, etag)
+        self.version = None
+        self.template = None
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get_template(self):
+        """Compile HTML_TEMPLATE once instead of on every request"""
+        if self.template is None:
+            self.template = app.jinja_env.from_string(HTML_TEMPLATE)
+        return self.template
+
+    def stats(self):
+        # Every request is a hit or a miss; not_modified counts the ones answered with 304
+        requests_seen = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified,
+            'hit_rate': round(self.hits / requests_seen, 4) if requests_seen else 0.0,
+            'version': list(self.version) if self.version else None,
+        }
+
+dashboard_snapshot = DashboardSnapshot()
+
+def get_data_version():
+    """(max metrics id, max alert id); both are rowid lookups"""
+    with get_db_connection() as conn:
+        cursor = conn.execute('''
+            SELECT (SELECT MAX(id) FROM system_metrics), (SELECT MAX(id) FROM alerts)
+        ''')
+        return tuple(cursor.fetchone())
+
+def cached_dashboard(host, version):
+    """(HTML, ETag) of the dashboard for host at a data version, rendered only on a snapshot miss"""
+    with dashboard_snapshot.lock:
+        cached = dashboard_snapshot.pages.get(host)
+        if cached and cached[0] == version:
+            dashboard_snapshot.hits += 1
+            return cached[1:]
+        # Rendered under the lock so concurrent misses render only once
+        dashboard_snapshot.misses += 1
+        body = render_dashboard(host)
+        if body is None:
+            return None
+        pages = dashboard_snapshot.pages
+        if host not in pages and len(pages) >= dashboard_snapshot.max_hosts:
+            pages.clear()
+        etag = hashlib.sha1(body.encode()).hexdigest()
+        pages[host] = (version, body, etag)
+        dashboard_snapshot.version = version
+        return body, etag
+
 @app.route('/')
 def index():
-    """Main dashboard page"""
+    """Main dashboard page, served from the snapshot cache (?host= for one host)"""
+    host = request.args.get('host')
+    page = cached_dashboard(host, get_data_version())
+    if page is None:
+        return "No data in database. Please run setup_db.py first."
+    body, etag = page
+    if request.if_none_match.contains(etag):
+        dashboard_snapshot.not_modified += 1
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+
+    response = Response(body, mimetype='text/html')
+    response.headers['ETag'] = f'"{etag}"'
+    return response
+
+@app.route('/api/cache/stats')
+def api_cache_stats():
+    """API endpoint for dashboard snapshot and stats cache counters"""
+    stats = dashboard_snapshot.stats()
+    stats['stats_cache'] = {'hits': stats_cache.hits, 'misses': stats_cache.misses}
+    return jsonify(stats)
+
+def render_dashboard(host=None):
+    """Render the dashboard HTML, or None if there is no data yet"""
     # Get latest metrics
-    latest = get_latest_metrics()
+    latest = get_latest_metrics(host)
     if not latest:
-        return "No data in database. Please run setup_db.py first."
+        return None
     
-    # Get historical data
-    historical = get_historical_metrics(24)
+    # Get historical data, downsampled server side to the chart's width
+    historical = get_historical_metrics(24, max_points=CHART_POINTS, host=host)
     
     # Get recent alerts
-    alerts = get_recent_alerts(5)
+    alerts = get_recent_alerts(5, host)
     
     # Prepare chart data
     chart_labels = []
@@ -389,93 +797,276 @@ def index():
     chart_disk = []
     chart_temp = []
     
-    for row in historical[-50:]:  # Last 50 points for chart
+    for row in historical:
         chart_labels.append(f"'{row['timestamp'][5:16]}'")
         chart_cpu.append(row['cpu_percent'])
         chart_memory.append(row['memory_percent'])
         chart_disk.append(row['disk_percent'])
         chart_temp.append(row['temperature'])
     
-    return render_template_string(
-        HTML_TEMPLATE,
-        metrics=latest,
-        memory_used=format_bytes(latest['memory_used']),
-        memory_total=format_bytes(latest['memory_total']),
-        disk_used=format_bytes(latest['disk_used']),
-        disk_total=format_bytes(latest['disk_total']),
-        uptime=format_uptime(latest['uptime_seconds']),
-        alerts=alerts,
-        historical=historical[-10:],  # Last 10 points for table
-        chart_labels=','.join(chart_labels),
-        chart_cpu=chart_cpu,
-        chart_memory=chart_memory,
-        chart_disk=chart_disk,
-        chart_temp=chart_temp,
-        current_time=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    )
+    with perf.render_timer():
+        return dashboard_snapshot.get_template().render(
+            metrics=latest,
+            memory_used=format_bytes(latest['memory_used']),
+            memory_total=format_bytes(latest['memory_total']),
+            disk_used=format_bytes(latest['disk_used']),
+            disk_total=format_bytes(latest['disk_total']),
+            uptime=format_uptime(latest['uptime_seconds']),
+            alerts=alerts,
+            historical=get_recent_metrics(10, host),  # Last 10 points for table
+            chart_labels=','.join(chart_labels),
+            chart_cpu=chart_cpu,
+            chart_memory=chart_memory,
+            chart_disk=chart_disk,
+            chart_temp=chart_temp,
+            chart_points=CHART_POINTS,
+            host=host,
+            current_time=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        )
 
 @app.route('/api/metrics/latest')
 def api_latest():
     """API endpoint for latest metrics"""
-    metrics = get_latest_metrics()
+    metrics = get_latest_metrics(request.args.get('host'))
     if metrics:
         return jsonify(dict(metrics))
     return jsonify({'error': 'No data found'}), 404
 
 @app.route('/api/metrics/historical')
 def api_historical():
-    """API endpoint for historical metrics"""
+    """API endpoint for historical metrics.
+
+    format=ndjson or stream=1 streams raw rows instead of building the list;
+    with limit=N the X-Next-Cursor header carries the token for cursor=.
+    """
     hours = request.args.get('hours', 24, type=int)
-    metrics = get_historical_metrics(hours)
+    host = request.args.get('host')
+    resolution = request.args.get('resolution')
+    max_points = request.args.get('max_points', type=int)
+    if resolution not in (None, 'raw') and resolution not in rollup.TIERS_BY_NAME:
+        return jsonify({'error': f'Unknown resolution: {resolution}'}), 400
+    if max_points is not None and max_points < 1:
+        return jsonify({'error': 'max_points must be positive'}), 400
+
+    ndjson = request.args.get('format') == 'ndjson'
+    if ndjson or request.args.get('stream', type=int):
+        if resolution not in (None, 'raw') or max_points:
+            return jsonify({'error': 'Streaming is only available for raw resolution'}), 400
+        limit = request.args.get('limit', type=int)
+        if limit is not None and limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        return stream_historical(hours, ndjson, limit, request.args.get('cursor'), host)
+
+    metrics = get_historical_metrics(hours, resolution, max_points, host)
     return jsonify([dict(row) for row in metrics])
 
+@app.route('/api/stream')
+def api_stream():
+    """Server-Sent Events feed of new metrics rows and alerts"""
+    host = request.args.get('host')
+    subscriber = broadcaster.subscribe()
+
+    def events():
+        try:
+            yield 'retry: 5000\n\n'
+            while broadcaster.is_subscribed(subscriber):
+                try:
+                    event, data = subscriber.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if host is not None and data.get('hostname') != host:
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/alerts')
 def api_alerts():
     """API endpoint for alerts"""
     limit = request.args.get('limit', 10, type=int)
-    alerts = get_recent_alerts(limit)
+    alerts = get_recent_alerts(limit, request.args.get('host'))
     return jsonify([dict(row) for row in alerts])
 
 @app.route('/api/metrics/average')
 def api_average():
     """API endpoint for average metrics over time period"""
     hours = request.args.get('hours', 1, type=int)
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT 
-            AVG(cpu_percent) as avg_cpu,
-            AVG(memory_percent) as avg_memory,
-            AVG(disk_percent) as avg_disk,
-            AVG(temperature) as avg_temp,
-            MAX(timestamp) as period_end,
-            MIN(timestamp) as period_start
-        FROM system_metrics 
-        WHERE timestamp >= datetime('now', '-' || ? || ' hours')
-    ''', (hours,))
-    result = cursor.fetchone()
-    conn.close()
-    
-    if result:
-        return jsonify({
-            'period_hours': hours,
-            'avg_cpu': round(result['avg_cpu'], 2),
-            'avg_memory': round(result['avg_memory'], 2),
-            'avg_disk': round(result['avg_disk'], 2),
-            'avg_temperature': round(result['avg_temp'], 2),
-            'period_start': result['period_start'],
-            'period_end': result['period_end']
-        })
+    average = get_average_metrics(hours, request.args.get('host'))
+    if average:
+        return jsonify(average)
     return jsonify({'error': 'No data found'}), 404
 
+@app.route('/api/metrics/stats')
+def api_stats():
+    """API endpoint for percentiles, spread and trends over a window.
+
+    Query parameters: hours, metrics (comma separated column names),
+    percentiles (comma separated) and ma (moving average sample windows);
+    each ma_N is a rolling mean series of [ts, value] pairs.
+    """
+    hours = request.args.get('hours', 1, type=float)
+    host = request.args.get('host')
+    try:
+        metrics = tuple(m for m in request.args.get('metrics', '').split(',') if m) \
+            or metric_stats.NUMERIC_COLUMNS
+        percentiles = tuple(float(p) for p in request.args.get('percentiles', '').split(',') if p) \
+            or metric_stats.DEFAULT_PERCENTILES
+        moving_averages = tuple(int(w) for w in request.args.get('ma', '').split(',') if w)
+    except ValueError:
+        return jsonify({'error': 'percentiles and ma must be numeric'}), 400
+
+    unknown = [m for m in metrics if m not in metric_stats.NUMERIC_COLUMNS]
+    if unknown:
+        return jsonify({'error': f"Unknown metrics: {', '.join(unknown)}"}), 400
+    if any(not 0 <= p <= 100 for p in percentiles) or any(w < 1 for w in moving_averages):
+        return jsonify({'error': 'percentiles must be 0-100 and ma windows positive'}), 400
+
+    key = (hours, host, metrics, percentiles, moving_averages, get_data_version(),
+           metric_stats.cache_bucket())
+    result = stats_cache.get(key)
+    if result is None:
+        with get_db_connection() as conn:
+            stats = metric_stats.window_stats(conn, window_start(hours), metrics,
+                                              percentiles, moving_averages, host)
+        result = {'period_hours': hours, 'host': host, 'metrics': stats}
+        stats_cache.put(key, result)
+    return jsonify(result)
+
+ingest_writer = None
+ingest_writer_lock = threading.Lock()
+alert_engine = RuleEngine()
+
+def get_ingest_writer():
+    """Writer for pushed batches, created on the first POST"""
+    global ingest_writer
+    with ingest_writer_lock:
+        if ingest_writer is None:
+            ingest_writer = IngestWriter(DATABASE, rules=alert_engine)
+        return ingest_writer
+
+def read_batch_body():
+    """Decoded request body, inflating gzip/deflate with a size cap.
+
+    Both the body as sent (MAX_CONTENT_LENGTH) and the inflated body are
+    limited to MAX_BATCH_BYTES, so a small compressed body cannot expand
+    into a huge one; either limit answers 413.
+    """
+    data = request.get_data(cache=False)
+    encoding = request.headers.get('Content-Encoding', '').lower()
+    if encoding in ('gzip', 'deflate'):
+        wbits = 31 if encoding == 'gzip' else 15
+        decompressor = zlib.decompressobj(wbits)
+        # Inflate one byte past the cap: stopping there is proof the body is too big
+        data = decompressor.decompress(data, MAX_BATCH_BYTES + 1)
+        if len(data) > MAX_BATCH_BYTES:
+            raise RequestEntityTooLarge('Batch exceeds the maximum size once decompressed')
+        if not decompressor.eof:
+            raise ValueError('Truncated compressed body')
+    elif encoding not in ('', 'identity'):
+        raise ValueError(f'Unsupported Content-Encoding: {encoding}')
+    if len(data) > MAX_BATCH_BYTES:
+        raise RequestEntityTooLarge('Batch exceeds the maximum size')
+    return data.decode('utf-8')
+
+def sample_ts(value, now):
+    """Epoch seconds of a pushed sample, now when missing; ValueError outside 1970..now + skew"""
+    if value is None:
+        return now
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('ts must be numeric epoch seconds')
+    if not math.isfinite(value) or not 0 < value <= now + MAX_SAMPLE_SKEW:
+        raise ValueError(f'ts out of range: {value!r}')
+    return int(value)
+
+def parse_batch(text, ndjson):
+    """List of metrics dicts from a JSON array/object or NDJSON body.
+
+    The whole batch is checked here, so it is either accepted or rejected as a unit.
+    """
+    if ndjson:
+        samples = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        payload = json.loads(text)
+        samples = payload.get('metrics', []) if isinstance(payload, dict) else payload
+    if not isinstance(samples, list):
+        raise ValueError('Expected a list of samples')
+
+    cleaned = []
+    now = int(time.time())
+    for sample in samples:
+        if not isinstance(sample, dict) or not sample.get('hostname'):
+            raise ValueError('Every sample needs a hostname')
+        row = {'hostname': str(sample['hostname']), 'ts': sample_ts(sample.get('ts'), now)}
+        for column in metric_stats.NUMERIC_COLUMNS:
+            value = sample.get(column)
+            if value is not None and (not isinstance(value, (int, float)) or not math.isfinite(value)):
+                raise ValueError(f'{column} must be a finite number')
+            row[column] = value
+        cleaned.append(row)
+    return cleaned
+
+@app.route('/api/metrics/batch', methods=['POST'])
+def api_metrics_batch():
+    """Ingest a batch of samples from one or more agents.
+
+    The body is a JSON array (or {"metrics": [...]}), or NDJSON when the
+    Content-Type is application/x-ndjson, optionally gzip/deflate encoded.
+    """
+    ndjson = request.mimetype == 'application/x-ndjson'
+    try:
+        samples = parse_batch(read_batch_body(), ndjson)
+    except (ValueError, TypeError, OverflowError, UnicodeDecodeError, zlib.error) as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    writer = get_ingest_writer()
+    try:
+        writer.add_metrics_many(samples)
+    except BufferFull as exc:
+        # Nothing from this batch was kept, so the agent can resend it as is
+        return jsonify({'error': str(exc)}), 503, {'Retry-After': str(int(writer.max_delay))}
+    return jsonify({'accepted': len(samples),
+                    'hosts': len({sample['hostname'] for sample in samples})}), 202
+
+@app.route('/api/alerts/rules')
+def api_alert_rules():
+    """API endpoint for alert rule counters and evaluation latency"""
+    return jsonify(alert_engine.stats())
+
+@app.route('/api/hosts')
+def api_hosts():
+    """API endpoint listing every reporting host"""
+    with get_db_connection() as conn:
+        cursor = conn.execute('''
+            SELECT hostname, first_seen, last_seen, samples FROM hosts ORDER BY hostname
+        ''')
+        return jsonify([dict(row) for row in cursor.fetchall()])
+
 if __name__ == '__main__':
     print("Starting Linux Monitor with Database Integration...")
     print("Make sure to run setup_db.py first to create and populate the database")
     print("Access the dashboard at: http://localhost:5000")
     print("API endpoints available at:")
+    print("  - /api/metrics/batch (POST, JSON or NDJSON, gzip allowed)")
+    print("  - /api/hosts")
+    print("All read endpoints accept ?host= to select one host")
     print("  - /api/metrics/latest")
-    print("  - /api/metrics/historical")
+    print("  - /api/metrics/historical?hours=&resolution=raw|1m|5m|1h&max_points=")
+    print("  - /api/metrics/historical?format=ndjson|stream=1&limit=&cursor=")
     print("  - /api/alerts")
+    print("  - /api/alerts/rules")
     print("  - /api/metrics/average")
+    print("  - /api/metrics/stats?hours=&metrics=&percentiles=&ma=")
+    print("  - /api/cache/stats")
+    print("  - /api/stream (Server-Sent Events)")
+    print("  - /debug/perf, /debug/perf/profiles")
+    print(f"Archived days in {ARCHIVE_DIR}/ (python archive.py) are included in historical and average")
+    
+    # Upgrade an existing database in place before serving it
+    with get_db_connection() as conn:
+        schema.migrate(conn)
     
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
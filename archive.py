@@ -0,0 +1,500 @@
+"""Columnar archive of closed days of system_metrics.
+
+Once a UTC day is ARCHIVE_AFTER_DAYS old, its rows are written to one file
+per day (archive/metrics-YYYY-MM-DD.col) and deleted from the database.
+Rows are stored sorted by (hostname, ts, id), one column at a time:
+
+    delta2  integers as deltas of deltas (id, ts: regular intervals become 0)
+    delta   other integers as first differences
+    xor     floats as the XOR of each value's bits with the previous value's
+            (Gorilla-style, with zlib standing in for the bit packing)
+
+Every column is zlib compressed. A JSON header holds the column offsets and
+each host's row range. hostname is not stored per row, and the text
+timestamp is rebuilt from ts.
+
+Readers memory-map the file and decode only the columns a query asks for.
+Within a host block ts is sorted, so a time range is a bisect and a slice.
+app.py unions these reads with the live table for the historical and
+average APIs. A day's rows are in both places from write_partition() until
+delete_archived() finishes, so app.py leaves out live rows of an archived
+day up to that file's max_id (late rows have higher ids).
+
+    python archive.py              # archive every closed day, print a report
+    python archive.py --every 3600
+"""
+import argparse
+import datetime
+import heapq
+import itertools
+import json
+import math
+import mmap
+import operator
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ingest import format_ts
+
+DATABASE = 'monitoring.db'
+ARCHIVE_DIR = 'archive'
+ARCHIVE_AFTER_DAYS = 2
+DAY = 86400
+MAGIC = b'MCOL'
+VERSION = 1
+COMPRESS_LEVEL = 6
+DELETE_CHUNK_ROWS = 5000
+DELETE_PAUSE = 0.05
+OPEN_PARTITIONS = 16
+
+# Stored columns; timestamp is derived from ts and hostname from the host index
+COLUMNS = (
+    'id', 'ts', 'cpu_percent', 'memory_percent', 'memory_used', 'memory_total',
+    'disk_percent', 'disk_used', 'disk_total', 'process_count', 'uptime_seconds',
+    'temperature', 'load_average_1min', 'load_average_5min', 'load_average_15min',
+)
+DELTA2_COLUMNS = ('id', 'ts')
+
+
+def day_path(directory, day_start):
+    day = datetime.datetime.fromtimestamp(day_start, datetime.timezone.utc).strftime('%Y-%m-%d')
+    return os.path.join(directory, f'metrics-{day}.col')
+
+
+def day_start_of(path):
+    day = os.path.basename(path)[len('metrics-'):-len('.col')]
+    return int(datetime.datetime.strptime(day, '%Y-%m-%d')
+               .replace(tzinfo=datetime.timezone.utc).timestamp())
+
+
+# Encoding
+
+def _deltas(values):
+    return [b - a for a, b in zip(itertools.chain((0,), values), values)]
+
+
+def encode_column(name, values):
+    """(encoding, payload bytes, null mask bytes or b'') for one column"""
+    present = [value for value in values if value is not None]
+    integral = all(isinstance(value, int) for value in present)
+    if integral:
+        nulls = b''
+        if len(present) != len(values):
+            nulls = bytes(value is None for value in values)
+            values = [0 if value is None else value for value in values]
+        if name in DELTA2_COLUMNS:
+            return 'delta2', array('q', _deltas(_deltas(values))).tobytes(), nulls
+        return 'delta', array('q', _deltas(values)).tobytes(), nulls
+
+    # SQLite has no NaN, so NaN can stand for NULL without a mask
+    bits = array('Q', array('d', (math.nan if value is None else value for value in values)).tobytes())
+    xored = array('Q', (current ^ previous for previous, current in zip(itertools.chain((0,), bits), bits)))
+    return 'xor', xored.tobytes(), b''
+
+
+def decode_column(encoding, data, nulls):
+    """Decoded column as a numpy array or array.array"""
+    if encoding == 'xor':
+        if np is not None:
+            return np.bitwise_xor.accumulate(np.frombuffer(data, dtype=np.uint64)).view(np.float64)
+        return array('d', array('Q', itertools.accumulate(array('Q', data), operator.xor)).tobytes())
+    if np is not None:
+        values = np.frombuffer(data, dtype=np.int64).cumsum()
+        if encoding == 'delta2':
+            values = values.cumsum()
+    else:
+        values = array('q', itertools.accumulate(array('q', data)))
+        if encoding == 'delta2':
+            values = array('q', itertools.accumulate(values))
+    if nulls:
+        # Integers with NULLs become floats with NaN, as they would in a NumPy window
+        mask = bytes(nulls)
+        if np is not None:
+            values = values.astype(np.float64)
+            values[np.frombuffer(mask, dtype=np.uint8).astype(bool)] = np.nan
+        else:
+            values = array('d', (math.nan if null else value for value, null in zip(values, mask)))
+    return values
+
+
+def write_partition(path, rows):
+    """Write rows (dicts sorted by hostname, ts, id) as one archive file"""
+    # Per-host sums and counts let a fully covered block be aggregated without decoding
+    hosts = []
+    for hostname, group in itertools.groupby(range(len(rows)), key=lambda i: rows[i]['hostname']):
+        group = list(group)
+        totals = {}
+        for name in COLUMNS[2:]:
+            present = [rows[i][name] for i in group if rows[i][name] is not None]
+            totals[name] = [math.fsum(present), len(present)]
+        hosts.append([hostname, group[0], len(group), totals])
+
+    header = {'version': VERSION, 'rows': len(rows), 'hosts': hosts,
+              'min_ts': min(row['ts'] for row in rows), 'max_ts': max(row['ts'] for row in rows),
+              'max_id': max(row['id'] for row in rows), 'columns': {}}
+    blobs = []
+    offset = 0
+    for name in COLUMNS:
+        encoding, payload, nulls = encode_column(name, [row[name] for row in rows])
+        payload = zlib.compress(payload, COMPRESS_LEVEL)
+        nulls = zlib.compress(nulls, COMPRESS_LEVEL) if nulls else b''
+        header['columns'][name] = {'encoding': encoding, 'offset': offset, 'length': len(payload),
+                                   'nulls_length': len(nulls)}
+        blobs += [payload, nulls]
+        offset += len(payload) + len(nulls)
+
+    encoded_header = json.dumps(header, separators=(',', ':')).encode()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<HI', VERSION, len(encoded_header)) + encoded_header)
+        for blob in blobs:
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+# Reading
+
+class Partition:
+    """One memory-mapped archive file with lazily decoded columns"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:4] != MAGIC:
+            raise ValueError(f'{path} is not a metrics archive')
+        _, header_length = struct.unpack_from('<HI', self._map, 4)
+        self._data_start = 10 + header_length
+        self.header = json.loads(self._map[10:self._data_start])
+        self.rows = self.header['rows']
+        self.min_ts = self.header['min_ts']
+        self.max_ts = self.header['max_ts']
+        self.hosts = {hostname: (start, count) for hostname, start, count, _ in self.header['hosts']}
+        self.totals = {hostname: totals for hostname, _, _, totals in self.header['hosts']}
+        self.day_start = self.min_ts // DAY * DAY
+        self.day_prefix = format_ts(self.day_start)[:11]
+        self._columns = {}
+        self._lock = threading.Lock()
+        # Files written before max_id was recorded decode it from the id column
+        self.max_id = self.header.get('max_id')
+        if self.max_id is None:
+            self.max_id = int(max(self.column('id'))) if self.rows else 0
+
+    def column(self, name):
+        with self._lock:
+            values = self._columns.get(name)
+            if values is None:
+                meta = self.header['columns'][name]
+                start = self._data_start + meta['offset']
+                view = memoryview(self._map)
+                try:
+                    data = zlib.decompress(view[start:start + meta['length']])
+                    nulls = b''
+                    if meta['nulls_length']:
+                        nulls_start = start + meta['length']
+                        nulls = zlib.decompress(view[nulls_start:nulls_start + meta['nulls_length']])
+                finally:
+                    view.release()
+                values = self._columns[name] = decode_column(meta['encoding'], data, nulls)
+            return values
+
+    def host_ranges(self, start_ts, end_ts, hostname=None):
+        """(hostname, first row, last row + 1) for rows with start_ts <= ts < end_ts"""
+        ts = self.column('ts')
+        hosts = self.hosts.items() if hostname is None else [(hostname, self.hosts.get(hostname))]
+        for name, block in hosts:
+            if block is None:
+                continue
+            first, count = block
+            block_ts = ts[first:first + count]
+            if np is not None:
+                lo, hi = np.searchsorted(block_ts, [start_ts, end_ts])
+            else:
+                lo, hi = bisect_left(block_ts, start_ts), bisect_left(block_ts, end_ts)
+            if hi > lo:
+                yield name, first + int(lo), first + int(hi)
+
+    def close(self):
+        self._columns.clear()
+        self._map.close()
+        self._file.close()
+
+
+def _clean(value):
+    """NaN back to None"""
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class ArchiveReader:
+    """Range reads and aggregates over every archived day in a directory"""
+
+    def __init__(self, directory=ARCHIVE_DIR, open_partitions=OPEN_PARTITIONS):
+        self.directory = directory
+        self.open_partitions = open_partitions
+        self._partitions = OrderedDict()  # path -> (mtime_ns, Partition)
+        self._lock = threading.Lock()
+
+    def partitions(self, start_ts, end_ts):
+        """Open partitions whose day overlaps [start_ts, end_ts), oldest first"""
+        try:
+            names = sorted(name for name in os.listdir(self.directory)
+                           if name.startswith('metrics-') and name.endswith('.col'))
+        except FileNotFoundError:
+            return []
+        selected = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            day_start = day_start_of(path)
+            if day_start + DAY <= start_ts or day_start >= end_ts:
+                continue
+            partition = self._open(path)
+            if partition is not None:
+                selected.append(partition)
+        return selected
+
+    def _open(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            cached = self._partitions.get(path)
+            if cached and cached[0] == mtime:
+                self._partitions.move_to_end(path)
+                return cached[1]
+            # A replaced or evicted partition is left to the garbage collector,
+            # since another request may still be reading its mapping
+            partition = Partition(path)
+            self._partitions[path] = (mtime, partition)
+            while len(self._partitions) > self.open_partitions:
+                self._partitions.popitem(last=False)
+            return partition
+
+    def _selected(self, start_ts, end_ts, partitions):
+        """partitions as given (a snapshot shared with a live query) or those overlapping the range"""
+        return self.partitions(start_ts, end_ts) if partitions is None else partitions
+
+    def count(self, start_ts, end_ts, hostname=None, partitions=None):
+        return sum(hi - lo for partition in self._selected(start_ts, end_ts, partitions)
+                   for _, lo, hi in partition.host_ranges(start_ts, end_ts, hostname))
+
+    def rows(self, start_ts, end_ts, columns, hostname=None, after=(-1, -1), partitions=None):
+        """Yield row dicts (keys in columns order) with ts in range and (ts, id) > after, in (ts, id) order"""
+        start_ts = max(start_ts, after[0])
+        for partition in self._selected(start_ts, end_ts, partitions):
+            blocks = [self._block_rows(partition, host, lo, hi, columns, after)
+                      for host, lo, hi in partition.host_ranges(start_ts, end_ts, hostname)]
+            if len(blocks) == 1:
+                rows = blocks[0]
+            else:
+                rows = heapq.merge(*blocks, key=operator.itemgetter(0))
+            for _, row in rows:
+                yield row
+
+    @staticmethod
+    def _block_rows(partition, host, lo, hi, columns, after):
+        """((ts, id), row) for rows lo..hi of one host block"""
+        ts = partition.column('ts')[lo:hi].tolist()
+        ids = partition.column('id')[lo:hi].tolist()
+        skip = 0
+        while skip < len(ts) and (ts[skip], ids[skip]) <= after:
+            skip += 1
+        ts, ids = ts[skip:], ids[skip:]
+
+        lists = []
+        for column in columns:
+            if column == 'id':
+                lists.append(ids)
+            elif column == 'ts':
+                lists.append(ts)
+            elif column == 'timestamp':
+                # Every row of a partition falls on the same UTC day
+                prefix, day_start = partition.day_prefix, partition.day_start
+                lists.append([f'{prefix}{(t - day_start) // 3600:02d}:{(t - day_start) // 60 % 60:02d}:'
+                              f'{(t - day_start) % 60:02d}' for t in ts])
+            elif column == 'hostname':
+                lists.append(itertools.repeat(host))
+            else:
+                values = partition.column(column)[lo + skip:hi].tolist()
+                lists.append([None if value != value else value for value in values])
+        for key, values in zip(zip(ts, ids), zip(*lists)):
+            yield key, dict(zip(columns, values))
+
+    def keys(self, start_ts, end_ts, hostname=None, after=(-1, -1), partitions=None):
+        """Yield (ts, id) keys in order, without building rows"""
+        start_ts = max(start_ts, after[0])
+        for partition in self._selected(start_ts, end_ts, partitions):
+            ts, ids = partition.column('ts'), partition.column('id')
+            blocks = [zip(ts[lo:hi].tolist(), ids[lo:hi].tolist())
+                      for _, lo, hi in partition.host_ranges(start_ts, end_ts, hostname)]
+            for key in heapq.merge(*blocks):
+                if key > after:
+                    yield key
+
+    def aggregate(self, start_ts, end_ts, columns, hostname=None, partitions=None):
+        """{column: (sum, count)} plus 'min_ts'/'max_ts' over the range"""
+        totals = {column: [0.0, 0] for column in columns}
+        min_ts = max_ts = None
+        for partition in self._selected(start_ts, end_ts, partitions):
+            ts = partition.column('ts')
+            for host, lo, hi in partition.host_ranges(start_ts, end_ts, hostname):
+                first, last = int(ts[lo]), int(ts[hi - 1])
+                min_ts = first if min_ts is None else min(min_ts, first)
+                max_ts = last if max_ts is None else max(max_ts, last)
+                block_start, block_count = partition.hosts[host]
+                whole_block = lo == block_start and hi == block_start + block_count
+                for column in columns:
+                    if whole_block:
+                        total, count = partition.totals[host][column]
+                    else:
+                        values = partition.column(column)[lo:hi]
+                        if np is not None:
+                            present = values[~np.isnan(values)] if values.dtype.kind == 'f' else values
+                            total, count = float(present.sum()), int(present.size)
+                        else:
+                            present = [value for value in values if value == value]
+                            total, count = math.fsum(present), len(present)
+                    totals[column][0] += total
+                    totals[column][1] += count
+        result = {column: tuple(total) for column, total in totals.items()}
+        result['min_ts'], result['max_ts'] = min_ts, max_ts
+        return result
+
+
+# Archiving
+
+def read_day(conn, day_start, max_id=None):
+    sql = f'''
+        SELECT hostname, {", ".join(COLUMNS)} FROM system_metrics
+        WHERE ts >= ? AND ts < ?{" AND id <= ?" if max_id is not None else ""}
+        ORDER BY hostname, ts, id
+    '''
+    params = (day_start, day_start + DAY) + ((max_id,) if max_id is not None else ())
+    cursor = conn.execute(sql, params)
+    names = [description[0] for description in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def partition_rows(path):
+    """Every row of an existing archive file, for merging in late arrivals"""
+    partition = Partition(path)
+    try:
+        rows = []
+        for hostname, (first, count) in partition.hosts.items():
+            columns = {column: partition.column(column)[first:first + count].tolist() for column in COLUMNS}
+            for i in range(count):
+                row = {column: _clean(columns[column][i]) for column in COLUMNS}
+                row['hostname'] = hostname
+                rows.append(row)
+        return rows
+    finally:
+        partition.close()
+
+
+def delete_archived(conn, day_start, max_id, chunk_rows=DELETE_CHUNK_ROWS, pause=DELETE_PAUSE):
+    """Delete a day's archived rows a chunk at a time, as retention.py does"""
+    deleted = 0
+    while True:
+        with conn:
+            count = conn.execute('''
+                DELETE FROM system_metrics WHERE rowid IN (
+                    SELECT rowid FROM system_metrics
+                    WHERE ts >= ? AND ts < ? AND id <= ? LIMIT ?
+                )
+            ''', (day_start, day_start + DAY, max_id, chunk_rows)).rowcount
+        deleted += count
+        if count < chunk_rows:
+            return deleted
+        time.sleep(pause)
+
+
+def prune(directory, cutoff):
+    """Remove archive files of days that ended before cutoff; return their names"""
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+    removed = []
+    for name in names:
+        if name.startswith('metrics-') and name.endswith('.col'):
+            path = os.path.join(directory, name)
+            if day_start_of(path) + DAY <= cutoff:
+                os.remove(path)
+                removed.append(name)
+    return removed
+
+
+def archive_closed_days(database=DATABASE, directory=ARCHIVE_DIR, now=None,
+                        after_days=ARCHIVE_AFTER_DAYS):
+    """Move every day that ended at least after_days ago into the archive"""
+    now = int(time.time()) if now is None else now
+    cutoff = (now - after_days * DAY) // DAY * DAY
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(database, timeout=30)
+    conn.execute('PRAGMA busy_timeout = 30000')
+    started = time.perf_counter()
+    report = {'days': [], 'rows': 0, 'bytes_written': 0}
+    try:
+        oldest = conn.execute('SELECT MIN(ts) FROM system_metrics').fetchone()[0]
+        if oldest is None:
+            return report
+        for day_start in range(oldest // DAY * DAY, cutoff, DAY):
+            max_id = conn.execute('''
+                SELECT MAX(id) FROM system_metrics WHERE ts >= ? AND ts < ?
+            ''', (day_start, day_start + DAY)).fetchone()[0]
+            if max_id is None:
+                continue
+            rows = read_day(conn, day_start, max_id)
+            path = day_path(directory, day_start)
+            if os.path.exists(path):
+                # Late rows for a day that is already archived; rows up to its max_id are
+                # already in the file if an earlier run stopped before deleting them
+                existing = partition_rows(path)
+                archived_max_id = max((row['id'] for row in existing), default=0)
+                rows = [row for row in rows if row['id'] > archived_max_id]
+                rows = sorted(existing + rows, key=lambda row: (
+                    row['hostname'] is not None, row['hostname'] or '', row['ts'], row['id']))
+            size = write_partition(path, rows)
+            deleted = delete_archived(conn, day_start, max_id)
+            report['days'].append({'day': os.path.basename(path), 'rows': len(rows),
+                                   'deleted': deleted, 'bytes': size,
+                                   'bytes_per_row': round(size / len(rows), 2)})
+            report['rows'] += deleted
+            report['bytes_written'] += size
+    finally:
+        conn.close()
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=DATABASE)
+    parser.add_argument('--dir', default=ARCHIVE_DIR)
+    parser.add_argument('--after-days', type=int, default=ARCHIVE_AFTER_DAYS,
+                        help='archive days that ended at least this many days ago')
+    parser.add_argument('--every', type=int, help='repeat every N seconds')
+    args = parser.parse_args()
+
+    while True:
+        print(json.dumps(archive_closed_days(args.db, args.dir, after_days=args.after_days), indent=2))
+        if not args.every:
+            break
+        time.sleep(args.every)
@@ -0,0 +1,358 @@
+"""asyncio (ASGI) serving mode for the monitoring dashboard.
+
+Serves the read routes of app.py ('/', /api/metrics/latest,
+/api/metrics/historical, /api/alerts, /api/metrics/average) from one event
+loop. The queries and the JSON/HTML encoding are the ones app.py uses, and
+they run on a dedicated thread pool, so the loop itself never blocks on
+SQLite. That pool is sized on its own (EXECUTOR_THREADS): a thread only
+holds a database connection while it runs a query, and threads beyond
+app.DB_POOL_SIZE wait in the connection pool, not on the loop. Identical requests that arrive while
+one is already being computed wait for that result (single-flight) instead
+of running the same query again.
+
+``application`` is a plain ASGI callable:
+
+    uvicorn async_app:application --port 5000
+
+Without an ASGI server installed, ``python async_app.py`` serves it over a
+small built-in HTTP/1.1 server.
+"""
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from urllib.parse import parse_qsl
+
+import app as flask_app
+import rollup
+import schema
+
+EXECUTOR_THREADS = 32
+executor = ThreadPoolExecutor(max_workers=EXECUTOR_THREADS, thread_name_prefix='db')
+STREAM_CHUNKS_PER_HOP = 256
+MAX_REQUEST_HEAD = 65536
+
+
+class SingleFlight:
+    """Shares one in-flight executor call among identical concurrent requests"""
+
+    def __init__(self):
+        self._inflight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def run(self, key, func, *args):
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        self.calls += 1
+        future = asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        self._inflight[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+
+single_flight = SingleFlight()
+
+
+def json_response(data, status=200, headers=()):
+    body = json.dumps(data, separators=(',', ':')).encode()
+    return status, [('content-type', 'application/json')] + list(headers), body
+
+
+def error(message, status=400):
+    return json_response({'error': message}, status)
+
+
+def arg_int(args, name, default=None):
+    """Like Flask's args.get(name, default, type=int)"""
+    try:
+        return int(args[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def latest_response(host):
+    metrics = flask_app.get_latest_metrics(host)
+    if metrics:
+        return json_response(dict(metrics))
+    return error('No data found', 404)
+
+
+def historical_response(hours, resolution, max_points, host):
+    metrics = flask_app.get_historical_metrics(hours, resolution, max_points, host)
+    return json_response([dict(row) for row in metrics])
+
+
+def alerts_response(limit, host):
+    return json_response([dict(row) for row in flask_app.get_recent_alerts(limit, host)])
+
+
+def average_response(hours, host):
+    average = flask_app.get_average_metrics(hours, host)
+    if average:
+        return json_response(average)
+    return error('No data found', 404)
+
+
+def dashboard_response(host, if_none_match):
+    page = flask_app.cached_dashboard(host, flask_app.get_data_version())
+    if page is None:
+        return 200, [('content-type', 'text/html; charset=utf-8')], \
+            b'No data in database. Please run setup_db.py first.'
+    body, etag = page
+    etag = f'"{etag}"'
+    if etag in if_none_match:
+        flask_app.dashboard_snapshot.not_modified += 1
+        return 304, [('etag', etag)], b''
+    return 200, [('content-type', 'text/html; charset=utf-8'), ('etag', etag)], body.encode()
+
+
+def stream_setup(hours, limit, token, host):
+    """(start, after, headers) for a raw stream, as app.stream_historical computes them"""
+    start = flask_app.window_start(hours)
+    after = flask_app.decode_cursor(token) if token else (-1, -1)
+    headers = []
+    if limit:
+        with flask_app.get_db_connection() as conn:
+            next_cursor = flask_app.next_page_cursor(conn, start, after, limit, host)
+        if next_cursor:
+            headers.append(('x-next-cursor', next_cursor))
+    return start, after, headers
+
+
+def take(chunks, count):
+    """Next count chunks of a generator joined as bytes; b'' once it is done"""
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk if isinstance(chunk, bytes) else chunk.encode())
+        if len(parts) >= count:
+            break
+    return b''.join(parts)
+
+
+async def stream_historical(send, args, request_headers, host):
+    loop = asyncio.get_running_loop()
+    ndjson = args.get('format') == 'ndjson'
+    limit = arg_int(args, 'limit')
+    if limit is not None and limit < 1:
+        return await send_response(send, *error('limit must be positive'))
+    try:
+        start, after, headers = await loop.run_in_executor(
+            executor, stream_setup, arg_int(args, 'hours', 24), limit, args.get('cursor'), host)
+    except (ValueError, UnicodeDecodeError):
+        return await send_response(send, *error('Invalid cursor'))
+
+    chunks = flask_app.encode_stream(flask_app.iter_historical_rows(start, after, limit, host), ndjson)
+    if 'gzip' in request_headers.get('accept-encoding', ''):
+        chunks = flask_app.gzip_stream(chunks)
+        headers.append(('content-encoding', 'gzip'))
+    headers += [('vary', 'Accept-Encoding'),
+                ('content-type', 'application/x-ndjson' if ndjson else 'application/json')]
+    await send({'type': 'http.response.start', 'status': 200, 'headers': encode_headers(headers)})
+    try:
+        while True:
+            # Advancing the generator may run a query, so it happens on the executor
+            body = await loop.run_in_executor(executor, take, chunks, STREAM_CHUNKS_PER_HOP)
+            if not body:
+                break
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        await loop.run_in_executor(executor, chunks.close)
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def route(path, args, request_headers):
+    """(status, headers, body) for one GET request"""
+    host = args.get('host')
+    if path == '/':
+        if_none_match = request_headers.get('if-none-match', '')
+        key = ('/', host, if_none_match)
+        return await single_flight.run(key, dashboard_response, host, if_none_match)
+
+    if path == '/api/metrics/latest':
+        return await single_flight.run((path, host), latest_response, host)
+
+    if path == '/api/metrics/historical':
+        hours = arg_int(args, 'hours', 24)
+        resolution = args.get('resolution')
+        max_points = arg_int(args, 'max_points')
+        if resolution not in (None, 'raw') and resolution not in rollup.TIERS_BY_NAME:
+            return error(f'Unknown resolution: {resolution}')
+        if max_points is not None and max_points < 1:
+            return error('max_points must be positive')
+        key = (path, hours, resolution, max_points, host)
+        return await single_flight.run(key, historical_response, hours, resolution, max_points, host)
+
+    if path == '/api/alerts':
+        limit = arg_int(args, 'limit', 10)
+        return await single_flight.run((path, limit, host), alerts_response, limit, host)
+
+    if path == '/api/metrics/average':
+        hours = arg_int(args, 'hours', 1)
+        return await single_flight.run((path, hours, host), average_response, hours, host)
+
+    if path == '/api/async/stats':
+        return json_response({'calls': single_flight.calls, 'coalesced': single_flight.coalesced,
+                              'inflight': len(single_flight._inflight)})
+
+    return error('Not found', 404)
+
+
+def encode_headers(headers):
+    return [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+async def send_response(send, status, headers, body):
+    headers = headers + [('content-length', str(len(body)))]
+    await send({'type': 'http.response.start', 'status': status, 'headers': encode_headers(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def migrate_database():
+    """Upgrade an existing database in place before serving it"""
+    with flask_app.get_db_connection() as conn:
+        schema.migrate(conn)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.get_running_loop().run_in_executor(executor, migrate_database)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    if scope['method'] not in ('GET', 'HEAD'):
+        return await send_response(send, *error('Method not allowed', 405))
+
+    args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+    request_headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                       for name, value in scope.get('headers', [])}
+    if scope['path'] == '/api/metrics/historical' and (
+            args.get('format') == 'ndjson' or arg_int(args, 'stream')):
+        if args.get('resolution') not in (None, 'raw') or args.get('max_points'):
+            return await send_response(send, *error('Streaming is only available for raw resolution'))
+        return await stream_historical(send, args, request_headers, args.get('host'))
+
+    status, headers, body = await route(scope['path'], args, request_headers)
+    await send_response(send, status, headers, b'' if scope['method'] == 'HEAD' else body)
+
+
+# Minimal HTTP/1.1 front end for running without uvicorn/hypercorn
+
+REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+async def handle_connection(reader, writer):
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                return
+            lines = head.decode('latin-1').split('\r\n')
+            method, target, version = lines[0].split(' ', 2)
+            headers = [tuple(part.strip() for part in line.split(':', 1))
+                       for line in lines[1:] if ':' in line]
+            lowered = {name.lower(): value for name, value in headers}
+            length = int(lowered.get('content-length', 0))
+            if length:
+                await reader.readexactly(length)
+            path, _, query = target.partition('?')
+            keep_alive = (version == 'HTTP/1.1' and lowered.get('connection', '').lower() != 'close')
+
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': version[5:],
+                'method': method, 'path': path, 'raw_path': path.encode(),
+                'query_string': query.encode('latin-1'),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in headers],
+            }
+            state = {'chunked': False, 'started': False}
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    state['started'] = True
+                    status = message['status']
+                    response_headers = [(name.decode('latin-1'), value.decode('latin-1'))
+                                        for name, value in message['headers']]
+                    if not any(name == 'content-length' for name, _ in response_headers):
+                        state['chunked'] = True
+                        response_headers.append(('transfer-encoding', 'chunked'))
+                    response_headers += [('date', formatdate(usegmt=True)),
+                                         ('connection', 'keep-alive' if keep_alive else 'close')]
+                    head = f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n' + ''.join(
+                        f'{name}: {value}\r\n' for name, value in response_headers) + '\r\n'
+                    writer.write(head.encode('latin-1'))
+                else:
+                    body = message.get('body', b'')
+                    if state['chunked']:
+                        if body:
+                            writer.write(b'%x\r\n%s\r\n' % (len(body), body))
+                        if not message.get('more_body'):
+                            writer.write(b'0\r\n\r\n')
+                    else:
+                        writer.write(body)
+                    await writer.drain()
+
+            try:
+                await application(scope, receive, send)
+            except Exception as exc:
+                print(f"Request failed: {method} {target}: {exc!r}")
+                if state['started']:
+                    return
+                keep_alive = False
+                await send_response(send, *error('Internal server error', 500))
+            if not keep_alive:
+                return
+    except (ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host='0.0.0.0', port=5000):
+    await asyncio.get_running_loop().run_in_executor(executor, migrate_database)
+    server = await asyncio.start_server(handle_connection, host, port, limit=MAX_REQUEST_HEAD,
+                                        backlog=1024)
+    print(f"Async dashboard at http://localhost:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+    try:
+        import uvicorn
+    except ImportError:
+        uvicorn = None
+    if uvicorn is not None:
+        uvicorn.run(application, host=args.host, port=args.port, log_level='warning')
+    else:
+        try:
+            asyncio.run(serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,123 @@
+"""Benchmark dashboard query latency before and after the schema migrations.
+
+Seeds a scratch database at schema version 1 (no indexes, text timestamps),
+times the queries app.py used to run, upgrades it in place with
+schema.migrate() and times the epoch/index based queries app.py runs now.
+
+    python bench_db.py --rows 10000000 --interval 10
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import time
+
+import schema
+
+# (name, v1 query, v1 params, current query, current params); the window is
+# in hours and substituted at run time
+QUERIES = [
+    ('latest',
+     "SELECT * FROM system_metrics ORDER BY timestamp DESC LIMIT 1", (),
+     "SELECT * FROM system_metrics ORDER BY ts DESC LIMIT 1", ()),
+    ('historical_24h',
+     "SELECT timestamp, cpu_percent, memory_percent, disk_percent, temperature "
+     "FROM system_metrics WHERE timestamp >= datetime('now', '-' || ? || ' hours') "
+     "ORDER BY timestamp ASC", ('hours',),
+     "SELECT timestamp, ts, cpu_percent, memory_percent, disk_percent, temperature "
+     "FROM system_metrics WHERE ts >= ? ORDER BY ts ASC", ('since',)),
+    ('average_1h',
+     "SELECT AVG(cpu_percent), AVG(memory_percent), MAX(timestamp), MIN(timestamp) "
+     "FROM system_metrics WHERE timestamp >= datetime('now', '-' || ? || ' hours')", ('hours_1',),
+     "SELECT AVG(cpu_percent), AVG(memory_percent), MAX(timestamp), MIN(timestamp) "
+     "FROM system_metrics WHERE ts >= ?", ('since_1',)),
+    ('alerts',
+     "SELECT * FROM alerts ORDER BY timestamp DESC LIMIT 10", (),
+     "SELECT * FROM alerts ORDER BY ts DESC LIMIT 10", ()),
+]
+
+
+def seed(conn, rows, interval):
+    """Fill a version 1 database with rows samples ending now"""
+    now = int(time.time())
+    start = now - rows * interval
+    conn.execute('''
+        WITH RECURSIVE seq(n) AS (
+            SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n + 1 < ?
+        )
+        INSERT INTO system_metrics (
+            timestamp, hostname, cpu_percent, memory_percent, memory_used, memory_total,
+            disk_percent, disk_used, disk_total, process_count, uptime_seconds,
+            temperature, load_average_1min, load_average_5min, load_average_15min
+        )
+        SELECT datetime(? + n * ?, 'unixepoch'), 'linux-server-01',
+               abs(random() % 1000) / 10.0, abs(random() % 1000) / 10.0, 0, 0,
+               abs(random() % 1000) / 10.0, 0, 0, 100, 86400,
+               40 + abs(random() % 300) / 10.0, 1.0, 1.0, 1.0
+        FROM seq
+    ''', (rows, start, interval))
+    conn.execute('''
+        WITH RECURSIVE seq(n) AS (
+            SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n + 1 < ?
+        )
+        INSERT INTO alerts (timestamp, severity, metric, value, threshold, message)
+        SELECT datetime(? + n * ?, 'unixepoch'), 'WARNING', 'cpu_percent', 90, 80, 'bench'
+        FROM seq
+    ''', (max(rows // 100, 1), start, interval * 100))
+    conn.commit()
+
+
+def time_query(conn, sql, params, repeat):
+    """Median wall time in milliseconds of running sql to completion"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def resolve(names):
+    """Turn symbolic parameter names into concrete values"""
+    now = int(time.time())
+    values = {'hours': 24, 'since': now - 24 * 3600, 'hours_1': 1, 'since_1': now - 3600}
+    return tuple(values[name] for name in names)
+
+
+def run(path, rows, interval, repeat):
+    """Seed, time, migrate and time again, then print a comparison"""
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    schema.migrate(conn, target=1)
+
+    started = time.perf_counter()
+    seed(conn, rows, interval)
+    print(f"Seeded {rows:,} rows in {time.perf_counter() - started:.1f}s")
+
+    before = {name: time_query(conn, old_sql, resolve(old_params), repeat)
+              for name, old_sql, old_params, _, _ in QUERIES}
+
+    started = time.perf_counter()
+    schema.migrate(conn)
+    print(f"Migrated in place to version {schema.get_version(conn)} "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    after = {name: time_query(conn, new_sql, resolve(new_params), repeat)
+             for name, _, _, new_sql, new_params in QUERIES}
+    conn.close()
+
+    print(f"\n{'query':<16}{'v1 (ms)':>12}{'latest (ms)':>14}{'speedup':>10}")
+    for name, *_ in QUERIES:
+        speedup = before[name] / after[name] if after[name] else float('inf')
+        print(f"{name:<16}{before[name]:>12.2f}{after[name]:>14.2f}{speedup:>9.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000, help='samples to seed (default 1,000,000)')
+    parser.add_argument('--interval', type=int, default=10, help='seconds between samples')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per query, median is reported')
+    parser.add_argument('--db', default='bench_monitoring.db', help='scratch database path')
+    args = parser.parse_args()
+    run(args.db, args.rows, args.interval, args.repeat)
@@ -0,0 +1,380 @@
+"""Load and benchmark the monitoring (app.py) and grid (grid.py) web apps.
+
+Seeds scratch databases of a chosen size, then drives every route with
+`concurrency` threads, either in process through the Flask test client or
+against a running server. For each route it reports requests/sec and
+latency percentiles. In process it also reports SQLite time per query and
+peak Python allocation per request. The JSON report carries the git
+revision, so runs can be compared across versions.
+
+    python bench_web.py --rows 200000 --servers 50 --concurrency 8 --out bench.json
+    python bench_web.py --app grid --url http://localhost:5000
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import perf
+
+# (method, path, JSON body); /api/stream never ends, so it is left out
+MONITORING_ROUTES = [
+    ('GET', '/', None),
+    ('GET', '/api/metrics/latest', None),
+    ('GET', '/api/metrics/historical?hours=1', None),
+    ('GET', '/api/metrics/historical?hours=24&max_points=500', None),
+    ('GET', '/api/metrics/historical?hours=24&resolution=1h', None),
+    ('GET', '/api/metrics/historical?format=ndjson&limit=1000', None),
+    ('GET', '/api/alerts', None),
+    ('GET', '/api/alerts/rules', None),
+    ('GET', '/api/metrics/average', None),
+    ('GET', '/api/metrics/stats?hours=24', None),
+    ('GET', '/api/hosts', None),
+    ('GET', '/api/cache/stats', None),
+    ('POST', '/api/metrics/batch', [{'hostname': 'bench-push', 'cpu_percent': 42.0,
+                                     'memory_percent': 50.0, 'disk_percent': 60.0}]),
+]
+GRID_ROUTES = [
+    ('GET', '/', None),
+    ('GET', '/api/servers', None),
+    ('GET', '/api/servers/web-server-01', None),
+    ('GET', '/api/ntp-drift/history?hours=24', None),
+    ('GET', '/api/ntp-drift/history?hours=24&server_id=1', None),
+    ('GET', '/api/summary', None),
+    ('GET', '/api/collector', None),
+    ('POST', '/api/check-ntp/web-server-01', None),
+]
+SKIPPED_ROUTES = {'/api/stream', '/static/<path:filename>', '/debug/perf', '/debug/perf/profiles'}
+ALLOCATION_SAMPLES = 5
+
+
+def instrument_sqlite():
+    """Give connections opened without a factory perf's timed cursors too"""
+    connect = sqlite3.connect
+    if getattr(connect, 'instrumented', False):
+        return
+
+    def timed_connect(*args, **kwargs):
+        kwargs.setdefault('factory', perf.TimedConnection)
+        return connect(*args, **kwargs)
+    timed_connect.instrumented = True
+    sqlite3.connect = timed_connect
+
+
+# Seeding
+
+def seed_monitoring(path, rows, hosts=1, interval_minutes=1):
+    """Fresh monitoring database at the latest schema with rows samples"""
+    import schema
+    import setup_db
+    from alert_rules import RuleEngine
+    from ingest import IngestWriter
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL').fetchone()
+    schema.migrate(conn)
+    conn.close()
+
+    def samples():
+        for i, sample in enumerate(setup_db.historical_samples(rows, interval_minutes)):
+            if hosts > 1:
+                sample['hostname'] = f'bench-{i % hosts:03d}'
+            yield sample
+
+    with IngestWriter(path, rules=RuleEngine()) as writer:
+        writer.bulk_load(samples())
+
+
+def seed_grid(path, servers=10, history=100):
+    """Fresh grid database with servers hosts and history samples each over 24h"""
+    import grid
+    import timeseries
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    grid.DATABASE = path
+    grid.init_database()
+
+    conn = sqlite3.connect(path)
+    existing = conn.execute('SELECT COUNT(*) FROM servers').fetchone()[0]
+    locations = ['US-East', 'US-West', 'EU-West', 'AP-Southeast']
+    environments = ['production', 'staging', 'management', 'backup']
+    conn.executemany('''
+        INSERT INTO servers (name, ip_address, location, environment) VALUES (?, ?, ?, ?)
+    ''', ((f'bench-server-{i:04d}', f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}',
+           locations[i % len(locations)], environments[i % len(environments)])
+          for i in range(existing, servers)))
+
+    now = time.time()
+    step = 24 * 3600 / max(history, 1)
+    server_ids = [row[0] for row in conn.execute('SELECT id FROM servers')]
+
+    def rows():
+        for n in range(history):
+            # UTC, like the grid's own writes
+            stamp = timeseries.format_timestamp(now - (history - n) * step)
+            for server_id in server_ids:
+                up = random.random() < 0.9
+                yield (server_id, stamp, 'up' if up else 'down',
+                       random.uniform(5, 150) if up else 0,
+                       round(random.uniform(-150, 150), 2) if up else None,
+                       random.randint(10, 95) if up else 0, random.randint(20, 90) if up else 0,
+                       random.randint(30, 85) if up else 0, random.randint(8, 12) if up else 0, 12,
+                       stamp if up else None)
+    conn.executemany('''
+        INSERT INTO server_metrics
+        (server_id, timestamp, status, response_time, ntp_drift, cpu_usage, memory_usage,
+         disk_usage, services_running, services_total, last_ntp_sync)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows())
+    conn.commit()
+    conn.close()
+
+
+def load_monitoring_app(path):
+    """app.py bound to the database at path"""
+    import app
+    from db_pool import ConnectionPool
+
+    app.DATABASE = path
+    app.db_pool.close()
+    app.db_pool = ConnectionPool(path, size=app.DB_POOL_SIZE, busy_timeout_ms=app.DB_BUSY_TIMEOUT_MS,
+                                 factory=perf.TimedConnection)
+    app.dashboard_snapshot = app.DashboardSnapshot()
+    app.stats_cache = app.metric_stats.StatsCache()
+    return app.app
+
+
+def load_grid_app(path):
+    """grid.py bound to the database at path"""
+    import grid
+
+    # get_metrics_writer() opens a writer for this path on first use
+    grid.DATABASE = path
+    # Prime the background collector so no timed request waits for the first sweep
+    grid.collector.collect()
+    return grid.app
+
+
+# Drivers
+
+class TestClientDriver:
+    """Runs requests in process; measures SQLite time and allocations too"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.flask_app.test_client()
+        return client
+
+    def request(self, method, path, body):
+        perf.begin_request()
+        started = time.perf_counter()
+        response = self._client().open(path, method=method, json=body)
+        response.get_data()
+        elapsed = time.perf_counter() - started
+        response.close()
+        queries, sql_seconds, _, _ = perf.request_totals()
+        return response.status_code, elapsed, queries, sql_seconds
+
+    def allocation(self, method, path, body):
+        """Peak traced bytes while serving one request"""
+        client = self._client()
+        tracemalloc.start()
+        try:
+            peaks = []
+            for _ in range(ALLOCATION_SAMPLES):
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                client.open(path, method=method, json=body).get_data()
+                peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        finally:
+            tracemalloc.stop()
+        return int(statistics.median(peaks))
+
+
+class HTTPDriver:
+    """Runs requests against a live server; SQLite and allocation figures are unavailable"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def request(self, method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.url + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as exc:
+            exc.read()
+            status = exc.code
+        except OSError:
+            status = 0
+        return status, time.perf_counter() - started, None, None
+
+    def allocation(self, method, path, body):
+        return None
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(int(len(sorted_values) * q / 100), len(sorted_values) - 1)]
+
+
+def bench_route(driver, method, path, body, requests, concurrency):
+    """Drive one route and summarise it"""
+    driver.request(method, path, body)  # warm caches and connections
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: driver.request(method, path, body), range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(result[1] * 1000 for result in results)
+    report = {
+        'requests': requests,
+        'errors': sum(1 for result in results if result[0] == 0 or result[0] >= 500),
+        'statuses': dict(Counter(str(result[0]) for result in results)),
+        'rps': round(requests / elapsed, 1),
+        'latency_ms': {
+            'mean': round(statistics.fmean(latencies), 3),
+            'p50': round(percentile(latencies, 50), 3),
+            'p90': round(percentile(latencies, 90), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(latencies[-1], 3),
+        },
+    }
+    if results[0][2] is not None:
+        queries = sum(result[2] for result in results)
+        sqlite_seconds = sum(result[3] for result in results)
+        report['sqlite'] = {
+            'queries_per_request': round(queries / requests, 2),
+            'ms_per_request': round(sqlite_seconds * 1000 / requests, 3),
+            'ms_per_query': round(sqlite_seconds * 1000 / queries, 4) if queries else None,
+        }
+    allocation = driver.allocation(method, path, body)
+    if allocation is not None:
+        report['peak_alloc_bytes_per_request'] = allocation
+    return report
+
+
+def uncovered_routes(flask_app, routes):
+    """Routes registered on the app that the benchmark does not exercise"""
+    covered = {path.split('?')[0] for _, path, _ in routes}
+    missing = []
+    for rule in flask_app.url_map.iter_rules():
+        if rule.rule in SKIPPED_ROUTES or rule.rule in covered:
+            continue
+        if '<' in rule.rule and any(_matches(rule, path) for path in covered):
+            continue
+        missing.append(rule.rule)
+    return missing
+
+
+def _matches(rule, path):
+    prefix = rule.rule.split('<')[0]
+    return path.startswith(prefix) and path.count('/') == rule.rule.count('/')
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(apps, rows, hosts, servers, history, requests, concurrency, url=None, db_dir='.'):
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'started': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'mode': 'http' if url else 'test_client',
+            'concurrency': concurrency,
+            'requests_per_route': requests,
+        },
+        'apps': {},
+    }
+    if url is None:
+        instrument_sqlite()
+
+    for name in apps:
+        if name == 'monitoring':
+            routes = MONITORING_ROUTES
+            if url is None:
+                path = os.path.join(db_dir, 'bench_web_monitoring.db')
+                started = time.perf_counter()
+                seed_monitoring(path, rows, hosts)
+                seeded = {'rows': rows, 'hosts': hosts, 'seconds': round(time.perf_counter() - started, 2)}
+                flask_app = load_monitoring_app(path)
+        else:
+            routes = GRID_ROUTES
+            if url is None:
+                path = os.path.join(db_dir, 'bench_web_servers.db')
+                started = time.perf_counter()
+                seed_grid(path, servers, history)
+                seeded = {'servers': servers, 'history_per_server': history,
+                          'seconds': round(time.perf_counter() - started, 2)}
+                flask_app = load_grid_app(path)
+
+        driver = HTTPDriver(url) if url else TestClientDriver(flask_app)
+        app_report = {'routes': {}}
+        if url is None:
+            app_report['seeded'] = seeded
+            app_report['not_benchmarked'] = uncovered_routes(flask_app, routes)
+        for method, route, body in routes:
+            print(f"  {name:<10} {method:<4} {route}", flush=True)
+            app_report['routes'][f'{method} {route}'] = bench_route(
+                driver, method, route, body, requests, concurrency)
+        report['apps'][name] = app_report
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--app', choices=['monitoring', 'grid', 'both'], default='both')
+    parser.add_argument('--rows', type=int, default=100000, help='monitoring samples to seed')
+    parser.add_argument('--hosts', type=int, default=1, help='monitoring hosts the samples are spread over')
+    parser.add_argument('--servers', type=int, default=10, help='grid servers to seed')
+    parser.add_argument('--history', type=int, default=288, help='grid samples per server over 24h')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--url', help='benchmark a running server instead of the test client '
+                                      '(it must already have data; nothing is seeded)')
+    parser.add_argument('--db-dir', default='.', help='directory for the scratch databases')
+    parser.add_argument('--out', help='write the JSON report here as well as stdout')
+    args = parser.parse_args()
+
+    if args.url and args.app == 'both':
+        parser.error('--url serves one app; choose --app monitoring or --app grid')
+    apps = ['monitoring', 'grid'] if args.app == 'both' else [args.app]
+    result = run(apps, args.rows, args.hosts, args.servers, args.history, args.requests,
+                 args.concurrency, args.url, args.db_dir)
+    output = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+    print(output)
@@ -0,0 +1,100 @@
+"""Single shared tail of monitoring.db fanned out to many live subscribers.
+
+One background thread watches the database and reads each new
+system_metrics row and alert exactly once, however many dashboards are
+connected. It checks ``PRAGMA data_version`` every tick, which only changes
+when another connection commits, so an idle database costs one pragma per
+poll interval rather than one query per viewer.
+"""
+import queue
+import sqlite3
+import threading
+
+POLL_INTERVAL = 2.0
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class MetricsBroadcaster:
+    """Tails system_metrics and alerts and pushes new rows to subscriber queues"""
+
+    def __init__(self, database, poll_interval=POLL_INTERVAL):
+        self.database = database
+        self.poll_interval = poll_interval
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.polls = 0
+        self.queries = 0
+
+    def subscribe(self):
+        """Register a new subscriber and return its queue of (event, data)"""
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='metrics-broadcaster', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def is_subscribed(self, subscriber):
+        with self._lock:
+            return subscriber in self._subscribers
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stop(self):
+        self._stop.set()
+
+    def _publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, data))
+            except queue.Full:
+                # A stalled client must not hold up everyone else
+                self.unsubscribe(subscriber)
+
+    def _run(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        try:
+            last_metric_id, last_alert_id = conn.execute('''
+                SELECT COALESCE((SELECT MAX(id) FROM system_metrics), 0),
+                       COALESCE((SELECT MAX(id) FROM alerts), 0)
+            ''').fetchone()
+            data_version = None
+
+            while not self._stop.wait(self.poll_interval):
+                if not self.subscriber_count():
+                    continue
+                self.polls += 1
+                current = conn.execute('PRAGMA data_version').fetchone()[0]
+                if current == data_version:
+                    continue
+                data_version = current
+                self.queries += 1
+
+                for row in conn.execute('''
+                    SELECT id, timestamp, ts, hostname, cpu_percent, memory_percent,
+                           disk_percent, temperature, load_average_1min
+                    FROM system_metrics WHERE id > ? ORDER BY id ASC
+                ''', (last_metric_id,)).fetchall():
+                    last_metric_id = row['id']
+                    self._publish('metrics', dict(row))
+
+                for row in conn.execute('''
+                    SELECT * FROM alerts WHERE id > ? ORDER BY id ASC
+                ''', (last_alert_id,)).fetchall():
+                    last_alert_id = row['id']
+                    self._publish('alert', dict(row))
+        finally:
+            conn.close()
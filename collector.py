@@ -0,0 +1,206 @@
+"""Low-overhead Linux metrics collector producing system_metrics samples.
+
+The /proc and thermal files are opened once and re-read with os.pread at
+offset 0, which makes the kernel regenerate their contents without a new
+open/close per sample. CPU usage is the busy share of the jiffies elapsed
+since the previous sample.
+
+    python collector.py --interval 0.5              # write to monitoring.db
+    python collector.py --push http://host:5000     # POST batches to app.py
+    python collector.py --bench 2000                # per-sample cost
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import socket
+import statistics
+import time
+import urllib.request
+
+READ_SIZE = 16384
+
+
+class ProcCollector:
+    """Reads CPU, memory, disk, load, uptime and temperature from /proc and /sys"""
+
+    def __init__(self, disk_path='/', hostname=None):
+        self.disk_path = disk_path
+        self.hostname = hostname or socket.gethostname()
+        self._stat = os.open('/proc/stat', os.O_RDONLY)
+        self._meminfo = os.open('/proc/meminfo', os.O_RDONLY)
+        self._loadavg = os.open('/proc/loadavg', os.O_RDONLY)
+        self._uptime = os.open('/proc/uptime', os.O_RDONLY)
+        self._thermal = []
+        for path in sorted(glob.glob('/sys/class/thermal/thermal_zone*/temp')):
+            try:
+                self._thermal.append(os.open(path, os.O_RDONLY))
+            except OSError:
+                pass
+        self._last_cpu = self._read_cpu()
+
+    def close(self):
+        for fd in [self._stat, self._meminfo, self._loadavg, self._uptime] + self._thermal:
+            os.close(fd)
+        self._thermal = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _read_cpu(self):
+        """(busy, total) jiffies from the aggregate cpu line"""
+        data = os.pread(self._stat, READ_SIZE, 0)
+        fields = data[:data.index(b'\n')].split()[1:9]
+        values = [int(field) for field in fields]
+        idle = values[3] + values[4]  # idle + iowait
+        total = sum(values)
+        return total - idle, total
+
+    def _read_meminfo(self):
+        """(total, available) in bytes"""
+        total = available = None
+        for line in os.pread(self._meminfo, READ_SIZE, 0).splitlines():
+            if line.startswith(b'MemTotal:'):
+                total = int(line.split()[1]) * 1024
+            elif line.startswith(b'MemAvailable:'):
+                available = int(line.split()[1]) * 1024
+                break
+        return total, available
+
+    def _read_temperature(self):
+        """Hottest thermal zone in degrees C, or None when there are none"""
+        readings = []
+        for fd in self._thermal:
+            try:
+                readings.append(int(os.pread(fd, 32, 0)) / 1000.0)
+            except (OSError, ValueError):
+                continue
+        return round(max(readings), 1) if readings else None
+
+    def _count_processes(self):
+        return sum(1 for entry in os.scandir('/proc') if entry.name.isdigit())
+
+    def sample(self):
+        """One metrics dict in system_metrics column names"""
+        busy, total = self._read_cpu()
+        last_busy, last_total = self._last_cpu
+        self._last_cpu = (busy, total)
+        elapsed = total - last_total
+        cpu = (busy - last_busy) * 100.0 / elapsed if elapsed > 0 else 0.0
+
+        mem_total, mem_available = self._read_meminfo()
+        mem_used = mem_total - mem_available if mem_total and mem_available is not None else None
+
+        disk = os.statvfs(self.disk_path)
+        disk_total = disk.f_blocks * disk.f_frsize
+        disk_used = (disk.f_blocks - disk.f_bfree) * disk.f_frsize
+
+        load = os.pread(self._loadavg, 128, 0).split()
+        uptime = float(os.pread(self._uptime, 64, 0).split()[0])
+
+        return {
+            'ts': int(time.time()),
+            'hostname': self.hostname,
+            'cpu_percent': round(cpu, 1),
+            'memory_percent': round(mem_used * 100.0 / mem_total, 1) if mem_used is not None else None,
+            'memory_used': mem_used,
+            'memory_total': mem_total,
+            'disk_percent': round(disk_used * 100.0 / disk_total, 1) if disk_total else None,
+            'disk_used': disk_used,
+            'disk_total': disk_total,
+            'process_count': self._count_processes(),
+            'uptime_seconds': int(uptime),
+            'temperature': self._read_temperature(),
+            'load_average_1min': float(load[0]),
+            'load_average_5min': float(load[1]),
+            'load_average_15min': float(load[2]),
+        }
+
+
+def benchmark(samples=2000, interval=0.5):
+    """Time sample() and project the CPU share at the given interval"""
+    with ProcCollector() as collector:
+        collector.sample()
+        wall = []
+        cpu_started = time.process_time()
+        for _ in range(samples):
+            started = time.perf_counter()
+            collector.sample()
+            wall.append((time.perf_counter() - started) * 1e6)
+        cpu_per_sample = (time.process_time() - cpu_started) / samples
+
+    wall.sort()
+    return {
+        'samples': samples,
+        'mean_us': round(statistics.fmean(wall), 1),
+        'p50_us': round(wall[len(wall) // 2], 1),
+        'p99_us': round(wall[int(len(wall) * 0.99) - 1], 1),
+        'cpu_us_per_sample': round(cpu_per_sample * 1e6, 1),
+        'interval_s': interval,
+        'cpu_percent_at_interval': round(cpu_per_sample / interval * 100, 4),
+    }
+
+
+def push_batch(url, samples, timeout=10):
+    """POST samples gzip-compressed to app.py's /api/metrics/batch"""
+    body = gzip.compress(json.dumps(samples).encode())
+    req = urllib.request.Request(
+        url.rstrip('/') + '/api/metrics/batch', data=body, method='POST',
+        headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return json.load(response)
+
+
+def run(interval=1.0, push_url=None, batch_size=10, database='monitoring.db'):
+    """Collect forever, writing locally or pushing batches to a server"""
+    writer = None
+    if push_url is None:
+        from alert_rules import RuleEngine
+        from ingest import BufferFull, IngestWriter
+        writer = IngestWriter(database, rules=RuleEngine())
+
+    pending = []
+    next_tick = time.monotonic()
+    with ProcCollector() as collector:
+        try:
+            while True:
+                sample = collector.sample()
+                if writer is not None:
+                    try:
+                        writer.add_metrics(sample)
+                    except BufferFull as exc:
+                        # The database has been failing for a while; skip this sample
+                        print(f"Write backlog full ({exc}); sample skipped")
+                else:
+                    pending.append(sample)
+                    if len(pending) >= batch_size:
+                        try:
+                            push_batch(push_url, pending)
+                            pending = []
+                        except OSError as exc:
+                            # Keep the samples and retry with the next batch
+                            print(f"Push failed ({exc}); {len(pending)} samples pending")
+                next_tick += interval
+                time.sleep(max(0.0, next_tick - time.monotonic()))
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between samples')
+    parser.add_argument('--push', metavar='URL', help='POST batches to this app.py server')
+    parser.add_argument('--batch', type=int, default=10, help='samples per pushed batch')
+    parser.add_argument('--db', default='monitoring.db')
+    parser.add_argument('--bench', type=int, metavar='N', help='benchmark N samples and exit')
+    args = parser.parse_args()
+
+    if args.bench:
+        print(json.dumps(benchmark(args.bench, args.interval), indent=2))
+    else:
+        run(args.interval, args.push, args.batch, args.db)
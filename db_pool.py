@@ -0,0 +1,118 @@
+import sqlite3
+import threading
+import time
+import contextlib
+from collections import deque
+
+# Defaults shared by the dashboards; override per pool if needed
+POOL_SIZE = 8
+BUSY_TIMEOUT_MS = 5000
+CACHED_STATEMENTS = 128
+ACQUIRE_TIMEOUT = 10.0  # seconds to wait for a free connection once `size` are open
+
+
+class ConnectionPool:
+    """A small pool of long-lived SQLite connections running in WAL mode.
+
+    Connections are borrowed for the length of a ``with`` block and then put
+    back, so the sqlite3 prepared statement cache of each connection is reused
+    across requests instead of being thrown away with the connection. At most
+    ``size`` connections exist at once; further borrowers wait for one to come
+    back and give up with TimeoutError after ``acquire_timeout`` seconds.
+    """
+
+    def __init__(self, database, size=POOL_SIZE, busy_timeout_ms=BUSY_TIMEOUT_MS,
+                 cached_statements=CACHED_STATEMENTS, wal=True, factory=sqlite3.Connection,
+                 acquire_timeout=ACQUIRE_TIMEOUT):
+        self.database = database
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self.wal = wal
+        self.factory = factory
+        self.acquire_timeout = acquire_timeout
+        self._idle = deque()
+        self._open = 0  # connections handed out or idle
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._closed = False
+
+    def _connect(self):
+        """Open and configure a new connection"""
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.busy_timeout_ms / 1000.0,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+            factory=self.factory,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout_ms)}')
+        if self.wal:
+            # WAL lets readers run while the ingest process is writing
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def acquire(self, timeout=None):
+        """Take an idle connection, open one while fewer than size exist, or wait for one"""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._available:
+            while not self._idle and self._open >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._closed:
+                    raise TimeoutError(f'No free connection to {self.database} within {timeout}s '
+                                       f'({self.size} in use)')
+                self._available.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._open += 1
+        try:
+            return self._connect()
+        except BaseException:
+            with self._available:
+                self._open -= 1
+                self._available.notify()
+            raise
+
+    def release(self, conn):
+        """Return a connection to the pool, or close it once the pool is closed"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # A connection that cannot roll back is not handed out again
+            self._discard(conn)
+            return
+        with self._available:
+            if not self._closed:
+                self._idle.append(conn)
+                self._available.notify()
+                return
+        self._discard(conn)
+
+    def _discard(self, conn):
+        with self._available:
+            self._open -= 1
+            self._available.notify()
+        conn.close()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with-block"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close every idle connection and stop pooling new ones"""
+        with self._available:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._open -= len(idle)
+            self._available.notify_all()
+        for conn in idle:
+            conn.close()
@@ -0,0 +1,180 @@
+"""Per-server NTP drift anomaly detection for grid.py.
+
+Every server has its own baseline, an exponentially weighted mean and
+variance of its drift. A sample is anomalous when it lies more than
+`threshold` standard deviations from that server's mean, once the server
+has at least `warmup` samples. A fixed cutoff cannot do this: a server
+that always runs 120 ms ahead is normal for itself, while a 60 ms jump on
+a server that sits at 2 ms is not.
+
+The state is one slot per server in flat arrays. update() scores and then
+folds in a whole sweep at once: one vectorized pass with numpy, or a
+plain loop over the same arrays without it.
+"""
+import math
+import threading
+import time
+from array import array
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ALPHA = 0.1  # weight of the newest sample in the EWMA
+THRESHOLD = 4.0  # standard deviations
+WARMUP = 10  # samples before a server can be flagged
+MIN_STD_MS = 1.0  # floor so a perfectly steady server is not flagged for tiny moves
+RECENT_EVENTS = 500
+
+
+class DriftAnomalyDetector:
+    """EWMA mean/variance of drift per server, scored a sweep at a time"""
+
+    def __init__(self, alpha=ALPHA, threshold=THRESHOLD, warmup=WARMUP, min_std=MIN_STD_MS):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.min_std = min_std
+        self._lock = threading.Lock()
+        self.slots = {}  # server_id -> index into the state arrays
+        self.mean = self._zeros(0)
+        self.var = self._zeros(0)
+        self.count = self._zeros(0)
+        self.current = {}  # server_id -> latest anomaly, for servers flagged by the last sample
+        self.recent = deque(maxlen=RECENT_EVENTS)
+        self.sweeps = 0
+        self.last_update_ms = None
+
+    @staticmethod
+    def _zeros(n):
+        return np.zeros(n) if np is not None else array('d', bytes(8 * n))
+
+    def _slot_indices(self, server_ids):
+        new = [server_id for server_id in server_ids if server_id not in self.slots]
+        if new:
+            for server_id in new:
+                self.slots[server_id] = len(self.slots)
+            grow = self._zeros(len(new))
+            if np is not None:
+                self.mean = np.concatenate([self.mean, grow])
+                self.var = np.concatenate([self.var, grow])
+                self.count = np.concatenate([self.count, grow])
+            else:
+                self.mean.extend(grow)
+                self.var.extend(grow)
+                self.count.extend(grow)
+        return [self.slots[server_id] for server_id in server_ids]
+
+    def _score(self, slots, values):
+        """(flags, means, stds, zscores) before folding values in, then update the state"""
+        alpha = self.alpha
+        if np is not None:
+            slots = np.asarray(slots, dtype=np.intp)
+            x = np.asarray(values, dtype=float)
+            mean, var, count = self.mean[slots], self.var[slots], self.count[slots]
+            std = np.maximum(np.sqrt(var), self.min_std)
+            z = (x - mean) / std
+            flags = (count >= self.warmup) & (np.abs(z) > self.threshold)
+            diff = x - mean
+            increment = alpha * diff
+            first = count == 0
+            self.mean[slots] = np.where(first, x, mean + increment)
+            self.var[slots] = np.where(first, 0.0, (1 - alpha) * (var + diff * increment))
+            self.count[slots] = count + 1
+            return flags.tolist(), mean.tolist(), std.tolist(), z.tolist()
+
+        flags, means, stds, zscores = [], [], [], []
+        for slot, x in zip(slots, values):
+            mean, var, count = self.mean[slot], self.var[slot], self.count[slot]
+            std = max(math.sqrt(var), self.min_std)
+            z = (x - mean) / std
+            flags.append(count >= self.warmup and abs(z) > self.threshold)
+            means.append(mean)
+            stds.append(std)
+            zscores.append(z)
+            if count == 0:
+                self.mean[slot], self.var[slot] = x, 0.0
+            else:
+                diff = x - mean
+                increment = alpha * diff
+                self.mean[slot] = mean + increment
+                self.var[slot] = (1 - alpha) * (var + diff * increment)
+            self.count[slot] = count + 1
+        return flags, means, stds, zscores
+
+    def update(self, server_ids, drifts, ts=None, complete=False):
+        """Score one sweep (drift None = no sample) and return the anomalies it raised.
+
+        A server without a sample is no longer listed as anomalous. With
+        complete=True server_ids is the whole fleet, so flagged servers
+        missing from it are dropped too.
+        """
+        started = time.perf_counter()
+        ts = ts or time.time()
+        pairs = [(server_id, drift) for server_id, drift in zip(server_ids, drifts) if drift is not None]
+        ids = [server_id for server_id, _ in pairs]
+        values = [drift for _, drift in pairs]
+        with self._lock:
+            sampled = set(ids)
+            expired = self.current.keys() - sampled if complete else set(server_ids) - sampled
+            for server_id in expired:
+                self.current.pop(server_id, None)
+            if not pairs:
+                return []
+            flags, means, stds, zscores = self._score(self._slot_indices(ids), values)
+            anomalies = []
+            for server_id, value, flagged, mean, std, z in zip(ids, values, flags, means, stds, zscores):
+                if not flagged:
+                    self.current.pop(server_id, None)
+                    continue
+                anomaly = {
+                    'server_id': server_id,
+                    'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts)),
+                    'ntp_drift': value,
+                    'expected': round(mean, 3),
+                    'std': round(std, 3),
+                    'zscore': round(z, 2),
+                }
+                self.current[server_id] = anomaly
+                self.recent.append(anomaly)
+                anomalies.append(anomaly)
+            self.sweeps += 1
+            self.last_update_ms = round((time.perf_counter() - started) * 1000, 3)
+        return anomalies
+
+    def prime(self, histories):
+        """Learn baselines from {server_id: [drift, ...]} (oldest first) without flagging anything"""
+        histories = {server_id: values for server_id, values in histories.items() if values}
+        depth = max((len(values) for values in histories.values()), default=0)
+        with self._lock:
+            for step in range(depth):
+                # Align histories on their newest sample so every server ends on the same step
+                pairs = [(server_id, values[len(values) - depth + step])
+                         for server_id, values in histories.items() if len(values) - depth + step >= 0]
+                self._score(self._slot_indices([server_id for server_id, _ in pairs]),
+                            [value for _, value in pairs])
+        return len(histories)
+
+    def baseline(self, server_id):
+        with self._lock:
+            slot = self.slots.get(server_id)
+            if slot is None:
+                return None
+            return {'mean': round(float(self.mean[slot]), 3),
+                    'std': round(math.sqrt(self.var[slot]), 3),
+                    'samples': int(self.count[slot])}
+
+    def report(self, recent=50):
+        with self._lock:
+            return {
+                'anomalous': [dict(anomaly) for anomaly in sorted(
+                    self.current.values(), key=lambda anomaly: -abs(anomaly['zscore']))],
+                'recent': [dict(anomaly) for anomaly in list(self.recent)[-recent:][::-1]] if recent else [],
+                'servers_tracked': len(self.slots),
+                'sweeps': self.sweeps,
+                'last_update_ms': self.last_update_ms,
+                'params': {'alpha': self.alpha, 'threshold': self.threshold, 'warmup': self.warmup,
+                           'min_std_ms': self.min_std, 'vectorized': np is not None},
+            }
@@ -0,0 +1,154 @@
+"""Incrementally maintained fleet summary for grid.py.
+
+FleetSummary keeps the contribution of every server to the totals and
+removes the old one before adding the new one whenever that server's state
+changes. Each update is O(1) whatever the fleet size. Reading the summary
+costs O(buckets + locations + environments) and never walks the server
+list.
+
+Drift is summed in integer microseconds so that adding and removing the
+same values cannot accumulate float error. Percentiles come from
+fixed-bucket histograms and are estimated as the upper bound of the
+bucket holding the rank, as in perf.RollingHistogram; ranks beyond the
+last bound report the last bound. Drift percentiles are of |drift|.
+"""
+import math
+import threading
+from bisect import bisect_left
+
+CRITICAL_DRIFT_MS = 100
+DRIFT_BOUNDS_MS = (1, 2, 5, 10, 20, 35, 50, 75, 100, 150, 200, 300, 500, 750, 1000)
+RESPONSE_BOUNDS_MS = (1, 2, 5, 10, 20, 35, 50, 75, 100, 150, 200, 300, 500, 1000, 2000)
+PERCENTILES = (50, 90, 99)
+
+
+class BucketCounts:
+    """Histogram that supports removing an observation as well as adding one"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+
+    def add(self, value, n=1):
+        self.counts[bisect_left(self.bounds, value)] += n
+        self.total += n
+
+    def percentile(self, q):
+        if not self.total:
+            return None
+        rank, seen = math.ceil(self.total * q / 100), 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.bounds[min(i, len(self.bounds) - 1)]
+        return self.bounds[-1]
+
+    def percentiles(self):
+        return {f'p{q}': self.percentile(q) for q in PERCENTILES}
+
+
+class Group:
+    """Counters for the whole fleet or one location/environment"""
+
+    __slots__ = ('total', 'up', 'critical', 'drift_us', 'drift_count')
+
+    def __init__(self):
+        self.total = self.up = self.critical = self.drift_us = self.drift_count = 0
+
+    def add(self, entry, n):
+        up, drift_us, critical = entry[0], entry[1], entry[3]
+        self.total += n
+        if up:
+            self.up += n
+            self.critical += n * critical
+            if drift_us is not None:
+                self.drift_us += n * drift_us
+                self.drift_count += n
+
+    def summary(self):
+        return {
+            'total': self.total,
+            'up': self.up,
+            'down': self.total - self.up,
+            'avg_drift': round(self.drift_us / self.drift_count / 1000, 2) if self.drift_count else 0,
+            'critical_drift': self.critical,
+        }
+
+
+class FleetSummary:
+    """Totals, drift/response percentiles and per-location/environment breakdowns"""
+
+    def __init__(self, critical_drift_ms=CRITICAL_DRIFT_MS):
+        self.critical_drift_ms = critical_drift_ms
+        self._lock = threading.Lock()
+        self._entries = {}  # server_id -> (up, drift_us, response_time, critical, location, environment)
+        self.fleet = Group()
+        self.locations = {}
+        self.environments = {}
+        self.drift = BucketCounts(DRIFT_BOUNDS_MS)
+        self.response_time = BucketCounts(RESPONSE_BOUNDS_MS)
+        self.updates = 0
+
+    def _entry(self, server):
+        up = server['status'] == 'up'
+        drift = server.get('ntp_drift')
+        drift_us = round(drift * 1000) if drift is not None else None
+        critical = int(up and drift is not None and abs(drift) > self.critical_drift_ms)
+        return (up, drift_us, server.get('response_time'), critical,
+                server.get('location') or 'unknown', server.get('environment') or 'unknown')
+
+    def _apply(self, entry, n):
+        """Add (n=1) or remove (n=-1) one server's contribution"""
+        up, drift_us, response_time = entry[0], entry[1], entry[2]
+        self.fleet.add(entry, n)
+        for groups, key in ((self.locations, entry[4]), (self.environments, entry[5])):
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = Group()
+            group.add(entry, n)
+            if not group.total:
+                del groups[key]
+        if up:
+            if drift_us is not None:
+                self.drift.add(abs(drift_us) / 1000, n)
+            if response_time is not None:
+                self.response_time.add(response_time, n)
+
+    def update(self, server):
+        """Record the current state of one server dict (id, status, ntp_drift, ...)"""
+        entry = self._entry(server)
+        with self._lock:
+            old = self._entries.get(server['id'])
+            if old == entry:
+                return
+            if old is not None:
+                self._apply(old, -1)
+            self._apply(entry, 1)
+            self._entries[server['id']] = entry
+            self.updates += 1
+
+    def remove(self, server_id):
+        with self._lock:
+            old = self._entries.pop(server_id, None)
+            if old is not None:
+                self._apply(old, -1)
+
+    def sync(self, servers):
+        """Update from a full sweep and drop servers that are no longer listed"""
+        current = {server['id'] for server in servers}
+        with self._lock:
+            gone = [server_id for server_id in self._entries if server_id not in current]
+        for server_id in gone:
+            self.remove(server_id)
+        for server in servers:
+            self.update(server)
+
+    def stats(self):
+        with self._lock:
+            stats = self.fleet.summary()
+            stats['drift_percentiles'] = self.drift.percentiles()
+            stats['response_time_percentiles'] = self.response_time.percentiles()
+            stats['by_location'] = {key: group.summary() for key, group in sorted(self.locations.items())}
+            stats['by_environment'] = {key: group.summary() for key, group in sorted(self.environments.items())}
+            return stats
@@ -5,9 +5,35 @@ import random
 import subprocess
 import socket
 import time
+import asyncio
+import threading
+import perf
+import probe
+import timeseries
+from grid_writer import MetricsWriter
+from fleet import FleetSummary
+from server_index import ServerIndex, SORT_FIELDS
+from drift_anomaly import DriftAnomalyDetector
 
 app = Flask(__name__)
 DATABASE = 'servers.db'
+PERF_SLOW_REQUEST_MS = 500
+PERF_PROFILE_RATE = 0.0  # fraction of requests run under cProfile
+COLLECT_INTERVAL = 30  # seconds between background sweeps of every server
+COLLECT_STARTUP_WAIT = 10  # seconds a request waits for the very first sweep
+PROBE_SERVERS = False  # True: real TCP/NTP probes (probe.py) instead of simulated checks
+SERVER_FIELDS = ('id', 'name', 'ip_address', 'location', 'environment', 'status', 'response_time',
+                 'ntp_drift', 'cpu_usage', 'memory_usage', 'disk_usage', 'services_running',
+                 'services_total', 'last_ntp_sync', 'last_check', 'drift_history', 'drift_timestamps')
+DRIFT_HISTORY_POINTS = 20  # drift points per server on the dashboard sparklines
+SERIES_POINTS = 2880  # in-memory samples kept per server (24h at the default interval)
+SERIES_MEMORY_BUDGET = 64 * 1024 * 1024  # bytes for all in-memory series together
+SERIES_WARM_HOURS = 24  # history loaded into memory at startup
+ANOMALY_PRIME_POINTS = 100  # drift samples per server replayed into the anomaly baselines at startup
+CHART_BUCKETS = 24  # points on the dashboard drift chart
+MAX_CHART_BUCKETS = 1000
+CHART_SERVERS = 5  # servers drawn on the dashboard drift chart
+perf.install(app, slow_ms=PERF_SLOW_REQUEST_MS, profile_rate=PERF_PROFILE_RATE)
 
 # HTML Template with Server Grid
 HTML_TEMPLATE = '''
@@ -357,12 +383,13 @@ HTML_TEMPLATE = '''
         const chart = new Chart(ctx, {
             type: 'line',
             data: {
-                labels: {{ chart_labels | safe }},
+                labels: {{ chart_labels | tojson }},
                 datasets: [
-                    {% for server in servers[:5] %}
+                    {% for dataset in chart_datasets %}
                     {
-                        label: '{{ server.name }}',
-                        data: {{ server.drift_history | safe }},
+                        label: '{{ dataset.name }}',
+                        data: {{ dataset.data | tojson }},
+                        spanGaps: true,
                         borderColor: 'hsl({{ loop.index * 60 }}, 70%, 50%)',
                         tension: 0.1
                     },
@@ -393,6 +420,8 @@ HTML_TEMPLATE = '''
 def init_database():
     """Initialize the database with server information"""
     conn = sqlite3.connect(DATABASE)
+    # Readers keep going against the last commit while a sweep is written
+    conn.execute('PRAGMA journal_mode = WAL').fetchone()
     cursor = conn.cursor()
     
     # Create servers table
@@ -426,6 +455,12 @@ def init_database():
         )
     ''')
     
+    # Per-server history reads walk this index instead of sorting the table
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_server_metrics_server_time
+        ON server_metrics (server_id, timestamp)
+    ''')
+    
     # Insert sample servers if table is empty
     cursor.execute("SELECT COUNT(*) FROM servers")
     if cursor.fetchone()[0] == 0:
@@ -452,8 +487,8 @@ def init_database():
     conn.close()
 
 def get_db_connection():
-    """Create a database connection"""
-    conn = sqlite3.connect(DATABASE)
+    """Create a database connection whose statements are timed by perf"""
+    conn = sqlite3.connect(DATABASE, factory=perf.TimedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -483,24 +518,53 @@ def check_server_status(ip_address):
     
     return status, response_time
 
+probe_engine = probe.ProbeEngine()
+metrics_writers = {}  # database path -> its MetricsWriter
+metrics_writer_lock = threading.Lock()
+
+def get_metrics_writer():
+    """The single server_metrics writer for the current DATABASE, created on first use"""
+    with metrics_writer_lock:
+        writer = metrics_writers.get(DATABASE)
+        if writer is None:
+            writer = metrics_writers[DATABASE] = MetricsWriter(DATABASE)
+        return writer
+
+def log_write_failure(future):
+    """Done-callback for writer futures nobody else inspects"""
+    if future.exception() is not None:
+        app.logger.error('Writing server_metrics failed: %s', future.exception())
+
+series = timeseries.TimeSeriesStore(SERIES_POINTS, SERIES_MEMORY_BUDGET)
+
+def probe_servers(servers):
+    """(status, response_time, ntp_drift) per server id from one concurrent probe sweep"""
+    results = asyncio.run(probe_engine.sweep([dict(server) for server in servers]))
+    return {result['server_id']: (result['status'], result['response_time'], result['ntp_drift'])
+            for result in results}
+
 def generate_server_metrics():
-    """Generate current metrics for all servers"""
+    """Check every server, record the results and return (current metrics, recorded rows)"""
     conn = get_db_connection()
-    cursor = conn.cursor()
     
     # Get all servers
-    cursor.execute("SELECT * FROM servers")
-    servers = cursor.fetchall()
+    servers = conn.execute("SELECT * FROM servers").fetchall()
+    conn.close()
+    probed = probe_servers(servers) if PROBE_SERVERS else {}
     
     current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     server_data = []
+    rows = []
     
     for server in servers:
-        # Check server status
-        status, response_time = check_server_status(server['ip_address'])
-        
-        # Generate NTP drift
-        ntp_drift = simulate_ntp_drift() if status == 'up' else None
+        if PROBE_SERVERS:
+            status, response_time, ntp_drift = probed[server['id']]
+        else:
+            # Check server status
+            status, response_time = check_server_status(server['ip_address'])
+            
+            # Generate NTP drift
+            ntp_drift = simulate_ntp_drift() if status == 'up' else None
         
         # Generate other metrics
         if status == 'up':
@@ -518,29 +582,19 @@ def generate_server_metrics():
             last_sync = 'N/A'
             response_time = 0
         
-        # Insert metrics into database
-        cursor.execute('''
-            INSERT INTO server_metrics 
-            (server_id, status, response_time, ntp_drift, cpu_usage, 
-             memory_usage, disk_usage, services_running, services_total, last_ntp_sync)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            server['id'], status, response_time, ntp_drift, cpu, memory, disk,
-            services_running, services_total, 
-            datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") if status == 'up' else None
-        ))
-        
-        # Get last 24 hours of NTP drift for chart
-        cursor.execute('''
-            SELECT timestamp, ntp_drift FROM server_metrics 
-            WHERE server_id = ? AND timestamp >= datetime('now', '-24 hours')
-            AND ntp_drift IS NOT NULL
-            ORDER BY timestamp ASC
-        ''', (server['id'],))
-        
-        drift_history = cursor.fetchall()
-        drift_values = [row['ntp_drift'] for row in drift_history]
-        drift_timestamps = [row['timestamp'][11:16] for row in drift_history[-20:]]  # Last 20 points
+        # Row for server_metrics, written with the rest of the sweep
+        rows.append({
+            'server_id': server['id'],
+            'status': status,
+            'response_time': response_time,
+            'ntp_drift': ntp_drift,
+            'cpu_usage': cpu,
+            'memory_usage': memory,
+            'disk_usage': disk,
+            'services_running': services_running,
+            'services_total': services_total,
+            'last_ntp_sync': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") if status == 'up' else None,
+        })
         
         server_data.append({
             'id': server['id'],
@@ -558,77 +612,302 @@ def generate_server_metrics():
             'services_total': services_total,
             'last_ntp_sync': last_sync,
             'last_check': current_time,
-            'drift_history': drift_values[-20:] if drift_values else [0] * 20,
-            'drift_timestamps': drift_timestamps
         })
     
-    conn.commit()
-    conn.close()
-    return server_data
+    # One time for the sweep, taken once every server is checked, for both sqlite and memory (UTC)
+    sweep_ts = int(time.time())
+    sweep_stamp = timeseries.format_timestamp(sweep_ts)
+    for row in rows:
+        row['timestamp'] = sweep_stamp
+    
+    # One executemany for the whole sweep, on the writer thread
+    written = get_metrics_writer().submit(rows)
+    written.add_done_callback(log_write_failure)
+    series.append_many(sweep_ts, rows)
+    
+    # Last points of NTP drift for the charts: from memory once warmed, else one query
+    if series.warmed:
+        histories = get_series_drift_histories([server['id'] for server in server_data])
+    else:
+        written.result()
+        conn = get_db_connection()
+        histories = get_drift_histories(conn.cursor())
+        conn.close()
+    for server in server_data:
+        drift_values, drift_timestamps = histories.get(server['id'], ([], []))
+        server['drift_history'] = drift_values if drift_values else [0] * DRIFT_HISTORY_POINTS
+        server['drift_timestamps'] = drift_timestamps
+    
+    # Only a committed sweep is published, so the sqlite fallbacks can see it too;
+    # a failed commit fails the sweep instead of passing for a stored one
+    written.result()
+    return server_data, rows
+
+def get_series_drift_histories(server_ids, points=DRIFT_HISTORY_POINTS, hours=24):
+    """get_drift_histories() answered from the in-memory series"""
+    since = time.time() - hours * 3600
+    histories = {}
+    for server_id in server_ids:
+        times, values = series.last(server_id, 'ntp_drift', points, since)
+        if values:
+            histories[server_id] = (values, [time.strftime('%H:%M', time.gmtime(ts)) for ts in times])
+    return histories
 
-def calculate_summary_stats(servers):
-    """Calculate summary statistics"""
-    total = len(servers)
-    up = sum(1 for s in servers if s['status'] == 'up')
-    down = total - up
+def get_drift_histories(cursor, points=DRIFT_HISTORY_POINTS, hours=24):
+    """{server_id: (drift values, HH:MM labels)} of each server's last `points` drift samples"""
+    # Each server's top-N is a short backwards walk of idx_server_metrics_server_time,
+    # so only `points` rows per server are read rather than the whole window
+    cursor.execute('''
+        SELECT m.server_id, m.timestamp, m.ntp_drift
+        FROM servers s
+        JOIN server_metrics m ON m.id IN (
+            SELECT id FROM server_metrics
+            WHERE server_id = s.id AND ntp_drift IS NOT NULL
+            AND timestamp >= datetime('now', '-' || ? || ' hours')
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+        )
+        ORDER BY m.server_id, m.timestamp, m.id
+    ''', (hours, points))
     
-    # Calculate average NTP drift (only for up servers)
-    drifts = [s['ntp_drift'] for s in servers if s['status'] == 'up' and s['ntp_drift'] is not None]
-    avg_drift = round(sum(drifts) / len(drifts), 2) if drifts else 0
+    histories = {}
+    for row in cursor.fetchall():
+        values, labels = histories.setdefault(row['server_id'], ([], []))
+        values.append(row['ntp_drift'])
+        labels.append(row['timestamp'][11:16])
+    return histories
+
+def get_drift_buckets(cursor, since, width, count, server_ids=None):
+    """{server_id: (mins, avgs, maxes, counts)} of drift over count buckets of width seconds from since"""
+    # One grouped pass over the window: rows are folded into buckets inside sqlite
+    # and only servers x buckets rows come back
+    where, params = '', [since, width, timeseries.format_timestamp(since),
+                         timeseries.format_timestamp(since + width * count)]
+    if server_ids is not None:
+        where = f"AND server_id IN ({', '.join('?' for _ in server_ids)})"
+        params.extend(server_ids)
+    cursor.execute(f'''
+        SELECT server_id, (CAST(strftime('%s', timestamp) AS INTEGER) - ?) / ? AS bucket,
+               MIN(ntp_drift) AS min_drift, AVG(ntp_drift) AS avg_drift,
+               MAX(ntp_drift) AS max_drift, COUNT(*) AS samples
+        FROM server_metrics
+        WHERE ntp_drift IS NOT NULL AND timestamp >= ? AND timestamp < ? {where}
+        GROUP BY server_id, bucket
+    ''', params)
     
-    # Count servers with critical drift (>100ms)
-    critical_drift = sum(1 for s in servers if s['status'] == 'up' and abs(s['ntp_drift']) > 100)
+    buckets = {}
+    for row in cursor.fetchall():
+        mins, avgs, maxes, counts = buckets.setdefault(
+            row['server_id'], ([None] * count, [None] * count, [None] * count, [0] * count))
+        bucket = row['bucket']
+        mins[bucket], avgs[bucket], maxes[bucket] = row['min_drift'], row['avg_drift'], row['max_drift']
+        counts[bucket] = row['samples']
+    return buckets
+
+def drift_buckets(hours, count, server_ids=None):
+    """Chart-ready drift history: one time axis and per-server min/avg/max arrays of count buckets"""
+    width = max(1, -(-hours * 3600 // count))
+    # Buckets end on a multiple of their width so the axis holds still between refreshes
+    end = (int(time.time()) // width + 1) * width
+    since = end - width * count
     
+    # Served from memory when the in-memory series hold the whole window
+    buckets = series.buckets(since, width, count, 'ntp_drift', server_ids)
+    if buckets is not None:
+        for server_id, (mins, sums, maxes, counts) in buckets.items():
+            buckets[server_id] = (mins, [total / n if n else None for total, n in zip(sums, counts)],
+                                  maxes, counts)
+    else:
+        conn = get_db_connection()
+        buckets = get_drift_buckets(conn.cursor(), since, width, count, server_ids)
+        conn.close()
+    
+    label_format = '%H:%M' if hours <= 24 else '%m-%d %H:%M'
+    names = collector.index.servers
     return {
-        'total': total,
-        'up': up,
-        'down': down,
-        'avg_drift': avg_drift,
-        'critical_drift': critical_drift
+        'start': timeseries.format_timestamp(since),
+        'end': timeseries.format_timestamp(end),
+        'bucket_seconds': width,
+        'labels': [time.strftime(label_format, time.gmtime(since + width * i)) for i in range(count)],
+        'servers': [{
+            'server_id': server_id,
+            'name': names[server_id]['name'] if server_id in names else None,
+            'min': mins,
+            'avg': [round(value, 3) if value is not None else None for value in avgs],
+            'max': maxes,
+            'count': counts,
+        } for server_id, (mins, avgs, maxes, counts) in sorted(buckets.items())],
     }
 
+class ServerCollector:
+    """Sweeps every server on its own cadence and keeps the latest state in memory.
+
+    GET endpoints read snapshot(); only the background thread probes servers
+    and inserts into server_metrics. The thread starts with the first
+    snapshot() call, so only the process that serves requests runs it.
+    """
+
+    def __init__(self, interval=COLLECT_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self.servers = []
+        self.summary = FleetSummary()
+        self.index = ServerIndex()
+        self.anomalies = DriftAnomalyDetector()
+        self.collected_at = None
+        self.sweeps = 0
+        self.errors = 0
+        self.last_sweep_seconds = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='server-collector', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def collect(self):
+        """Run one sweep and publish it"""
+        started = time.perf_counter()
+        servers, rows = generate_server_metrics()
+        self.summary.sync(servers)
+        self.index.rebuild(servers)
+        # The recorded rows keep None where no drift was measured; the server dicts show 0
+        self.anomalies.update([row['server_id'] for row in rows], [row['ntp_drift'] for row in rows],
+                              complete=True)
+        with self._lock:
+            self.servers = servers
+            self.collected_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.sweeps += 1
+            self.last_sweep_seconds = round(time.perf_counter() - started, 3)
+        self._ready.set()
+
+    def _run(self):
+        try:
+            conn = get_db_connection()
+            try:
+                series.warm(conn, SERIES_WARM_HOURS)
+            finally:
+                conn.close()
+            self.anomalies.prime({server_id: series.last(server_id, 'ntp_drift', ANOMALY_PRIME_POINTS)[1]
+                                  for server_id in series.server_ids()})
+        except sqlite3.Error as e:
+            app.logger.warning('Could not warm the in-memory series: %s', e)
+        while not self._stop.is_set():
+            try:
+                self.collect()
+            except Exception as e:
+                self.errors += 1
+                app.logger.exception('Server sweep failed: %s', e)
+            if self._stop.wait(self.interval):
+                break
+
+    def snapshot(self, wait=COLLECT_STARTUP_WAIT):
+        """(servers, stats, collected_at) from the most recent sweep"""
+        self.start()
+        self._ready.wait(wait)
+        with self._lock:
+            servers, collected_at = self.servers, self.collected_at
+        return servers, self.summary.stats(), collected_at
+
+    def update(self, server_id, **values):
+        """Fold a one-off check of a single server into the snapshot"""
+        with self._lock:
+            servers = [dict(server, **values) if server['id'] == server_id else server
+                       for server in self.servers]
+            self.servers = servers
+        for server in servers:
+            if server['id'] == server_id:
+                self.summary.update(server)
+                self.index.update(server)
+                if 'ntp_drift' in values:
+                    drift = values['ntp_drift'] if server['status'] == 'up' else None
+                    self.anomalies.update([server_id], [drift])
+
+    def status(self):
+        writer = metrics_writers.get(DATABASE)
+        with self._lock:
+            return {
+                'interval': self.interval,
+                'running': self._thread is not None and self._thread.is_alive(),
+                'sweeps': self.sweeps,
+                'errors': self.errors,
+                'last_sweep_seconds': self.last_sweep_seconds,
+                'collected_at': self.collected_at,
+                'servers': len(self.servers),
+                'probes': 'tcp/ntp' if PROBE_SERVERS else 'simulated',
+                'series': series.stats(),
+                'writer': writer.stats() if writer is not None else None,
+            }
+
+collector = ServerCollector()
+
 @app.route('/')
 def index():
     """Main dashboard with server grid"""
-    # Generate fresh metrics
-    servers = generate_server_metrics()
-    stats = calculate_summary_stats(servers)
-    
-    # Prepare chart data
-    chart_labels = []
-    chart_datasets = []
+    # Latest sweep from the background collector
+    servers, stats, collected_at = collector.snapshot()
     
-    # Get NTP drift history for top 5 servers
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Get timestamps for last 24 hours
-    cursor.execute('''
-        SELECT DISTINCT strftime('%H:%M', timestamp) as hour
-        FROM server_metrics 
-        WHERE timestamp >= datetime('now', '-24 hours')
-        GROUP BY hour
-        ORDER BY timestamp ASC
-        LIMIT 24
-    ''')
-    chart_labels = [row['hour'] for row in cursor.fetchall()]
+    # Drift chart: average drift of the first servers over the last 24 hours, on one axis
+    chart = drift_buckets(24, CHART_BUCKETS, [server['id'] for server in servers[:CHART_SERVERS]])
+    chart_labels = chart['labels']
+    chart_datasets = [{'name': server['name'], 'data': server['avg']} for server in chart['servers']]
     
-    conn.close()
-    
-    return render_template_string(
-        HTML_TEMPLATE,
-        servers=servers,
-        stats=stats,
-        chart_labels=chart_labels,
-        current_time=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    )
+    with perf.render_timer():
+        return render_template_string(
+            HTML_TEMPLATE,
+            servers=servers,
+            stats=stats,
+            chart_labels=chart_labels,
+            chart_datasets=chart_datasets,
+            current_time=collected_at or datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        )
 
 @app.route('/api/servers')
 def api_servers():
-    """API endpoint for current server status"""
-    servers = generate_server_metrics()
+    """API endpoint for current server status.
+
+    Filters: status, location, environment, prefix (name), min_drift and
+    max_drift (|ntp_drift| in ms). sort is one of SORT_FIELDS, order is
+    asc or desc, offset and limit page the result, and fields picks the
+    keys returned for each server (e.g. fields=name,status,ntp_drift).
+    """
+    _, _, collected_at = collector.snapshot()
+    args = request.args
+    sort = args.get('sort', 'id')
+    order = args.get('order', 'asc')
+    offset = args.get('offset', 0, type=int)
+    limit = args.get('limit', None, type=int)
+    fields = [field for field in args.get('fields', '').split(',') if field]
+    if sort not in SORT_FIELDS:
+        return jsonify({'error': f'sort must be one of {", ".join(SORT_FIELDS)}'}), 400
+    if order not in ('asc', 'desc'):
+        return jsonify({'error': 'order must be asc or desc'}), 400
+    if offset < 0 or (limit is not None and limit < 0):
+        return jsonify({'error': 'offset and limit must not be negative'}), 400
+    unknown = [field for field in fields if field not in SERVER_FIELDS]
+    if unknown:
+        return jsonify({'error': f'unknown fields: {", ".join(unknown)}'}), 400
+    
+    total, servers = collector.index.query(
+        status=args.get('status'), location=args.get('location'), environment=args.get('environment'),
+        name_prefix=args.get('prefix'), min_drift=args.get('min_drift', None, type=float),
+        max_drift=args.get('max_drift', None, type=float), sort=sort, descending=order == 'desc',
+        offset=offset, limit=limit)
+    if fields:
+        servers = [{field: server.get(field) for field in fields} for server in servers]
     return jsonify({
         'timestamp': datetime.datetime.now().isoformat(),
+        'collected_at': collected_at,
+        'total': total,
+        'offset': offset,
+        'limit': limit,
         'servers': servers
     })
 
@@ -660,6 +939,17 @@ def api_ntp_history():
     hours = request.args.get('hours', 24, type=int)
     server_id = request.args.get('server_id', None, type=int)
     
+    # Served from memory when the in-memory series hold the whole window
+    points = series.window(time.time() - hours * 3600, 'ntp_drift', server_id or None)
+    if points is not None:
+        # A sweep stamps every server with the same time, so format each time once
+        stamps = {}
+        for ts, _, _ in points:
+            if ts not in stamps:
+                stamps[ts] = timeseries.format_timestamp(ts)
+        return jsonify([{'timestamp': stamps[ts], 'ntp_drift': value, 'server_id': key}
+                        for ts, key, value in points])
+    
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -685,13 +975,51 @@ def api_ntp_history():
     
     return jsonify([dict(row) for row in results])
 
+@app.route('/api/ntp-drift/buckets')
+def api_ntp_buckets():
+    """NTP drift history bucketed for charts.
+
+    hours is the window, buckets the number of points on the time axis and
+    server_id an optional comma-separated list of servers (default all).
+    The response grows with servers x buckets, not with the rows read.
+    """
+    hours = request.args.get('hours', 24, type=int)
+    count = request.args.get('buckets', CHART_BUCKETS, type=int)
+    server_ids = None
+    if request.args.get('server_id'):
+        try:
+            server_ids = [int(value) for value in request.args['server_id'].split(',')]
+        except ValueError:
+            return jsonify({'error': 'server_id must be a comma-separated list of ids'}), 400
+    if hours <= 0:
+        return jsonify({'error': 'hours must be positive'}), 400
+    if not 1 <= count <= MAX_CHART_BUCKETS:
+        return jsonify({'error': f'buckets must be between 1 and {MAX_CHART_BUCKETS}'}), 400
+    collector.snapshot()
+    return jsonify(drift_buckets(hours, count, server_ids))
+
+@app.route('/api/ntp-drift/anomalies')
+def api_ntp_anomalies():
+    """Servers whose latest drift is far outside their own EWMA baseline"""
+    recent = request.args.get('recent', 50, type=int)
+    collector.snapshot()
+    report = collector.anomalies.report(max(recent, 0))
+    for anomaly in report['anomalous'] + report['recent']:
+        server = collector.index.servers.get(anomaly['server_id'])
+        anomaly['name'] = server['name'] if server else None
+    return jsonify(report)
+
 @app.route('/api/summary')
 def api_summary():
     """API endpoint for summary statistics"""
-    servers = generate_server_metrics()
-    stats = calculate_summary_stats(servers)
+    _, stats, _ = collector.snapshot()
     return jsonify(stats)
 
+@app.route('/api/collector')
+def api_collector():
+    """Background collector cadence and last sweep timing"""
+    return jsonify(collector.status())
+
 @app.route('/api/check-ntp/<server_name>', methods=['POST'])
 def check_ntp(server_name):
     """Manually trigger NTP check for a server"""
@@ -700,6 +1028,7 @@ def check_ntp(server_name):
     
     cursor.execute("SELECT * FROM servers WHERE name = ?", (server_name,))
     server = cursor.fetchone()
+    conn.close()
     
     if not server:
         return jsonify({'error': 'Server not found'}), 404
@@ -707,16 +1036,20 @@ def check_ntp(server_name):
     # Simulate NTP check
     ntp_drift = simulate_ntp_drift()
     status = 'up' if random.random() < 0.95 else 'down'
+    # Whole seconds, like the stored timestamp and the sweeps
+    checked_ts = int(time.time())
     
-    # Insert check result
-    cursor.execute('''
-        INSERT INTO server_metrics 
-        (server_id, status, ntp_drift, last_ntp_sync, timestamp)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (server['id'], status, ntp_drift, datetime.datetime.now(), datetime.datetime.now()))
-    
-    conn.commit()
-    conn.close()
+    # Record the check through the writer and wait for its commit (timestamps are UTC)
+    get_metrics_writer().submit([{
+        'server_id': server['id'],
+        'timestamp': timeseries.format_timestamp(checked_ts),
+        'status': status,
+        'ntp_drift': ntp_drift,
+        'last_ntp_sync': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }]).result()
+    series.append(server['id'], checked_ts, {'ntp_drift': ntp_drift})
+    collector.update(server['id'], status=status, ntp_drift=ntp_drift,
+                     last_check=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
     
     return jsonify({
         'server': server_name,
@@ -733,9 +1066,17 @@ if __name__ == '__main__':
     print("📊 Access the dashboard at: http://localhost:5000")
     print("\n📡 API Endpoints:")
     print("  - GET  /api/servers              - List all servers with current status")
+    print("         ?status=&location=&environment=&prefix=&min_drift=&max_drift=")
+    print("         &sort=&order=asc|desc&offset=&limit=&fields=name,status,ntp_drift")
     print("  - GET  /api/servers/<name>       - Get specific server details")
     print("  - GET  /api/ntp-drift/history    - NTP drift history")
+    print("  - GET  /api/ntp-drift/buckets    - Drift min/avg/max per server on a shared time axis")
+    print("         ?hours=24&buckets=24&server_id=1,2,3")
+    print("  - GET  /api/ntp-drift/anomalies  - Drift far from each server's own baseline")
     print("  - GET  /api/summary               - Summary statistics")
     print("  - POST /api/check-ntp/<name>      - Trigger NTP check")
+    print("  - GET  /api/collector             - Background sweep status")
+    print(f"Servers are swept every {COLLECT_INTERVAL}s in the background; pages serve the latest sweep")
+    print("  - GET  /debug/perf                - Request, SQL and render timing histograms")
     
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,159 @@
+"""Single writer thread for grid.py's server_metrics.
+
+A sweep hands over all of its rows at once and the writer inserts them with
+one executemany in one transaction. Batches that queue up while a commit
+is in progress, such as a sweep and a few manual NTP checks, share the
+next transaction. The database runs in WAL mode, so dashboard reads carry
+on against the last commit while a sweep is being written.
+
+submit() returns a Future that resolves to the number of rows once they
+are committed, for callers that need to read their own write. A failed
+transaction fails the futures of every batch in it, whatever the error,
+and the writer carries on with the next batches.
+
+    python grid_writer.py --check   # a failing batch must not stop the writer
+"""
+import argparse
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+METRIC_COLUMNS = (
+    'server_id', 'timestamp', 'status', 'response_time', 'ntp_drift', 'cpu_usage',
+    'memory_usage', 'disk_usage', 'services_running', 'services_total', 'last_ntp_sync',
+)
+INSERT_METRICS_SQL = (
+    f"INSERT INTO server_metrics ({', '.join(METRIC_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in METRIC_COLUMNS)})"
+)
+MAX_QUEUED_BATCHES = 64
+
+
+class MetricsWriter:
+    """Owns the only write connection to server_metrics"""
+
+    def __init__(self, database, busy_timeout_ms=5000):
+        self.database = database
+        self._conn = sqlite3.connect(database, timeout=busy_timeout_ms / 1000.0,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode = WAL').fetchone()
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        self._queue = queue.Queue(maxsize=MAX_QUEUED_BATCHES)
+        self._closed = False
+        self.rows_written = 0
+        self.commits = 0
+        self.errors = 0
+        self.last_commit_ms = None
+        self._thread = threading.Thread(target=self._run, name='grid-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, rows):
+        """Queue dicts keyed by METRIC_COLUMNS (missing columns are NULL) for one transaction"""
+        if self._closed:
+            raise RuntimeError('MetricsWriter is closed')
+        future = Future()
+        batch = [tuple(row.get(column) for column in METRIC_COLUMNS) for row in rows]
+        self._queue.put((batch, future))
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            pending = [item]
+            # Everything else already waiting goes into the same transaction
+            stop = False
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                pending.append(item)
+            try:
+                self._write(pending)
+            except Exception as e:
+                # Never leave a caller blocked on result() or lose the thread to one bad batch
+                self.errors += 1
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+            if stop:
+                return
+
+    def _write(self, pending):
+        started = time.perf_counter()
+        with self._conn:
+            for batch, _ in pending:
+                self._conn.executemany(INSERT_METRICS_SQL, batch)
+        self.commits += 1
+        self.last_commit_ms = round((time.perf_counter() - started) * 1000, 3)
+        for batch, future in pending:
+            self.rows_written += len(batch)
+            if not future.done():
+                future.set_result(len(batch))
+
+    def stats(self):
+        return {
+            'rows_written': self.rows_written,
+            'commits': self.commits,
+            'errors': self.errors,
+            'queued_batches': self._queue.qsize(),
+            'last_commit_ms': self.last_commit_ms,
+        }
+
+    def close(self):
+        """Write everything queued and release the connection"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._conn.close()
+        atexit.unregister(self.close)
+
+
+class _Unbindable:
+    """A column value whose adaptation raises something other than sqlite3.Error"""
+
+    def __conform__(self, protocol):
+        raise KeyError('unbindable')
+
+
+def check_writer(database='grid_writer_check.db', timeout=5.0):
+    """Submit a batch that fails in the writer thread and make sure the next one still commits"""
+    conn = sqlite3.connect(database)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS server_metrics (id INTEGER PRIMARY KEY, {', '.join(METRIC_COLUMNS)})")
+    conn.close()
+    writer = MetricsWriter(database)
+    try:
+        failed = writer.submit([{'server_id': 1, 'ntp_drift': _Unbindable()}])
+        assert isinstance(failed.exception(timeout), KeyError), failed.exception()
+        written = writer.submit([{'server_id': 1, 'ntp_drift': 0.5}])
+        assert written.result(timeout) == 1
+        assert writer.stats()['errors'] == 1, writer.stats()
+    finally:
+        writer.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--check', action='store_true', help='verify a failing batch does not stop the writer')
+    args = parser.parse_args()
+    if args.check:
+        check_writer()
+        print('grid writer ok: failed batch reported, next batch committed')
+    else:
+        parser.print_help()
@@ -0,0 +1,267 @@
+"""Buffered, batched writer for system_metrics and alerts.
+
+Samples are collected in memory and written with executemany inside a
+single transaction once ``max_batch`` rows are waiting or the oldest row has
+waited ``max_delay`` seconds. The buffer is always flushed on ``close()``,
+which is also registered with atexit. When given an alert_rules.RuleEngine,
+every queued sample is evaluated on the way in and the alerts it fires are
+written in the same batch.
+
+A batch whose transaction fails goes back to the front of the buffer and is
+retried no sooner than ``max_delay`` seconds later. After ``max_retries``
+failed attempts in a row the batch is dropped and counted in ``dropped``.
+Queued metric rows are capped at ``max_buffered``; past that, adding raises
+BufferFull and nothing from the call is kept, so the caller can retry it
+without writing rows twice. A failed flush triggered by adding rows is only
+logged, because those rows are already kept.
+"""
+import atexit
+import datetime
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+
+import rollup
+
+log = logging.getLogger(__name__)
+
+DATABASE = 'monitoring.db'
+MAX_BATCH = 500
+MAX_DELAY = 5.0
+MAX_BUFFERED = 50000
+MAX_RETRIES = 5
+BULK_CHUNK = 50000
+
+METRIC_COLUMNS = (
+    'timestamp', 'ts', 'hostname', 'cpu_percent', 'memory_percent', 'memory_used',
+    'memory_total', 'disk_percent', 'disk_used', 'disk_total', 'process_count',
+    'uptime_seconds', 'temperature', 'load_average_1min', 'load_average_5min',
+    'load_average_15min',
+)
+ALERT_COLUMNS = ('timestamp', 'ts', 'hostname', 'severity', 'metric', 'value', 'threshold', 'message')
+
+INSERT_METRICS_SQL = (
+    f"INSERT INTO system_metrics ({', '.join(METRIC_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in METRIC_COLUMNS)})"
+)
+INSERT_ALERT_SQL = (
+    f"INSERT INTO alerts ({', '.join(ALERT_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in ALERT_COLUMNS)})"
+)
+UPSERT_HOST_SQL = '''
+    INSERT INTO hosts (hostname, first_seen, last_seen, samples) VALUES (?, ?, ?, ?)
+    ON CONFLICT (hostname) DO UPDATE SET
+        first_seen = min(first_seen, excluded.first_seen),
+        last_seen = max(last_seen, excluded.last_seen),
+        samples = samples + excluded.samples
+'''
+
+
+def format_ts(ts):
+    """Text timestamp matching SQLite's CURRENT_TIMESTAMP (UTC)"""
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class BufferFull(RuntimeError):
+    """Raised when a write would queue more than max_buffered metric rows"""
+
+
+def host_summaries(samples):
+    """(hostname, first ts, last ts, count) per host in a batch"""
+    hosts = {}
+    for sample in samples:
+        hostname = sample.get('hostname')
+        if hostname is None:
+            continue
+        entry = hosts.get(hostname)
+        if entry is None:
+            hosts[hostname] = [hostname, sample['ts'], sample['ts'], 1]
+        else:
+            entry[1] = min(entry[1], sample['ts'])
+            entry[2] = max(entry[2], sample['ts'])
+            entry[3] += 1
+    return list(hosts.values())
+
+
+class IngestWriter:
+    """Buffers metric samples and alerts and writes them in batches"""
+
+    def __init__(self, database=DATABASE, max_batch=MAX_BATCH, max_delay=MAX_DELAY,
+                 busy_timeout_ms=5000, rules=None, max_buffered=MAX_BUFFERED,
+                 max_retries=MAX_RETRIES):
+        self.database = database
+        self.rules = rules
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_buffered = max_buffered
+        self.max_retries = max_retries
+        self._conn = sqlite3.connect(database, timeout=busy_timeout_ms / 1000.0,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode = WAL').fetchone()
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+
+        self._metrics = []
+        self._alerts = []
+        self._oldest = None
+        self._buffer_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._failures = 0  # failed flushes in a row
+        self._retry_at = 0.0  # monotonic time before which a failed batch is not retried
+        self.rows_written = 0
+        self.flushes = 0
+        self.errors = 0
+        self.dropped = 0
+
+        # Flushes on the time threshold even when no new samples arrive
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name='ingest-flusher', daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add_metrics(self, metrics):
+        """Queue one metrics dict; ``ts`` defaults to now"""
+        self.add_metrics_many([metrics])
+
+    def add_metrics_many(self, samples):
+        """Queue a list of metrics dicts, all or none of them (BufferFull)"""
+        now = int(time.time())
+        queued = []
+        for metrics in samples:
+            ts = metrics.get('ts') or now
+            queued.append(dict(metrics, ts=ts, timestamp=metrics.get('timestamp') or format_ts(ts)))
+        self._enqueue(self._metrics, queued)
+        if self.rules is not None:
+            for sample in queued:
+                for alert in self.rules.evaluate(sample):
+                    self.add_alert(**alert)
+
+    def add_alert(self, severity, metric, value, threshold, message, ts=None, hostname=None):
+        """Queue one alert row"""
+        ts = ts or int(time.time())
+        alert = {'timestamp': format_ts(ts), 'ts': ts, 'hostname': hostname, 'severity': severity,
+                 'metric': metric, 'value': value, 'threshold': threshold, 'message': message}
+        self._enqueue(self._alerts, [alert])
+
+    def _enqueue(self, buffer, rows):
+        with self._buffer_lock:
+            if self._closed:
+                raise RuntimeError('IngestWriter is closed')
+            # Only metric rows count against the cap: alerts follow from metrics already accepted
+            if buffer is self._metrics and self._metrics \
+                    and len(self._metrics) + len(rows) > self.max_buffered:
+                raise BufferFull(f'{len(self._metrics)} metric rows already waiting for {self.database}')
+            buffer.extend(rows)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = len(self._metrics) + len(self._alerts) >= self.max_batch
+        if full and time.monotonic() >= self._retry_at:
+            try:
+                self.flush()
+            except Exception:
+                # The rows are kept for a later flush, so the caller must not resend them
+                log.exception('Flush of %s failed', self.database)
+
+    def _flush_loop(self):
+        while not self._stop.wait(min(self.max_delay, 1.0)):
+            oldest = self._oldest
+            now = time.monotonic()
+            if oldest is not None and now - oldest >= self.max_delay and now >= self._retry_at:
+                try:
+                    self.flush()
+                except Exception:
+                    # The rows are back in the buffer; keep the thread for the next attempt
+                    log.exception('Background flush of %s failed', self.database)
+
+    def flush(self):
+        """Write everything buffered so far in one transaction"""
+        with self._write_lock:
+            with self._buffer_lock:
+                metrics, self._metrics = self._metrics, []
+                alerts, self._alerts = self._alerts, []
+                oldest, self._oldest = self._oldest, None
+            if not metrics and not alerts:
+                return 0
+            try:
+                self._write(metrics, alerts)
+            except Exception:
+                self.errors += 1
+                self._failures += 1
+                self._retry_at = time.monotonic() + self.max_delay
+                if self._failures >= self.max_retries:
+                    self._failures = 0
+                    self.dropped += len(metrics) + len(alerts)
+                    log.error('Dropped %d metric rows and %d alerts for %s after %d failed writes',
+                              len(metrics), len(alerts), self.database, self.max_retries)
+                    raise
+                # Put the batch back ahead of anything queued since, for the next flush
+                with self._buffer_lock:
+                    self._metrics = metrics + self._metrics
+                    self._alerts = alerts + self._alerts
+                    if self._oldest is None or (oldest is not None and oldest < self._oldest):
+                        self._oldest = oldest
+                raise
+            self._failures = 0
+            self._retry_at = 0.0
+            self.flushes += 1
+            return len(metrics) + len(alerts)
+
+    def _write(self, metrics, alerts):
+        """executemany both row sets and the rollups; caller holds _write_lock"""
+        with self._conn:
+            if metrics:
+                self._conn.executemany(INSERT_METRICS_SQL, (
+                    tuple(sample.get(column) for column in METRIC_COLUMNS) for sample in metrics))
+                rollup.apply(self._conn, metrics)
+                self._conn.executemany(UPSERT_HOST_SQL, host_summaries(metrics))
+            if alerts:
+                self._conn.executemany(INSERT_ALERT_SQL, (
+                    tuple(alert[column] for column in ALERT_COLUMNS) for alert in alerts))
+        self.rows_written += len(metrics) + len(alerts)
+
+    def bulk_load(self, samples, chunk_size=BULK_CHUNK):
+        """Backfill an iterable of metrics dicts (each with ``ts``).
+
+        Rows bypass the buffer and are written chunk_size at a time, one
+        transaction per chunk, so memory stays flat for millions of rows.
+        """
+        self.flush()
+        samples = iter(samples)
+        loaded = 0
+        while True:
+            chunk = [dict(sample, timestamp=sample.get('timestamp') or format_ts(sample['ts']))
+                     for sample in itertools.islice(samples, chunk_size)]
+            if not chunk:
+                break
+            alerts = []
+            if self.rules is not None:
+                for sample in chunk:
+                    alerts.extend(dict(alert, timestamp=format_ts(alert['ts']))
+                                  for alert in self.rules.evaluate(sample))
+            with self._write_lock:
+                self._write(chunk, alerts)
+            loaded += len(chunk)
+        return loaded
+
+    def close(self):
+        """Flush anything still buffered and release the connection"""
+        with self._buffer_lock:
+            if self._closed:
+                return
+            # No new rows from here on, so the final flush sees everything
+            self._closed = True
+        self._stop.set()
+        self._flusher.join()
+        try:
+            self.flush()
+        finally:
+            self._conn.close()
+            atexit.unregister(self.close)
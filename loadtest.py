@@ -0,0 +1,83 @@
+"""HTTP load test comparing the Flask and asyncio dashboard servers.
+
+Starts app.py and async_app.py in turn on the same database and drives each
+path with bench_web's HTTP driver and per-route measurement, so the figures
+line up with bench_web.py reports.
+
+    python loadtest.py --url http://localhost:5000
+    python loadtest.py --compare        # starts app.py and async_app.py itself
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+from bench_web import HTTPDriver, bench_route
+
+DEFAULT_PATHS = ['/', '/api/metrics/latest', '/api/metrics/historical?hours=24',
+                 '/api/alerts', '/api/metrics/average']
+
+FLASK_SERVER = ('import app; '
+                'app.app.run(host="127.0.0.1", port={port}, threaded=True, debug=False)')
+ASYNC_SERVER = 'import asyncio, async_app; asyncio.run(async_app.serve("127.0.0.1", {port}))'
+
+
+def run_load(url, paths=DEFAULT_PATHS, concurrency=32, requests=500):
+    """bench_web.bench_route report for each path of a running server"""
+    driver = HTTPDriver(url)
+    return {path: bench_route(driver, 'GET', path, None, requests, concurrency) for path in paths}
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url + '/api/metrics/latest', timeout=2).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not start')
+
+
+def compare(paths, concurrency, requests, port=5100):
+    """Start each server in turn in a subprocess and load it with the same mix"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    reports = {}
+    for name, code in (('flask', FLASK_SERVER), ('async', ASYNC_SERVER)):
+        server = subprocess.Popen([sys.executable, '-c', code.format(port=port)], cwd=os.getcwd(),
+                                  env=dict(os.environ, PYTHONPATH=here),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            url = f'http://127.0.0.1:{port}'
+            wait_until_up(url)
+            reports[name] = run_load(url, paths, concurrency, requests)
+        finally:
+            server.terminate()
+            server.wait()
+    return reports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--path', action='append', help='path to request (repeatable)')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=500, help='requests per path')
+    parser.add_argument('--compare', action='store_true',
+                        help='start app.py and async_app.py and load both')
+    args = parser.parse_args()
+
+    paths = args.path or DEFAULT_PATHS
+    if args.compare:
+        reports = compare(paths, args.concurrency, args.requests)
+        for name, report in reports.items():
+            for path, result in report.items():
+                print(f"{name:>6} {path:<40} {result['rps']:>8} req/s  "
+                      f"p50 {result['latency_ms']['p50']} ms  p99 {result['latency_ms']['p99']} ms  "
+                      f"errors {result['errors']}")
+        print(json.dumps(reports, indent=2))
+    else:
+        print(json.dumps(run_load(args.url, paths, args.concurrency, args.requests), indent=2))
@@ -0,0 +1,159 @@
+"""Window statistics over system_metrics columns.
+
+A window is loaded once into one contiguous float array per column (NumPy
+when it is installed, array.array('d') otherwise) and every statistic is
+computed over those arrays rather than row by row. Results are kept in a small
+LRU keyed by the request, the data version and a coarse time bucket, so a
+repeated request does not touch the database again until new rows arrive or
+its relative window has moved on.
+"""
+import math
+from array import array
+from collections import OrderedDict
+import itertools
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NUMERIC_COLUMNS = (
+    'cpu_percent', 'memory_percent', 'memory_used', 'memory_total',
+    'disk_percent', 'disk_used', 'disk_total', 'process_count',
+    'uptime_seconds', 'temperature', 'load_average_1min',
+    'load_average_5min', 'load_average_15min',
+)
+DEFAULT_PERCENTILES = (50, 95, 99)
+CACHE_SIZE = 64
+CACHE_BUCKET_SECONDS = 60  # a cached relative window is reused for at most this long
+
+
+def load_window(conn, start_ts, columns, hostname=None):
+    """Return (ts, {column: values}) arrays for rows with ts >= start_ts"""
+    sql = f'SELECT ts, {", ".join(columns)} FROM system_metrics WHERE ts >= ?'
+    params = [start_ts]
+    if hostname is not None:
+        sql += ' AND hostname = ?'
+        params.append(hostname)
+    cursor = conn.execute(sql + ' ORDER BY ts ASC', params)
+    rows = cursor.fetchall()
+    # NULLs become NaN so every column keeps the same length as ts
+    if np is not None:
+        matrix = np.array([tuple(row) for row in rows], dtype=np.float64).reshape(len(rows), len(columns) + 1)
+        return matrix[:, 0], {column: matrix[:, i + 1] for i, column in enumerate(columns)}
+    ts = array('d', (row[0] for row in rows))
+    values = {column: array('d', (math.nan if row[i + 1] is None else row[i + 1] for row in rows))
+              for i, column in enumerate(columns)}
+    return ts, values
+
+
+def _percentile(sorted_values, q):
+    """Linear interpolation percentile, matching numpy's default method"""
+    position = (len(sorted_values) - 1) * q / 100.0
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = position - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+def column_stats(ts, values, percentiles=DEFAULT_PERCENTILES, moving_averages=()):
+    """Summary statistics for one column over its timestamps.
+
+    Each ma_N is the rolling mean series [[ts, mean of the N samples ending at ts], ...],
+    starting at the first sample with N values behind it.
+    """
+    if np is not None:
+        mask = ~np.isnan(values)
+        values, ts = values[mask], ts[mask]
+        count = int(values.size)
+        if not count:
+            return {'count': 0}
+        result = {
+            'count': count,
+            'min': float(values.min()),
+            'max': float(values.max()),
+            'mean': float(values.mean()),
+            'stddev': float(values.std()),
+        }
+        for q, value in zip(percentiles, np.percentile(values, percentiles)):
+            result[f'p{q:g}'] = float(value)
+        sums = np.concatenate(([0.0], np.cumsum(values)))
+        for window in moving_averages:
+            means = (sums[window:] - sums[:-window]) / window
+            result[f'ma_{window}'] = np.column_stack((ts[window - 1:], means)).tolist()
+        elapsed = float(ts[-1] - ts[0])
+        result['rate_per_minute'] = float(values[-1] - values[0]) / elapsed * 60 if elapsed else 0.0
+        if count > 1:
+            steps = np.diff(values) / np.maximum(np.diff(ts), 1) * 60
+            result['max_rate_per_minute'] = float(np.abs(steps).max())
+        return result
+
+    pairs = [(t, v) for t, v in zip(ts, values) if not math.isnan(v)]
+    count = len(pairs)
+    if not count:
+        return {'count': 0}
+    ts = array('d', (t for t, _ in pairs))
+    values = array('d', (v for _, v in pairs))
+    mean = math.fsum(values) / count
+    ordered = sorted(values)
+    result = {
+        'count': count,
+        'min': ordered[0],
+        'max': ordered[-1],
+        'mean': mean,
+        'stddev': math.sqrt(math.fsum((v - mean) ** 2 for v in values) / count),
+    }
+    for q in percentiles:
+        result[f'p{q:g}'] = _percentile(ordered, q)
+    sums = [0.0] + list(itertools.accumulate(values))
+    for window in moving_averages:
+        result[f'ma_{window}'] = [[ts[i - 1], (sums[i] - sums[i - window]) / window]
+                                  for i in range(window, count + 1)]
+    elapsed = ts[-1] - ts[0]
+    result['rate_per_minute'] = (values[-1] - values[0]) / elapsed * 60 if elapsed else 0.0
+    if count > 1:
+        result['max_rate_per_minute'] = max(
+            abs(values[i] - values[i - 1]) / max(ts[i] - ts[i - 1], 1) * 60 for i in range(1, count))
+    return result
+
+
+def cache_bucket(now=None):
+    """Coarse time bucket for cache keys of relative windows"""
+    return int(time.time() if now is None else now) // CACHE_BUCKET_SECONDS
+
+
+class StatsCache:
+    """LRU of computed windows keyed by request parameters, data version and time bucket"""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+def window_stats(conn, start_ts, columns, percentiles=DEFAULT_PERCENTILES, moving_averages=(),
+                 hostname=None):
+    """Statistics for every requested column over one window"""
+    ts, values = load_window(conn, start_ts, columns, hostname)
+    return {column: column_stats(ts, values[column], percentiles, moving_averages)
+            for column in columns}
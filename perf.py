@@ -0,0 +1,319 @@
+"""Per-request timing for the Flask dashboards.
+
+``install(app)`` times every request and splits it into SQLite time
+(statements run through TimedConnection cursors), JSON encoding (jsonify),
+template rendering (render_timer()) and everything else. It also records
+response sizes and per-statement latency. Each of these goes into a rolling
+histogram covering the last WINDOW_SECONDS, served at /debug/perf. Every
+installed app has its own recorder (app.extensions['perf']), so two apps in
+one process keep separate stats for the same endpoint. Statements run outside
+a request, e.g. by a background thread, go to the module-level `recorder`.
+
+A fraction of requests (profile_rate) can run under cProfile. Any of those
+slower than slow_ms keeps its profile, listed at /debug/perf/profiles.
+"""
+import contextlib
+import cProfile
+import io
+import math
+import pstats
+import random
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+from flask import g, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+
+WINDOW_SECONDS = 600
+WINDOW_SLOTS = 60
+LATENCY_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+SIZE_BOUNDS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+SLOW_REQUEST_MS = 500
+SLOW_REQUESTS_KEPT = 50
+PROFILES_KEPT = 10
+PROFILE_LINES = 30
+SQL_KEY_LENGTH = 160
+TOP_STATEMENTS = 50
+
+
+class RollingHistogram:
+    """Bucketed counts over a sliding window made of fixed time slots"""
+
+    def __init__(self, bounds, window=WINDOW_SECONDS, slots=WINDOW_SLOTS):
+        self.bounds = bounds
+        self.slot_seconds = window / slots
+        # slot -> [slot number, bucket counts, count, sum, max]
+        self.slots = [None] * slots
+
+    def observe(self, value, now=None):
+        number = int((time.monotonic() if now is None else now) // self.slot_seconds)
+        position = number % len(self.slots)
+        slot = self.slots[position]
+        if slot is None or slot[0] != number:
+            slot = self.slots[position] = [number, [0] * (len(self.bounds) + 1), 0, 0.0, 0.0]
+        slot[1][bisect_left(self.bounds, value)] += 1
+        slot[2] += 1
+        slot[3] += value
+        slot[4] = max(slot[4], value)
+
+    def snapshot(self, now=None):
+        """Counts, mean, max and bucket-estimated percentiles over the window"""
+        current = int((time.monotonic() if now is None else now) // self.slot_seconds)
+        counts = [0] * (len(self.bounds) + 1)
+        count, total, largest = 0, 0.0, 0.0
+        for slot in self.slots:
+            if slot is None or slot[0] <= current - len(self.slots):
+                continue
+            for i, n in enumerate(slot[1]):
+                counts[i] += n
+            count += slot[2]
+            total += slot[3]
+            largest = max(largest, slot[4])
+        if not count:
+            return {'count': 0}
+
+        def percentile(q):
+            # Upper bound of the bucket holding the q-th observation
+            rank, seen = math.ceil(count * q), 0
+            for i, n in enumerate(counts):
+                seen += n
+                if seen >= rank:
+                    return min(self.bounds[i], largest) if i < len(self.bounds) else largest
+            return largest
+
+        return {
+            'count': count,
+            'sum': round(total, 3),
+            'mean': round(total / count, 3),
+            'max': round(largest, 3),
+            'p50': round(percentile(0.50), 3),
+            'p90': round(percentile(0.90), 3),
+            'p99': round(percentile(0.99), 3),
+            'buckets': {(f'<={bound:g}' if i < len(self.bounds) else f'>{self.bounds[-1]:g}'): n
+                        for i, (bound, n) in enumerate(zip(self.bounds + (None,), counts)) if n},
+        }
+
+
+class PerfRecorder:
+    """Rolling histograms per endpoint and per SQL statement"""
+
+    def __init__(self, slow_ms=SLOW_REQUEST_MS):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self.histograms = {}  # (kind, key) -> RollingHistogram
+        self.slow_requests = deque(maxlen=SLOW_REQUESTS_KEPT)
+        self.profiles = deque(maxlen=PROFILES_KEPT)
+
+    def observe(self, kind, key, value, bounds=LATENCY_BOUNDS_MS):
+        with self._lock:
+            histogram = self.histograms.get((kind, key))
+            if histogram is None:
+                histogram = self.histograms[(kind, key)] = RollingHistogram(bounds)
+            histogram.observe(value)
+
+    def snapshot(self, kind):
+        with self._lock:
+            return {key: histogram.snapshot()
+                    for (histogram_kind, key), histogram in self.histograms.items()
+                    if histogram_kind == kind}
+
+    def report(self, background=None):
+        endpoints = {}
+        for kind in ('latency_ms', 'sql_ms', 'queries', 'json_ms', 'render_ms', 'other_ms',
+                     'response_bytes'):
+            for endpoint, snapshot in self.snapshot(kind).items():
+                endpoints.setdefault(endpoint, {})[kind] = snapshot
+        statements = sorted(self.snapshot('statement_ms').items(),
+                            key=lambda item: item[1].get('sum', 0), reverse=True)
+        report = {
+            'window_seconds': WINDOW_SECONDS,
+            'endpoints': endpoints,
+            'statements': dict(statements[:TOP_STATEMENTS]),
+            'slow_requests': list(self.slow_requests),
+            'profiles': len(self.profiles),
+        }
+        if background is not None:
+            report['background_statements'] = background.report()['statements']
+        return report
+
+
+# Statements run outside any request
+recorder = PerfRecorder()
+
+# Per-thread totals for the request currently being served
+_current = threading.local()
+
+
+def begin_request(request_recorder=None):
+    _current.recorder = request_recorder
+    _current.queries = 0
+    _current.sql = 0.0
+    _current.json = 0.0
+    _current.render = 0.0
+
+
+def request_totals():
+    """(queries, sql seconds, json seconds, render seconds) so far on this thread"""
+    return (getattr(_current, 'queries', 0), getattr(_current, 'sql', 0.0),
+            getattr(_current, 'json', 0.0), getattr(_current, 'render', 0.0))
+
+
+def _add(name, seconds):
+    setattr(_current, name, getattr(_current, name, 0.0) + seconds)
+
+
+@contextlib.contextmanager
+def render_timer():
+    """Count the enclosed block as template rendering"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add('render', time.perf_counter() - started)
+
+
+def statement_key(sql):
+    return ' '.join(sql.split())[:SQL_KEY_LENGTH]
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that charges execute and fetch time to its request.
+
+    Each execute/executemany is one statement_ms observation; fetches only
+    add to the request's SQL time, so statement counts match statements run.
+    """
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(self, *args)
+        finally:
+            _add('sql', time.perf_counter() - started)
+
+    def _statement(self, method, sql, *args):
+        _current.queries = getattr(_current, 'queries', 0) + 1
+        started = time.perf_counter()
+        try:
+            return method(self, sql, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            _add('sql', elapsed)
+            (getattr(_current, 'recorder', None) or recorder).observe(
+                'statement_ms', statement_key(sql), elapsed * 1000)
+
+    def execute(self, sql, parameters=()):
+        return self._statement(sqlite3.Cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._statement(sqlite3.Cursor.executemany, sql, seq_of_parameters)
+
+    def fetchone(self):
+        return self._timed(sqlite3.Cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._timed(sqlite3.Cursor.fetchmany)
+        return self._timed(sqlite3.Cursor.fetchmany, size)
+
+    def fetchall(self):
+        return self._timed(sqlite3.Cursor.fetchall)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection factory whose cursors are TimedCursors (sqlite3.connect(factory=...))"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """jsonify() provider that charges encoding time to the request"""
+
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            _add('json', time.perf_counter() - started)
+
+
+def _profile_text(profiler):
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+    return out.getvalue()
+
+
+def install(app, slow_ms=SLOW_REQUEST_MS, profile_rate=0.0):
+    """Time every request of a Flask app and add the /debug/perf endpoints.
+
+    profile_rate is the fraction of requests run under cProfile; profiles
+    of requests slower than slow_ms are kept.
+    """
+    app_recorder = app.extensions['perf'] = PerfRecorder(slow_ms)
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def perf_before_request():
+        begin_request(app_recorder)
+        g.perf_profiler = None
+        if profile_rate and random.random() < profile_rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                g.perf_profiler = profiler
+            except ValueError:
+                # Another profiler is already active on this interpreter
+                pass
+        g.perf_started = time.perf_counter()
+
+    @app.after_request
+    def perf_after_request(response):
+        started = g.pop('perf_started', None)
+        if started is None:
+            return response
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        profiler = g.pop('perf_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+        endpoint = request.url_rule.rule if request.url_rule else '<unmatched>'
+        queries, sql, encode, render = request_totals()
+        app_recorder.observe('latency_ms', endpoint, elapsed_ms)
+        app_recorder.observe('sql_ms', endpoint, sql * 1000)
+        app_recorder.observe('queries', endpoint, queries, SIZE_BOUNDS)
+        app_recorder.observe('json_ms', endpoint, encode * 1000)
+        app_recorder.observe('render_ms', endpoint, render * 1000)
+        app_recorder.observe('other_ms', endpoint, max(elapsed_ms - (sql + encode + render) * 1000, 0.0))
+        if not response.is_streamed:
+            app_recorder.observe('response_bytes', endpoint, response.calculate_content_length() or 0,
+                             SIZE_BOUNDS)
+
+        if elapsed_ms >= app_recorder.slow_ms:
+            entry = {'endpoint': endpoint, 'path': request.full_path.rstrip('?'),
+                     'ms': round(elapsed_ms, 2), 'sql_ms': round(sql * 1000, 2), 'queries': queries,
+                     'at': time.strftime('%Y-%m-%d %H:%M:%S')}
+            app_recorder.slow_requests.append(entry)
+            if profiler is not None:
+                app_recorder.profiles.append(dict(entry, profile=_profile_text(profiler)))
+        return response
+
+    @app.route('/debug/perf')
+    def debug_perf():
+        """Rolling latency, SQL, JSON, render and size histograms"""
+        return jsonify(app_recorder.report(background=recorder))
+
+    @app.route('/debug/perf/profiles')
+    def debug_perf_profiles():
+        """cProfile output of recent slow, sampled requests"""
+        return jsonify(list(app_recorder.profiles))
+
+    return app_recorder
@@ -0,0 +1,312 @@
+"""Concurrent reachability and NTP probes for the servers in servers.db.
+
+Every server is probed at once from one event loop instead of one
+``ping`` at a time: a TCP connect to tcp_port for reachability and an SNTP
+query to ntp_port for clock offset. At most `concurrency` probes are in
+flight, each host has its own timeout, and each host's start is delayed by
+a random jitter so a sweep does not hit the network as a single burst.
+
+An ip_address of the form host:port overrides tcp_port for that server.
+
+    python probe.py                  # one sweep over servers.db
+    python probe.py --every 30       # sweep forever
+    python probe.py --demo 500       # sweep local stand-in listeners
+    python probe.py --check          # parse a known-good 48-byte NTP reply
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import struct
+import time
+
+DATABASE = 'servers.db'
+TCP_PORT = 22
+NTP_PORT = 123
+CONCURRENCY = 256
+TIMEOUT = 2.0
+JITTER = 1.0
+NTP_EPOCH_OFFSET = 2208988800  # seconds from 1900-01-01 to 1970-01-01
+# RFC 5905 header is 48 bytes: li/vn/mode at 0, origin/receive/transmit timestamps at 24/32/40
+NTP_PACKET = struct.Struct('!B23xQQQ')
+NTP_CLIENT_MODE = 0x1b  # leap 0, version 3, mode 3 (client)
+NTP_SERVER_MODE = 4
+# A server reply captured in this layout: origin 1700000000.0, receive +0.25 s, transmit +0.5 s
+KNOWN_REPLY = bytes.fromhex(
+    '240206e900000a0b00000c0d47505300e8fe6f7600000000'
+    'e8fe6f8000000000e8fe6f8040000000e8fe6f8080000000')
+
+
+def to_ntp(seconds):
+    return int((seconds + NTP_EPOCH_OFFSET) * 2 ** 32)
+
+
+def from_ntp(value):
+    return value / 2 ** 32 - NTP_EPOCH_OFFSET
+
+
+def parse_reply(data):
+    """(origin, receive, transmit) raw NTP timestamps of a server reply, or None if it is not one"""
+    if len(data) < NTP_PACKET.size or data[0] & 0x7 != NTP_SERVER_MODE:
+        return None
+    return NTP_PACKET.unpack_from(data)[1:]
+
+
+def check_packet_layout():
+    """Parse KNOWN_REPLY and fail loudly if the packet layout does not match it"""
+    assert NTP_PACKET.size == 48, NTP_PACKET.size
+    origin, receive, transmit = (from_ntp(value) for value in parse_reply(KNOWN_REPLY))
+    assert (origin, receive, transmit) == (1700000000.0, 1700000000.25, 1700000000.5), \
+        (origin, receive, transmit)
+    return True
+
+
+def describe_error(e):
+    return os.strerror(e.errno) if e.errno else str(e) or type(e).__name__
+
+
+def split_address(address, default_port):
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and ':' not in host:
+        return host, int(port)
+    return address, default_port
+
+
+class _NTPClient(asyncio.DatagramProtocol):
+    """Resolves `reply` with (packet, local receive time) for the first matching answer"""
+
+    def __init__(self, request, transmit):
+        self.request = request
+        self.transmit = transmit
+        self.reply = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport):
+        transport.sendto(self.request)
+
+    def datagram_received(self, data, addr):
+        received = time.time()
+        if self.reply.done():
+            return
+        # A reply must echo our transmit timestamp as its origin
+        timestamps = parse_reply(data)
+        if timestamps is not None and timestamps[0] == self.transmit:
+            self.reply.set_result((data, received))
+
+    def error_received(self, exc):
+        if not self.reply.done():
+            self.reply.set_exception(exc)
+
+
+async def ntp_query(host, port=NTP_PORT):
+    """(offset ms, round-trip delay ms) of host's clock relative to ours"""
+    loop = asyncio.get_running_loop()
+    sent = time.time()
+    transmit = to_ntp(sent)
+    request = NTP_PACKET.pack(NTP_CLIENT_MODE, 0, 0, transmit)
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: _NTPClient(request, transmit), remote_addr=(host, port))
+    try:
+        data, received = await protocol.reply
+    finally:
+        transport.close()
+    _, server_received, server_sent = parse_reply(data)
+    server_received, server_sent = from_ntp(server_received), from_ntp(server_sent)
+    offset = ((server_received - sent) + (server_sent - received)) / 2
+    delay = (received - sent) - (server_sent - server_received)
+    return offset * 1000, delay * 1000
+
+
+async def tcp_connect(host, port):
+    """Milliseconds to complete a TCP handshake"""
+    started = time.perf_counter()
+    _, writer = await asyncio.open_connection(host, port)
+    elapsed = (time.perf_counter() - started) * 1000
+    writer.close()
+    return elapsed
+
+
+class ProbeEngine:
+    """Bounded-concurrency sweeps of TCP and NTP probes"""
+
+    def __init__(self, concurrency=CONCURRENCY, timeout=TIMEOUT, jitter=JITTER,
+                 tcp_port=TCP_PORT, ntp_port=NTP_PORT, ntp=True):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.jitter = jitter
+        self.tcp_port = tcp_port
+        self.ntp_port = ntp_port
+        self.ntp = ntp
+        self.last_sweep = None
+
+    async def probe(self, server, semaphore):
+        """Probe one server row (id, name, ip_address) into a server_metrics-style dict"""
+        host, port = split_address(server['ip_address'], self.tcp_port)
+        if self.jitter:
+            await asyncio.sleep(random.uniform(0, self.jitter))
+        result = {
+            'server_id': server['id'],
+            'name': server['name'],
+            'ip_address': server['ip_address'],
+            'status': 'down',
+            'response_time': None,
+            'ntp_drift': None,
+            'ntp_delay': None,
+            'error': None,
+        }
+        async with semaphore:
+            try:
+                result['response_time'] = round(
+                    await asyncio.wait_for(tcp_connect(host, port), self.timeout), 3)
+                result['status'] = 'up'
+            except asyncio.TimeoutError:
+                result['error'] = 'tcp timeout'
+            except OSError as e:
+                result['error'] = 'tcp: ' + describe_error(e)
+
+            if self.ntp and result['status'] == 'up':
+                try:
+                    offset, delay = await asyncio.wait_for(ntp_query(host, self.ntp_port), self.timeout)
+                    result['ntp_drift'], result['ntp_delay'] = round(offset, 3), round(delay, 3)
+                except asyncio.TimeoutError:
+                    result['error'] = 'ntp timeout'
+                except OSError as e:
+                    result['error'] = 'ntp: ' + describe_error(e)
+        result['checked_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        return result
+
+    async def sweep(self, servers):
+        """Probe every server; results come back in the order of `servers`"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.probe(server, semaphore) for server in servers))
+        self.last_sweep = {
+            'servers': len(results),
+            'up': sum(1 for result in results if result['status'] == 'up'),
+            'seconds': round(time.perf_counter() - started, 3),
+            'finished_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        return results
+
+    async def run(self, load_servers, interval, handle):
+        """Sweep load_servers() every `interval` seconds, passing each result list to handle()"""
+        while True:
+            started = time.monotonic()
+            handle(await self.sweep(load_servers()))
+            await asyncio.sleep(max(interval - (time.monotonic() - started), 0))
+
+
+def load_servers(database=DATABASE):
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in conn.execute('SELECT id, name, ip_address FROM servers ORDER BY id')]
+    finally:
+        conn.close()
+
+
+# Local stand-ins: each fake server gets its own loopback address
+
+class _FakeNTPServer(asyncio.DatagramProtocol):
+    """Answers SNTP requests with a fixed clock offset after a delay"""
+
+    def __init__(self, offset, delay):
+        self.offset = offset
+        self.delay = delay
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        asyncio.get_running_loop().call_later(self.delay, self.reply, data, addr, time.time())
+
+    def reply(self, data, addr, received):
+        if len(data) < NTP_PACKET.size:
+            return
+        transmit = NTP_PACKET.unpack_from(data)[3]
+        now = time.time() + self.offset
+        # A 48-byte answer like a real server's: version 3, server mode, stratum 2
+        packet = bytearray(NTP_PACKET.pack(0x1c, transmit, to_ntp(received + self.offset), to_ntp(now)))
+        packet[1] = 2
+        self.transport.sendto(bytes(packet), addr)
+
+
+async def start_stand_ins(count, tcp_port, ntp_port, timeout):
+    """Listeners on 127.0.1.1.. standing in for `count` servers.
+
+    Every tenth host has no TCP listener (down), every seventh answers NTP
+    slower than the timeout, and the rest answer with their own clock offset.
+    """
+    loop = asyncio.get_running_loop()
+    servers, handles = [], []
+    for i in range(count):
+        host = f'127.0.{1 + i // 250}.{1 + i % 250}'
+        servers.append({'id': i + 1, 'name': f'stand-in-{i + 1:04d}', 'ip_address': host})
+        if i % 10 == 9:
+            continue
+        handles.append(await asyncio.start_server(lambda reader, writer: writer.close(), host, tcp_port))
+        delay = timeout * 1.5 if i % 7 == 6 else random.uniform(0, 0.05)
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _FakeNTPServer(random.uniform(-0.15, 0.15), delay), local_addr=(host, ntp_port))
+        handles.append(transport)
+    return servers, handles
+
+
+async def demo(count, concurrency, timeout, jitter, tcp_port=20022, ntp_port=20123):
+    check_packet_layout()
+    servers, handles = await start_stand_ins(count, tcp_port, ntp_port, timeout)
+    engine = ProbeEngine(concurrency, timeout, jitter, tcp_port, ntp_port)
+    try:
+        results = await engine.sweep(servers)
+    finally:
+        for handle in handles:
+            handle.close()
+    return engine, results
+
+
+def print_results(results, limit=20):
+    for result in results[:limit]:
+        drift = '-' if result['ntp_drift'] is None else f"{result['ntp_drift']:.2f} ms"
+        rtt = '-' if result['response_time'] is None else f"{result['response_time']:.2f} ms"
+        print(f"{result['name']:<20} {result['ip_address']:<16} {result['status']:<5} "
+              f"rtt {rtt:<12} drift {drift:<14} {result['error'] or ''}")
+    if len(results) > limit:
+        print(f'... {len(results) - limit} more')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=DATABASE)
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--timeout', type=float, default=TIMEOUT)
+    parser.add_argument('--jitter', type=float, default=JITTER)
+    parser.add_argument('--tcp-port', type=int, default=TCP_PORT)
+    parser.add_argument('--ntp-port', type=int, default=NTP_PORT)
+    parser.add_argument('--every', type=float, help='sweep every N seconds instead of once')
+    parser.add_argument('--demo', type=int, metavar='N', help='probe N local stand-in servers')
+    parser.add_argument('--check', action='store_true', help='verify the NTP packet layout and exit')
+    args = parser.parse_args()
+
+    if args.check:
+        check_packet_layout()
+        print(f'NTP packet layout ok ({NTP_PACKET.size} bytes)')
+    elif args.demo:
+        engine, results = asyncio.run(demo(args.demo, args.concurrency, args.timeout, args.jitter))
+        print_results(results)
+        errors = {}
+        for result in results:
+            errors[result['error']] = errors.get(result['error'], 0) + 1
+        print(engine.last_sweep, errors)
+    else:
+        engine = ProbeEngine(args.concurrency, args.timeout, args.jitter, args.tcp_port, args.ntp_port)
+        if args.every:
+            def report(results):
+                print(engine.last_sweep)
+            try:
+                asyncio.run(engine.run(lambda: load_servers(args.db), args.every, report))
+            except KeyboardInterrupt:
+                pass
+        else:
+            results = asyncio.run(engine.sweep(load_servers(args.db)))
+            print_results(results, limit=len(results))
+            print(engine.last_sweep)
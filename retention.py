@@ -0,0 +1,192 @@
+"""Retention and compaction for monitoring.db.
+
+Each table has a maximum age (None keeps it forever). Expired rows are
+deleted in small chunks, each in its own short transaction with a pause in
+between, so the ingest writer never waits long for the write lock. Freed
+pages are then returned to the filesystem with PRAGMA incremental_vacuum.
+
+Raw system_metrics rows are only deleted once their day is in the columnar
+archive (archive.py): a pass archives closed days first and never deletes
+raw rows of a day that has no archive file. Archive files get their own
+maximum age. Rollup tier ages live in rollup.TIER_RETENTION, so query()
+only picks a tier that still covers the window.
+
+    python retention.py            # one pass, prints a report
+    python retention.py --every 3600
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+import archive
+import rollup
+
+DATABASE = 'monitoring.db'
+DAY = 86400
+ARCHIVE_DIR = archive.ARCHIVE_DIR
+ARCHIVE_MAX_AGE = 365 * DAY  # archive files older than this are removed, None keeps them
+
+# Rollup tier name -> max age in seconds, None keeps the tier forever
+TIER_RETENTION = rollup.TIER_RETENTION
+
+# table -> (time column, max age in seconds or None to keep forever)
+POLICIES = {
+    'system_metrics': ('ts', 7 * DAY),
+    'alerts': ('ts', 90 * DAY),
+}
+POLICIES.update({table: ('bucket', TIER_RETENTION[name]) for name, _, table in rollup.TIERS})
+# The raw table has a rowid; rollup tiers are WITHOUT ROWID and keyed by bucket
+ROWID_TABLES = ('system_metrics', 'alerts')
+
+CHUNK_ROWS = 5000
+CHUNK_PAUSE = 0.05
+VACUUM_PAGES = 2000
+
+
+def database_size(conn):
+    """(file bytes, free bytes) from the page counters"""
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return page_count * page_size, freelist * page_size
+
+
+def delete_expired(conn, table, column, cutoff, chunk_rows=CHUNK_ROWS, pause=CHUNK_PAUSE):
+    """Delete rows older than cutoff chunk_rows at a time; return the count"""
+    if table in ROWID_TABLES:
+        sql = f'''
+            DELETE FROM {table} WHERE rowid IN (
+                SELECT rowid FROM {table} WHERE {column} < ? ORDER BY {column} LIMIT ?
+            )
+        '''
+    else:
+        sql = f'''
+            DELETE FROM {table} WHERE (hostname, bucket) IN (
+                SELECT hostname, bucket FROM {table} WHERE {column} < ? ORDER BY {column} LIMIT ?
+            )
+        '''
+    deleted = 0
+    while True:
+        with conn:
+            count = conn.execute(sql, (cutoff, chunk_rows)).rowcount
+        deleted += count
+        if count < chunk_rows:
+            return deleted
+        # Give the ingest writer a window to take the lock
+        time.sleep(pause)
+
+
+def enable_incremental_vacuum(conn):
+    """Switch auto_vacuum to INCREMENTAL; needs one full VACUUM to take effect"""
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+
+
+def incremental_vacuum(conn, pages=VACUUM_PAGES, pause=CHUNK_PAUSE):
+    """Release free pages a batch at a time until none are left"""
+    while conn.execute('PRAGMA freelist_count').fetchone()[0]:
+        # executescript steps the pragma to completion; execute() frees one page
+        conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+        time.sleep(pause)
+
+
+def archived_cutoff(conn, directory, cutoff):
+    """cutoff, moved back to the oldest day before it with raw rows but no archive file"""
+    oldest = conn.execute('SELECT MIN(ts) FROM system_metrics').fetchone()[0]
+    if oldest is None:
+        return cutoff
+    for day_start in range(oldest // DAY * DAY, cutoff, DAY):
+        if os.path.exists(archive.day_path(directory, day_start)):
+            continue
+        if conn.execute('SELECT 1 FROM system_metrics WHERE ts >= ? AND ts < ? LIMIT 1',
+                        (day_start, day_start + DAY)).fetchone():
+            return day_start
+    return cutoff
+
+
+def run_retention(database=DATABASE, policies=None, now=None, chunk_rows=CHUNK_ROWS,
+                  archive_dir=ARCHIVE_DIR):
+    """Apply every policy once and return a report dict.
+
+    With archive_dir (None: no archive in use) closed days are archived
+    first and raw rows of unarchived days are kept.
+    """
+    policies = POLICIES if policies is None else policies
+    now = int(time.time()) if now is None else now
+    report = {'tables': {}}
+    if archive_dir is not None:
+        report['archive'] = archive.archive_closed_days(database, archive_dir, now)
+    conn = sqlite3.connect(database, timeout=30, isolation_level='DEFERRED')
+    conn.execute('PRAGMA busy_timeout = 30000')
+    started = time.perf_counter()
+    size_before, _ = database_size(conn)
+
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table, (column, max_age) in policies.items():
+        if max_age is None or table not in existing:
+            continue
+        table_started = time.perf_counter()
+        cutoff = now - max_age
+        if table == 'system_metrics' and archive_dir is not None:
+            cutoff = archived_cutoff(conn, archive_dir, cutoff)
+        deleted = delete_expired(conn, table, column, cutoff, chunk_rows)
+        report['tables'][table] = {
+            'deleted': deleted,
+            'cutoff': cutoff,
+            'seconds': round(time.perf_counter() - table_started, 3),
+        }
+        if cutoff < now - max_age:
+            report['tables'][table]['kept_unarchived_from'] = cutoff
+    if archive_dir is not None and ARCHIVE_MAX_AGE is not None:
+        report['archive_pruned'] = archive.prune(archive_dir, now - ARCHIVE_MAX_AGE)
+
+    vacuum_started = time.perf_counter()
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        incremental_vacuum(conn)
+        report['vacuum'] = 'incremental'
+    else:
+        # Pages stay on the freelist and are reused, but the file won't shrink
+        report['vacuum'] = 'unavailable: run with --enable-incremental-vacuum once'
+    report['vacuum_seconds'] = round(time.perf_counter() - vacuum_started, 3)
+
+    size_after, free_after = database_size(conn)
+    conn.close()
+    report.update({
+        'bytes_before': size_before,
+        'bytes_after': size_after,
+        'bytes_reclaimed': size_before - size_after,
+        'bytes_free': free_after,
+        'seconds': round(time.perf_counter() - started, 3),
+    })
+    return report
+
+
+def schedule(database=DATABASE, every=3600, archive_dir=ARCHIVE_DIR):
+    """Run retention every `every` seconds until interrupted"""
+    while True:
+        print(json.dumps(run_retention(database, archive_dir=archive_dir), indent=2))
+        time.sleep(every)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=DATABASE)
+    parser.add_argument('--every', type=int, help='repeat every N seconds')
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR,
+                        help="columnar archive directory, or '' when no archive is kept")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help='switch the database to auto_vacuum=INCREMENTAL (one full VACUUM)')
+    args = parser.parse_args()
+
+    if args.enable_incremental_vacuum:
+        conn = sqlite3.connect(args.db)
+        enable_incremental_vacuum(conn)
+        conn.close()
+    archive_dir = args.archive_dir or None
+    if args.every:
+        schedule(args.db, args.every, archive_dir)
+    else:
+        print(json.dumps(run_retention(args.db, archive_dir=archive_dir), indent=2))
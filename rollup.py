@@ -0,0 +1,227 @@
+"""Pre-aggregated rollup tiers for system_metrics.
+
+Each tier keeps one row per (hostname, bucket) with the sample count and the
+min/max/sum/last of every metric in ROLLUP_METRICS, plus the number of
+non-NULL readings of each metric (``{metric}_n``) that its average divides by. The tiers are updated
+incrementally by ``apply()`` in the same transaction as the raw insert, and
+``query()`` picks the cheapest tier that still satisfies a max_points budget.
+"""
+import datetime
+import math
+import time
+
+# (name, bucket width in seconds, table)
+TIERS = [
+    ('1m', 60, 'metrics_rollup_1m'),
+    ('5m', 300, 'metrics_rollup_5m'),
+    ('1h', 3600, 'metrics_rollup_1h'),
+]
+TIERS_BY_NAME = {name: (width, table) for name, width, table in TIERS}
+DAY = 86400
+# Tier name -> max age in seconds (enforced by retention.py), None keeps the tier forever
+TIER_RETENTION = {'1m': 14 * DAY, '5m': 90 * DAY, '1h': None}
+
+ROLLUP_METRICS = (
+    'cpu_percent',
+    'memory_percent',
+    'disk_percent',
+    'temperature',
+    'load_average_1min',
+)
+AGGREGATES = ('min', 'max', 'sum', 'n', 'last')
+
+
+def _columns():
+    """Aggregate column names in table order"""
+    return [f'{metric}_{agg}' for metric in ROLLUP_METRICS for agg in AGGREGATES]
+
+
+def _column_type(column):
+    return 'INTEGER NOT NULL DEFAULT 0' if column.endswith('_n') else 'REAL'
+
+
+def add_count_columns(conn):
+    """Add any missing {metric}_n columns to existing tier tables"""
+    for _, _, table in TIERS:
+        existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        for metric in ROLLUP_METRICS:
+            if f'{metric}_n' not in existing:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {metric}_n {_column_type(metric + "_n")}')
+                # Best guess for buckets whose raw rows are gone; backfill() redoes the rest exactly
+                conn.execute(f'UPDATE {table} SET {metric}_n = CASE WHEN {metric}_max IS NULL THEN 0 ELSE samples END')
+
+
+def create_tables(conn):
+    """Create the tier tables (used by the schema migration)"""
+    column_defs = ',\n'.join(f'            {column} {_column_type(column)}' for column in _columns())
+    for _, _, table in TIERS:
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                hostname TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                samples INTEGER NOT NULL,
+                last_ts INTEGER NOT NULL,
+{column_defs},
+                PRIMARY KEY (hostname, bucket)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table} (bucket)')
+
+
+def backfill(conn):
+    """Build every tier from the raw rows already in system_metrics"""
+    aggregates = ',\n'.join(
+        f'                   MIN({m}), MAX({m}), SUM({m}), COUNT({m}), NULL' for m in ROLLUP_METRICS)
+    for _, width, table in TIERS:
+        conn.execute(f'''
+            INSERT OR REPLACE INTO {table} (hostname, bucket, samples, last_ts, {', '.join(_columns())})
+            SELECT COALESCE(hostname, ''), ts / {width} * {width}, COUNT(*), MAX(ts),
+{aggregates}
+            FROM system_metrics
+            WHERE ts IS NOT NULL
+            GROUP BY COALESCE(hostname, ''), ts / {width}
+        ''')
+        last_values = ',\n'.join(f'''
+                {m}_last = (SELECT {m} FROM system_metrics s
+                            WHERE s.ts = {table}.last_ts
+                            AND COALESCE(s.hostname, '') = {table}.hostname
+                            ORDER BY s.id DESC LIMIT 1)''' for m in ROLLUP_METRICS)
+        conn.execute(f'UPDATE {table} SET {last_values}')
+
+
+def _upsert_sql(table):
+    """INSERT ... ON CONFLICT statement folding one sample into a bucket"""
+    columns = _columns()
+    updates = ['samples = samples + 1']
+    for metric in ROLLUP_METRICS:
+        new = f'excluded.{metric}_last'
+        updates += [
+            f'{metric}_min = min(COALESCE({metric}_min, {new}), COALESCE({new}, {metric}_min))',
+            f'{metric}_max = max(COALESCE({metric}_max, {new}), COALESCE({new}, {metric}_max))',
+            f'{metric}_sum = COALESCE({metric}_sum, 0) + COALESCE({new}, 0)',
+            f'{metric}_n = {metric}_n + ({new} IS NOT NULL)',
+            f'{metric}_last = CASE WHEN excluded.last_ts >= last_ts THEN {new} ELSE {metric}_last END',
+        ]
+    # SET expressions all see the old row, so last_ts is updated last safely
+    updates.append('last_ts = max(last_ts, excluded.last_ts)')
+    placeholders = ', '.join('?' for _ in range(4 + len(columns)))
+    return f'''
+        INSERT INTO {table} (hostname, bucket, samples, last_ts, {', '.join(columns)})
+        VALUES ({placeholders})
+        ON CONFLICT (hostname, bucket) DO UPDATE SET
+            {', '.join(updates)}
+    '''
+
+
+UPSERT_SQL = {name: _upsert_sql(table) for name, _, table in TIERS}
+
+
+def apply(conn, samples):
+    """Fold metrics dicts (each carrying ``ts``) into every rollup tier.
+
+    Runs on the caller's connection and inside the caller's transaction.
+    """
+    samples = list(samples)
+    if not samples:
+        return
+    for name, width, _ in TIERS:
+        params = []
+        for sample in samples:
+            values = []
+            for metric in ROLLUP_METRICS:
+                value = sample.get(metric)
+                values += [value, value, value, int(value is not None), value]
+            params.append([sample.get('hostname') or '', sample['ts'] // width * width,
+                           1, sample['ts']] + values)
+        conn.executemany(UPSERT_SQL[name], params)
+
+
+def choose_tier(window_seconds, max_points, age=None):
+    """Largest tier whose buckets are no wider than the window needs.
+
+    With age (seconds from the window start to now) only tiers that still
+    keep rows that old are considered, so a long window is never cut short
+    by a tier's retention.
+    """
+    needed = math.ceil(window_seconds / max(max_points, 1))
+    tiers = [tier for tier in TIERS
+             if age is None or TIER_RETENTION[tier[0]] is None or TIER_RETENTION[tier[0]] >= age]
+    chosen = tiers[0]
+    for tier in tiers:
+        if tier[1] <= needed:
+            chosen = tier
+    return chosen
+
+
+def query(conn, start_ts, end_ts, resolution=None, max_points=None, hostname=None):
+    """Aggregated rows between start_ts and end_ts.
+
+    With an explicit resolution ('1m', '5m' or '1h') the tier rows are
+    returned as they are. With max_points the best tier is picked and its
+    buckets are merged further until no more than max_points remain.
+    """
+    if resolution is not None:
+        width, table = TIERS_BY_NAME[resolution]
+        group_width = width
+    else:
+        _, width, table = choose_tier(end_ts - start_ts, max_points, int(time.time()) - start_ts)
+        needed = math.ceil((end_ts - start_ts) / max(max_points, 1))
+        group_width = max(width, math.ceil(needed / width) * width)
+
+    sql = f'SELECT * FROM {table} WHERE bucket >= ? AND bucket <= ?'
+    params = [start_ts // width * width, end_ts]
+    if hostname is not None:
+        sql += ' AND hostname = ?'
+        params.append(hostname)
+    sql += ' ORDER BY bucket ASC'
+
+    groups = {}
+    for row in conn.execute(sql, params):
+        bucket = row['bucket'] // group_width * group_width
+        group = groups.get(bucket)
+        if group is None:
+            groups[bucket] = group = {'samples': 0, 'last_ts': row['last_ts']}
+            for metric in ROLLUP_METRICS:
+                group[f'{metric}_min'] = row[f'{metric}_min']
+                group[f'{metric}_max'] = row[f'{metric}_max']
+                group[f'{metric}_sum'] = 0.0
+                group[f'{metric}_n'] = 0
+                group[f'{metric}_last'] = row[f'{metric}_last']
+        else:
+            newer = row['last_ts'] >= group['last_ts']
+            for metric in ROLLUP_METRICS:
+                low, high = row[f'{metric}_min'], row[f'{metric}_max']
+                if low is not None and (group[f'{metric}_min'] is None or low < group[f'{metric}_min']):
+                    group[f'{metric}_min'] = low
+                if high is not None and (group[f'{metric}_max'] is None or high > group[f'{metric}_max']):
+                    group[f'{metric}_max'] = high
+                if newer:
+                    group[f'{metric}_last'] = row[f'{metric}_last']
+            if newer:
+                group['last_ts'] = row['last_ts']
+        group['samples'] += row['samples']
+        for metric in ROLLUP_METRICS:
+            group[f'{metric}_sum'] += row[f'{metric}_sum'] or 0.0
+            group[f'{metric}_n'] += row[f'{metric}_n']
+
+    results = []
+    for bucket in sorted(groups):
+        group = groups[bucket]
+        point = {
+            'timestamp': datetime.datetime.fromtimestamp(
+                bucket, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+            'ts': bucket,
+            'samples': group['samples'],
+        }
+        for metric in ROLLUP_METRICS:
+            # Averages are over non-NULL readings; a metric never reported has none
+            count = group[f'{metric}_n']
+            point[metric] = round(group[f'{metric}_sum'] / count, 2) if count else None
+            point[f'{metric}_min'] = group[f'{metric}_min']
+            point[f'{metric}_max'] = group[f'{metric}_max']
+            point[f'{metric}_last'] = group[f'{metric}_last']
+        results.append(point)
+    if max_points and resolution is None:
+        # Bucket alignment can add one partial bucket at the start
+        results = results[-max_points:]
+    return results
@@ -0,0 +1,147 @@
+"""Versioned schema migrations for monitoring.db.
+
+The schema version is kept in SQLite's ``PRAGMA user_version``. Each entry in
+MIGRATIONS upgrades the database by one version inside its own transaction,
+so an existing database is brought up to date in place by ``migrate()``.
+"""
+import rollup
+
+
+def _baseline(conn):
+    """Version 1: the original system_metrics and alerts tables"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS system_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            hostname TEXT,
+            cpu_percent REAL,
+            memory_percent REAL,
+            memory_used INTEGER,
+            memory_total INTEGER,
+            disk_percent REAL,
+            disk_used INTEGER,
+            disk_total INTEGER,
+            process_count INTEGER,
+            uptime_seconds INTEGER,
+            temperature REAL,
+            load_average_1min REAL,
+            load_average_5min REAL,
+            load_average_15min REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            severity TEXT,
+            metric TEXT,
+            value REAL,
+            threshold REAL,
+            message TEXT
+        )
+    ''')
+
+
+def _epoch_timestamps(conn):
+    """Version 2: integer epoch ``ts`` columns with time indexes"""
+    for table in ('system_metrics', 'alerts'):
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+        if 'ts' not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN ts INTEGER')
+        conn.execute(f'''
+            UPDATE {table} SET ts = CAST(strftime('%s', timestamp) AS INTEGER)
+            WHERE ts IS NULL
+        ''')
+        # Writers are expected to set ts, but keep rows from older writers usable
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_fill_ts
+            AFTER INSERT ON {table} WHEN NEW.ts IS NULL
+            BEGIN
+                UPDATE {table}
+                SET ts = CAST(strftime('%s', COALESCE(NEW.timestamp, 'now')) AS INTEGER)
+                WHERE id = NEW.id;
+            END
+        ''')
+
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_system_metrics_ts ON system_metrics (ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_system_metrics_host_ts ON system_metrics (hostname, ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_alerts_ts ON alerts (ts)')
+
+
+def _rollup_tiers(conn):
+    """Version 3: 1m/5m/1h rollup tables, built from existing rows"""
+    rollup.create_tables(conn)
+    rollup.backfill(conn)
+
+
+def _hosts(conn):
+    """Version 4: host directory and per-host alert indexing"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS hosts (
+            hostname TEXT PRIMARY KEY,
+            first_seen INTEGER,
+            last_seen INTEGER,
+            samples INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO hosts (hostname, first_seen, last_seen, samples)
+        SELECT hostname, MIN(ts), MAX(ts), COUNT(*)
+        FROM system_metrics WHERE hostname IS NOT NULL
+        GROUP BY hostname
+    ''')
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(alerts)')]
+    if 'hostname' not in columns:
+        conn.execute('ALTER TABLE alerts ADD COLUMN hostname TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_alerts_host_ts ON alerts (hostname, ts)')
+
+
+def _rollup_counts(conn):
+    """Version 5: per-metric non-NULL counts in the rollup tiers"""
+    rollup.add_count_columns(conn)
+    # Rebuild the buckets that still have raw rows so their counts are exact
+    rollup.backfill(conn)
+
+
+# (version, description, upgrade function), in order
+MIGRATIONS = [
+    (1, 'baseline tables', _baseline),
+    (2, 'epoch timestamps and time indexes', _epoch_timestamps),
+    (3, 'metric rollup tiers', _rollup_tiers),
+    (4, 'host directory', _hosts),
+    (5, 'rollup non-NULL counts', _rollup_counts),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    """Return the schema version recorded in the database"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=None):
+    """Apply every pending migration up to target (default: latest)"""
+    target = LATEST_VERSION if target is None else target
+    current = get_version(conn)
+    applied = []
+
+    for version, description, upgrade in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+        # Explicit transaction so a failed step leaves the old version intact
+        isolation_level = conn.isolation_level
+        conn.isolation_level = None
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            upgrade(conn)
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.isolation_level = isolation_level
+        applied.append((version, description))
+
+    return applied
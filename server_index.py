@@ -0,0 +1,124 @@
+"""In-memory secondary indexes over grid.py's server states.
+
+ServerIndex holds the latest dict for every server by id. Alongside it
+are hash indexes on status, location and environment, a sorted name list
+for prefix lookups and a sorted |drift| list for threshold lookups. A
+query intersects the id sets of its filters, smallest first. It then
+sorts and slices only the matching ids, so the cost follows the result
+size rather than the fleet size.
+
+rebuild() replaces everything from a full sweep. update() moves one
+server between index entries and leaves the rest alone.
+"""
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+SORT_FIELDS = ('name', 'status', 'location', 'environment', 'ntp_drift', 'response_time',
+               'cpu_usage', 'memory_usage', 'disk_usage', 'id')
+HASH_FIELDS = ('status', 'location', 'environment')
+TEXT_FIELDS = ('name', 'status', 'location', 'environment')
+
+
+def sort_key(field):
+    """Key for sorting server dicts by field, ties broken by id; ntp_drift sorts by magnitude"""
+    if field in TEXT_FIELDS:
+        return lambda server: (server.get(field) or '', server['id'])
+    if field == 'ntp_drift':
+        return lambda server: (abs(server.get(field) or 0), server['id'])
+    return lambda server: (server.get(field) or 0, server['id'])
+
+
+class ServerIndex:
+    """Latest server dicts with filter, sort and pagination support"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.servers = {}
+        self.hashes = {field: {} for field in HASH_FIELDS}
+        self.names = []  # sorted (name, id)
+        self.drifts = []  # sorted (|ntp_drift|, id)
+
+    def _add(self, server):
+        self.servers[server['id']] = server
+        for field, index in self.hashes.items():
+            index.setdefault(server.get(field), set()).add(server['id'])
+
+    def _remove(self, server):
+        del self.servers[server['id']]
+        for field, index in self.hashes.items():
+            ids = index.get(server.get(field))
+            if ids is not None:
+                ids.discard(server['id'])
+                if not ids:
+                    del index[server.get(field)]
+
+    @staticmethod
+    def _drift_key(server):
+        return (abs(server.get('ntp_drift') or 0), server['id'])
+
+    def rebuild(self, servers):
+        """Index a full sweep, dropping servers no longer listed"""
+        with self._lock:
+            self.servers = {}
+            self.hashes = {field: {} for field in HASH_FIELDS}
+            for server in servers:
+                self._add(server)
+            self.names = sorted((server['name'], server['id']) for server in servers)
+            self.drifts = sorted(self._drift_key(server) for server in servers)
+
+    def update(self, server):
+        """Replace one server's state, keeping every index in step"""
+        with self._lock:
+            old = self.servers.get(server['id'])
+            if old is not None:
+                self._remove(old)
+                self._discard(self.names, (old['name'], old['id']))
+                self._discard(self.drifts, self._drift_key(old))
+            self._add(server)
+            insort(self.names, (server['name'], server['id']))
+            insort(self.drifts, self._drift_key(server))
+
+    @staticmethod
+    def _discard(sorted_list, key):
+        i = bisect_left(sorted_list, key)
+        if i < len(sorted_list) and sorted_list[i] == key:
+            del sorted_list[i]
+
+    def query(self, status=None, location=None, environment=None, name_prefix=None,
+              min_drift=None, max_drift=None, sort='name', descending=False, offset=0, limit=None):
+        """(total matches, one page of server dicts)"""
+        if sort not in SORT_FIELDS:
+            raise ValueError(f'cannot sort by {sort!r}; choose from {", ".join(SORT_FIELDS)}')
+        with self._lock:
+            candidates = []
+            for field, value in (('status', status), ('location', location), ('environment', environment)):
+                if value is not None:
+                    candidates.append(self.hashes[field].get(value, set()))
+            if name_prefix:
+                lo = bisect_left(self.names, (name_prefix,))
+                hi = bisect_left(self.names, (name_prefix + '\U0010ffff',))
+                candidates.append({server_id for _, server_id in self.names[lo:hi]})
+            if min_drift is not None or max_drift is not None:
+                lo, hi = 0, len(self.drifts)
+                if min_drift is not None:
+                    lo = bisect_left(self.drifts, (min_drift,))
+                if max_drift is not None:
+                    hi = bisect_right(self.drifts, (max_drift, float('inf')))
+                candidates.append({server_id for _, server_id in self.drifts[lo:hi]})
+
+            if candidates:
+                candidates.sort(key=len)
+                ids = candidates[0].intersection(*candidates[1:])
+                matches = [self.servers[server_id] for server_id in ids]
+            elif sort == 'name':
+                # The name index is already in order
+                matches = [self.servers[server_id] for _, server_id in self.names]
+            else:
+                matches = list(self.servers.values())
+
+        if candidates or sort != 'name':
+            matches.sort(key=sort_key(sort))
+        if descending:
+            matches.reverse()
+        end = None if limit is None else offset + limit
+        return len(matches), matches[offset:end]
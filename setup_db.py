@@ -1,55 +1,37 @@
+import os
 import sqlite3
 import random
+import socket
 import datetime
 import time
+import schema
+from alert_rules import RuleEngine
+from ingest import IngestWriter
+
+# Backfilled and live samples are written under the same host, as collector.ProcCollector names it
+HOSTNAME = socket.gethostname()
 
 def init_database():
     """Initialize the database and create tables"""
     conn = sqlite3.connect('monitoring.db')
     cursor = conn.cursor()
     
-    # Create system metrics table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS system_metrics (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            hostname TEXT,
-            cpu_percent REAL,
-            memory_percent REAL,
-            memory_used INTEGER,
-            memory_total INTEGER,
-            disk_percent REAL,
-            disk_used INTEGER,
-            disk_total INTEGER,
-            process_count INTEGER,
-            uptime_seconds INTEGER,
-            temperature REAL,
-            load_average_1min REAL,
-            load_average_5min REAL,
-            load_average_15min REAL
-        )
-    ''')
+    # Only takes effect on a new, empty database; see retention.py for old ones
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    
+    # WAL is persistent, so the dashboard can read while we write
+    cursor.execute('PRAGMA journal_mode = WAL').fetchone()
     
-    # Create alerts table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            severity TEXT,
-            metric TEXT,
-            value REAL,
-            threshold REAL,
-            message TEXT
-        )
-    ''')
+    # Create or upgrade the tables to the latest schema version
+    for version, description in schema.migrate(conn):
+        print(f"Applied schema migration {version}: {description}")
     
     conn.commit()
     conn.close()
     print("Database initialized successfully!")
 
-def generate_sample_data():
+def generate_sample_data(hostname=HOSTNAME):
     """Generate sample monitoring data"""
-    hostname = "linux-server-01"
     
     # Generate realistic looking metrics with some variation
     cpu = random.uniform(10, 60)
@@ -61,15 +43,12 @@ def generate_sample_data():
     load5 = random.uniform(0.5, 3.5)
     load15 = random.uniform(0.5, 3.0)
     
-    # Occasionally spike CPU or memory
+    # Occasionally spike CPU or memory; alert_rules raises the alerts
     if random.random() < 0.1:  # 10% chance of spike
         cpu = random.uniform(80, 95)
-        # Create an alert for high CPU
-        create_alert('WARNING', 'cpu_percent', cpu, 80, f"High CPU usage detected: {cpu:.1f}%")
     
     if random.random() < 0.05:  # 5% chance of high memory
         memory = random.uniform(85, 95)
-        create_alert('CRITICAL', 'memory_percent', memory, 90, f"Critical memory usage: {memory:.1f}%")
     
     return {
         'hostname': hostname,
@@ -88,47 +67,50 @@ def generate_sample_data():
         'load_average_15min': round(load15, 2)
     }
 
-def create_alert(severity, metric, value, threshold, message):
-    """Insert an alert into the database"""
-    conn = sqlite3.connect('monitoring.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO alerts (severity, metric, value, threshold, message)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (severity, metric, value, threshold, message))
-    conn.commit()
-    conn.close()
+_writer = None
+
+def get_writer():
+    """Shared buffered writer used by insert_metrics() and create_alert()"""
+    global _writer
+    if _writer is None:
+        _writer = IngestWriter('monitoring.db', rules=RuleEngine())
+    return _writer
+
+def create_alert(severity, metric, value, threshold, message, hostname=None):
+    """Queue an alert for the next batched write"""
+    get_writer().add_alert(severity, metric, value, threshold, message, hostname=hostname)
 
 def insert_metrics(metrics):
-    """Insert metrics into the database"""
-    conn = sqlite3.connect('monitoring.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO system_metrics (
-            hostname, cpu_percent, memory_percent, memory_used, memory_total,
-            disk_percent, disk_used, disk_total, process_count, uptime_seconds,
-            temperature, load_average_1min, load_average_5min, load_average_15min
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        metrics['hostname'], metrics['cpu_percent'], metrics['memory_percent'],
-        metrics['memory_used'], metrics['memory_total'], metrics['disk_percent'],
-        metrics['disk_used'], metrics['disk_total'], metrics['process_count'],
-        metrics['uptime_seconds'], metrics['temperature'], metrics['load_average_1min'],
-        metrics['load_average_5min'], metrics['load_average_15min']
-    ))
-    
-    conn.commit()
-    conn.close()
+    """Queue metrics for the next batched write"""
+    get_writer().add_metrics(metrics)
+
+def historical_samples(points, interval_minutes=5):
+    """Yield points samples spaced interval_minutes apart, ending now"""
+    now = int(time.time())
+    for i in range(points):
+        metrics = generate_sample_data()
+        metrics['ts'] = now - (points - i) * interval_minutes * 60
+        yield metrics
+
+def backfill_history(points=20, interval_minutes=5):
+    """Bulk load past samples, one transaction per chunk"""
+    started = time.perf_counter()
+    loaded = get_writer().bulk_load(historical_samples(points, interval_minutes))
+    print(f"Loaded {loaded} historical samples in {time.perf_counter() - started:.2f}s")
 
 def populate_data(duration_minutes=5, interval_seconds=30):
-    """Populate the database with sample data over a time period"""
+    """Populate the database with live metrics (random ones off Linux) over a time period"""
     print(f"Populating database with {duration_minutes} minutes of data at {interval_seconds}s intervals...")
     
+    collector = None
+    if os.path.exists('/proc/stat'):
+        from collector import ProcCollector
+        collector = ProcCollector(hostname=HOSTNAME)
+    
     end_time = datetime.datetime.now() + datetime.timedelta(minutes=duration_minutes)
     
     while datetime.datetime.now() < end_time:
-        metrics = generate_sample_data()
+        metrics = collector.sample() if collector else generate_sample_data()
         insert_metrics(metrics)
         
         timestamp = datetime.datetime.now().strftime("%H:%M:%S")
@@ -137,6 +119,8 @@ def populate_data(duration_minutes=5, interval_seconds=30):
         
         time.sleep(interval_seconds)
     
+    if collector:
+        collector.close()
     print("Data population complete!")
 
 if __name__ == "__main__":
@@ -145,28 +129,11 @@ if __name__ == "__main__":
     
     # Populate with some initial historical data
     print("Generating historical data...")
-    for i in range(20):  # Generate 20 data points with timestamps in the past
-        metrics = generate_sample_data()
-        # Adjust timestamp to be in the past
-        past_time = datetime.datetime.now() - datetime.timedelta(minutes=(20-i)*5)
-        conn = sqlite3.connect('monitoring.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO system_metrics (
-                timestamp, hostname, cpu_percent, memory_percent, memory_used, memory_total,
-                disk_percent, disk_used, disk_total, process_count, uptime_seconds,
-                temperature, load_average_1min, load_average_5min, load_average_15min
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            past_time, metrics['hostname'], metrics['cpu_percent'], metrics['memory_percent'],
-            metrics['memory_used'], metrics['memory_total'], metrics['disk_percent'],
-            metrics['disk_used'], metrics['disk_total'], metrics['process_count'],
-            metrics['uptime_seconds'], metrics['temperature'], metrics['load_average_1min'],
-            metrics['load_average_5min'], metrics['load_average_15min']
-        ))
-        conn.commit()
-        conn.close()
+    backfill_history(points=20, interval_minutes=5)
     
     print("Starting real-time data population...")
     # Then start real-time data population
-    populate_data(duration_minutes=30, interval_seconds=10)
\ No newline at end of file
+    try:
+        populate_data(duration_minutes=30, interval_seconds=10)
+    finally:
+        get_writer().close()
\ No newline at end of file
@@ -0,0 +1,309 @@
+"""In-memory per-server time series for grid.py.
+
+Each server keeps fixed-size ring buffers, one array('d') for the sample
+times and one per field (drift, response time, cpu, memory, disk). NULLs
+are stored as NaN. Appends are O(1); a sample older than the newest one
+held (a manual check racing a sweep) is inserted in time order instead, so
+the ring stays sorted. A history read finds its start with a bisect over
+the ring and copies out only the points it returns.
+
+All series share one memory budget. When a new server would push the total
+over it, every ring shrinks to fit and keeps its most recent points (but
+never below MIN_POINTS). Each
+series remembers the newest time it has dropped, so a range read that
+reaches further back returns None and the caller can go to sqlite instead.
+"""
+import datetime
+import math
+import operator
+import threading
+import time
+from array import array
+
+FIELDS = ('ntp_drift', 'response_time', 'cpu_usage', 'memory_usage', 'disk_usage')
+POINTS_PER_SERVER = 2880  # 24h at a 30s sweep interval
+MEMORY_BUDGET = 64 * 1024 * 1024  # bytes across all servers
+MIN_POINTS = 16
+NAN = float('nan')
+
+
+def parse_timestamp(value):
+    """Epoch seconds of a server_metrics timestamp (naive, treated as UTC)"""
+    return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def format_timestamp(ts):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))
+
+
+class Series:
+    """Ring buffers of one server's samples, oldest at `start`"""
+
+    __slots__ = ('times', 'columns', 'start', 'count', 'dropped')
+
+    def __init__(self, capacity, fields, dropped):
+        self.times = array('d', bytes(8 * capacity))
+        self.columns = [array('d', bytes(8 * capacity)) for _ in fields]
+        self.start = 0
+        self.count = 0
+        self.dropped = dropped  # newest sample time no longer held
+
+    def append(self, ts, values):
+        capacity = len(self.times)
+        if self.count and ts < self.times[(self.start + self.count - 1) % capacity]:
+            self._insert(ts, values)
+            return
+        if self.count == capacity:
+            position = self.start
+            self.dropped = max(self.dropped, self.times[position])
+            self.start = (self.start + 1) % capacity
+        else:
+            position = (self.start + self.count) % capacity
+            self.count += 1
+        self.times[position] = ts
+        for column, value in zip(self.columns, values):
+            column[position] = NAN if value is None else value
+
+    def _insert(self, ts, values):
+        """Place a late sample after every sample with time <= ts"""
+        capacity, times = len(self.times), self.times
+        index = self.first_at_or_after(ts)
+        while index < self.count and times[(self.start + index) % capacity] == ts:
+            index += 1
+        if self.count == capacity:
+            if index == 0:
+                # Older than everything held: it counts as already dropped
+                self.dropped = max(self.dropped, ts)
+                return
+            self.dropped = max(self.dropped, times[self.start])
+            self.start = (self.start + 1) % capacity
+            self.count -= 1
+            index -= 1
+        for i in range(self.count, index, -1):
+            target, source = (self.start + i) % capacity, (self.start + i - 1) % capacity
+            times[target] = times[source]
+            for column in self.columns:
+                column[target] = column[source]
+        position = (self.start + index) % capacity
+        times[position] = ts
+        for column, value in zip(self.columns, values):
+            column[position] = NAN if value is None else value
+        self.count += 1
+
+    def first_at_or_after(self, ts):
+        """Logical index of the first sample with time >= ts"""
+        capacity, times = len(self.times), self.times
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if times[(self.start + mid) % capacity] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def points(self, first, column):
+        """(time, value) from logical index first onwards, NaN values skipped"""
+        capacity, times, values = len(self.times), self.times, self.columns[column]
+        out = []
+        for i in range(first, self.count):
+            position = (self.start + i) % capacity
+            value = values[position]
+            if value == value:
+                out.append((times[position], value))
+        return out
+
+    def resized(self, capacity, fields):
+        """Copy holding the most recent `capacity` samples"""
+        keep = min(self.count, capacity)
+        series = Series(capacity, fields, self.dropped)
+        old_capacity = len(self.times)
+        for i in range(self.count - keep):
+            series.dropped = max(series.dropped, self.times[(self.start + i) % old_capacity])
+        for i in range(self.count - keep, self.count):
+            position = (self.start + i) % old_capacity
+            series.append(self.times[position], [column[position] for column in self.columns])
+        return series
+
+
+class TimeSeriesStore:
+    """Ring-buffer series keyed by server_id under a shared memory budget"""
+
+    def __init__(self, points=POINTS_PER_SERVER, memory_budget=MEMORY_BUDGET, fields=FIELDS):
+        self.fields = fields
+        self.field_index = {field: i for i, field in enumerate(fields)}
+        self.point_bytes = 8 * (1 + len(fields))
+        self.points = points
+        self.memory_budget = memory_budget
+        self.capacity = self._capacity_for(1)
+        self.series = {}
+        self.warmed_from = None  # every sample at or after this time is held (until dropped)
+        self._lock = threading.Lock()
+
+    def _capacity_for(self, servers):
+        return max(MIN_POINTS, min(self.points, self.memory_budget // (self.point_bytes * max(servers, 1))))
+
+    def _series(self, server_id):
+        series = self.series.get(server_id)
+        if series is None:
+            if self._capacity_for(len(self.series) + 1) < self.capacity:
+                # Shrink for twice as many servers so growing fleets resize rarely
+                self._resize(self._capacity_for(2 * (len(self.series) + 1)))
+            dropped = self.warmed_from - 1 if self.warmed_from is not None else math.inf
+            series = self.series[server_id] = Series(self.capacity, self.fields, dropped)
+        return series
+
+    def _resize(self, capacity):
+        self.capacity = capacity
+        for key, existing in self.series.items():
+            self.series[key] = existing.resized(capacity, self.fields)
+
+    def append(self, server_id, ts, row):
+        """Add one sample; row maps field names to values (missing fields are NULL)"""
+        with self._lock:
+            self._series(server_id).append(ts, [row.get(field) for field in self.fields])
+
+    def append_many(self, ts, rows):
+        """Add one sweep: rows of dicts with 'id' (or 'server_id') and field values"""
+        with self._lock:
+            for row in rows:
+                server_id = row['server_id'] if 'server_id' in row else row['id']
+                self._series(server_id).append(ts, [row.get(field) for field in self.fields])
+
+    def warm(self, conn, hours=24):
+        """Load the last `hours` of server_metrics; earlier appends newer than the database are kept"""
+        started = time.time() - hours * 3600
+        rows = conn.execute(f'''
+            SELECT server_id, timestamp, {', '.join(self.fields)} FROM server_metrics
+            WHERE timestamp >= ?
+            ORDER BY server_id, timestamp, id
+        ''', (format_timestamp(started),)).fetchall()
+        with self._lock:
+            live = self.series
+            self.series = {}
+            self.warmed_from = started
+            self.capacity = self._capacity_for(len({row[0] for row in rows} | set(live)))
+            for row in rows:
+                self._series(row[0]).append(parse_timestamp(row[1]), row[2:])
+            for server_id, series in live.items():
+                target = self._series(server_id)
+                newest = -math.inf
+                if target.count:
+                    newest = target.times[(target.start + target.count - 1) % len(target.times)]
+                capacity = len(series.times)
+                for i in range(series.count):
+                    position = (series.start + i) % capacity
+                    if series.times[position] > newest:
+                        target.append(series.times[position], [column[position] for column in series.columns])
+        return len(rows)
+
+    def server_ids(self):
+        with self._lock:
+            return list(self.series)
+
+    @property
+    def warmed(self):
+        return self.warmed_from is not None
+
+    def last(self, server_id, field, n, since=None):
+        """(times, values) of the last n non-NULL values of field, optionally only at or after since"""
+        with self._lock:
+            series = self.series.get(server_id)
+            if series is None:
+                return [], []
+            column = self.field_index[field]
+            first = series.first_at_or_after(since) if since is not None else 0
+            # Walk back from the newest sample until n values are found
+            capacity, times, values = len(series.times), series.times, series.columns[column]
+            out_times, out_values = [], []
+            for i in range(series.count - 1, first - 1, -1):
+                position = (series.start + i) % capacity
+                value = values[position]
+                if value == value:
+                    out_times.append(times[position])
+                    out_values.append(value)
+                    if len(out_values) == n:
+                        break
+        out_times.reverse()
+        out_values.reverse()
+        return out_times, out_values
+
+    def covers(self, since, server_id=None):
+        """True if every sample at or after since is in memory"""
+        with self._lock:
+            if not self.warmed or since < self.warmed_from:
+                return False
+            if server_id is not None:
+                series = self.series.get(server_id)
+                return series is None or since > series.dropped
+            return all(since > series.dropped for series in self.series.values())
+
+    def window(self, since, field, server_id=None):
+        """[(time, server_id, value)] ordered by time, or None if not fully in memory"""
+        if not self.covers(since, server_id):
+            return None
+        column = self.field_index[field]
+        with self._lock:
+            if server_id is not None:
+                selected = [(server_id, self.series[server_id])] if server_id in self.series else []
+            else:
+                selected = sorted(self.series.items())
+            points = []
+            for key, series in selected:
+                points.extend([(ts, key, value)
+                               for ts, value in series.points(series.first_at_or_after(since), column)])
+        # Each server's run is already in time order, which timsort merges cheaply
+        points.sort(key=operator.itemgetter(0))
+        return points
+
+    def buckets(self, since, width, count, field, server_ids=None):
+        """{server_id: (mins, sums, maxes, counts)} over count buckets of width seconds from since.
+
+        Empty buckets hold None (0 in counts). Returns None if the window is
+        not fully in memory.
+        """
+        if server_ids is None:
+            if not self.covers(since):
+                return None
+        elif not all(self.covers(since, server_id) for server_id in server_ids):
+            return None
+        column = self.field_index[field]
+        out = {}
+        with self._lock:
+            selected = sorted(self.series) if server_ids is None else [
+                server_id for server_id in server_ids if server_id in self.series]
+            for server_id in selected:
+                series = self.series[server_id]
+                capacity, times, values = len(series.times), series.times, series.columns[column]
+                mins, sums, maxes, counts = [None] * count, [None] * count, [None] * count, [0] * count
+                for i in range(series.first_at_or_after(since), series.count):
+                    position = (series.start + i) % capacity
+                    value = values[position]
+                    if value != value:
+                        continue
+                    bucket = int((times[position] - since) // width)
+                    if bucket >= count:
+                        break
+                    if counts[bucket]:
+                        if value < mins[bucket]:
+                            mins[bucket] = value
+                        elif value > maxes[bucket]:
+                            maxes[bucket] = value
+                        sums[bucket] += value
+                    else:
+                        mins[bucket] = maxes[bucket] = sums[bucket] = value
+                    counts[bucket] += 1
+                if any(counts):
+                    out[server_id] = (mins, sums, maxes, counts)
+        return out
+
+    def stats(self):
+        with self._lock:
+            return {
+                'servers': len(self.series),
+                'capacity_per_server': self.capacity,
+                'points': sum(series.count for series in self.series.values()),
+                'bytes': len(self.series) * self.capacity * self.point_bytes,
+                'memory_budget': self.memory_budget,
+                'warmed_from': format_timestamp(self.warmed_from) if self.warmed else None,
+            }